@@ -1,52 +1,345 @@
 import azure.functions as func
 import logging
 import json
-import requests
+import io
 import os
-from datetime import datetime
+import re
+import queue
+import random
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import asyncio
+import atexit
+import bisect
+import contextvars
+import functools
+import gc
+import hashlib
+import heapq
+import math
+import unicodedata
+import zlib
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import date, datetime, timedelta
 from functools import lru_cache
 
+import numpy as np
+
 app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
 
 # Cache in-memory simples para otimização
 CACHE_SIZE = 128
 
+
+# ============ MEDIÇÃO DE TEMPO ============
+
+class MedicaoTempo:
+    """
+    Latência por etapa de uma requisição, com relógio monotônico (perf_counter_ns)
+
+    As etapas vêm de `etapa(nome)` (trecho delimitado) ou de `marcar(nome)`
+    (tempo desde o fim da etapa anterior); repetir o nome acumula a duração.
+    """
+
+    def __init__(self):
+        self.inicio_ns = time.perf_counter_ns()
+        self._ultimo_ns = self.inicio_ns
+        self.etapas = {}
+
+    def registrar(self, nome: str, duracao_ns: int) -> None:
+        self.etapas[nome] = self.etapas.get(nome, 0) + duracao_ns
+        self._ultimo_ns = time.perf_counter_ns()
+
+    @contextmanager
+    def etapa(self, nome: str):
+        inicio = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.registrar(nome, time.perf_counter_ns() - inicio)
+
+    def marcar(self, nome: str) -> None:
+        self.registrar(nome, time.perf_counter_ns() - self._ultimo_ns)
+
+    def total_ms(self) -> float:
+        return (time.perf_counter_ns() - self.inicio_ns) / 1e6
+
+    def duracoes_ms(self) -> dict:
+        """Etapas em ms na ordem em que apareceram, mais o total"""
+        duracoes = {nome: round(ns / 1e6, 3) for nome, ns in self.etapas.items()}
+        duracoes["total"] = round(self.total_ms(), 3)
+        return duracoes
+
+
+# Medição da requisição em andamento; cada tarefa asyncio (e asyncio.to_thread)
+# herda uma cópia do contexto, então operações de um lote não se misturam
+_medicao_atual = contextvars.ContextVar("medicao_atual", default=None)
+
+
+def medicao_atual() -> MedicaoTempo:
+    """Medição da requisição atual (uma nova, se chamada fora de um handler)"""
+    medicao = _medicao_atual.get()
+    if medicao is None:
+        medicao = MedicaoTempo()
+        _medicao_atual.set(medicao)
+    return medicao
+
+
+@contextmanager
+def etapa(nome: str):
+    """Mede o trecho como etapa da requisição atual (sem efeito fora de um handler)"""
+    medicao = _medicao_atual.get()
+    if medicao is None:
+        yield
+        return
+    with medicao.etapa(nome):
+        yield
+
+
+def marcar_etapa(nome: str) -> None:
+    """Atribui a `nome` o tempo desde o fim da última etapa da requisição atual"""
+    medicao = _medicao_atual.get()
+    if medicao is not None:
+        medicao.marcar(nome)
+
+
+def ler_json(req: func.HttpRequest):
+    """req.get_json() medido como etapa 'leitura'"""
+    with etapa("leitura"):
+        return req.get_json()
+
+
+def ler_inteiro(req_body: dict, campo: str, padrao: int, minimo: int, maximo: int) -> int:
+    """Campo inteiro do corpo, limitado a [minimo, maximo] (levanta ValueError se não for número)"""
+    try:
+        valor = int(req_body.get(campo, padrao))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"Campo '{campo}' deve ser um número inteiro")
+    return min(max(valor, minimo), maximo)
+
+
+def formatar_server_timing(duracoes: dict) -> str:
+    """Valor do cabeçalho Server-Timing (ex.: leitura;dur=0.041, total;dur=1.2)"""
+    return ", ".join(f"{nome};dur={ms}" for nome, ms in duracoes.items())
+
+
+def medir_tempo(handler):
+    """
+    Decorator dos handlers HTTP: abre a medição da requisição, devolve as
+    etapas no cabeçalho Server-Timing e registra-as como campos do log
+    """
+    rota = handler.__name__
+    
+    @functools.wraps(handler)
+    async def medido(req: func.HttpRequest) -> func.HttpResponse:
+        medicao = MedicaoTempo()
+        token = _medicao_atual.set(medicao)
+        _metricas.incrementar("estudai_requisicoes_em_andamento", rota=rota)
+        status_code = 500
+        try:
+            resposta = await handler(req)
+            status_code = resposta.status_code
+        finally:
+            _medicao_atual.reset(token)
+            _metricas.incrementar("estudai_requisicoes_em_andamento", -1, rota=rota)
+            _metricas.incrementar("estudai_requisicoes_total", rota=rota, status=str(status_code))
+            _metricas.observar("estudai_requisicao_duracao_segundos", medicao.total_ms() / 1000, rota=rota)
+        duracoes = medicao.duracoes_ms()
+        resposta.headers["Server-Timing"] = formatar_server_timing(duracoes)
+        logging.info(
+            f'Tempos de {rota}: ' + ", ".join(f"{nome}={ms}ms" for nome, ms in duracoes.items()),
+            extra={"rota": rota, "status_code": status_code, "tempos_ms": duracoes}
+        )
+        return resposta
+    return medido
+
+
+# ============ MÉTRICAS ============
+
+# Limites dos baldes de latência em segundos, em escala log-linear:
+# 1, 2, ..., 9 x 10^k de 100 µs a 10 s (erro relativo pequeno em toda a faixa)
+BALDES_LATENCIA = tuple(
+    round(m * 10.0 ** e, 6) for e in range(-4, 1) for m in range(1, 10)
+) + (10.0,)
+
+
+class RegistroMetricas:
+    """
+    Contadores, gauges e histogramas em memória, no formato texto do Prometheus
+
+    Cada thread incrementa o próprio fragmento (um dict só dela), então o
+    caminho quente não usa lock; a coleta soma os fragmentos de todas as
+    threads. Os rótulos de uma métrica devem vir sempre na mesma ordem.
+    Valores que só fazem sentido na hora da coleta (profundidade de filas,
+    acertos de caches) vêm de coletores registrados.
+    """
+
+    def __init__(self, baldes: tuple = BALDES_LATENCIA):
+        self.baldes = baldes
+        self._local = threading.local()
+        self._fragmentos = []
+        self._lock = threading.Lock()  # só para registrar fragmentos novos
+        self._descricoes = {}
+        self._coletores = []
+
+    def descrever(self, nome: str, tipo: str, ajuda: str) -> None:
+        """Tipo (counter, gauge, histogram) e texto de ajuda da métrica"""
+        self._descricoes[nome] = (tipo, ajuda)
+
+    def registrar_coletor(self, coletor) -> None:
+        """coletor() devolve (nome, rótulos, valor) calculados na hora da coleta"""
+        self._coletores.append(coletor)
+
+    def _fragmento(self) -> dict:
+        try:
+            return self._local.valores
+        except AttributeError:
+            valores = self._local.valores = {}
+            with self._lock:
+                self._fragmentos.append(valores)
+            return valores
+
+    def incrementar(self, nome: str, valor: float = 1, **rotulos) -> None:
+        """Soma `valor` ao contador (ou gauge, se negativo) com os rótulos dados"""
+        fragmento = self._fragmento()
+        chave = (nome, tuple(rotulos.items()))
+        fragmento[chave] = fragmento.get(chave, 0) + valor
+
+    def observar(self, nome: str, valor: float, **rotulos) -> None:
+        """Registra `valor` no histograma: contagem por balde (+Inf no fim) e soma"""
+        fragmento = self._fragmento()
+        chave = (nome, tuple(rotulos.items()))
+        histograma = fragmento.get(chave)
+        if histograma is None:
+            histograma = fragmento[chave] = [0] * (len(self.baldes) + 1) + [0.0]
+        histograma[bisect.bisect_left(self.baldes, valor)] += 1
+        histograma[-1] += valor
+
+    def coletar(self) -> dict:
+        """{(nome, rótulos): valor ou [contagens..., soma]} somando fragmentos e coletores"""
+        with self._lock:
+            fragmentos = list(self._fragmentos)
+        total = {}
+        for fragmento in fragmentos:
+            for chave, valor in list(fragmento.items()):
+                if isinstance(valor, list):
+                    atual = total.get(chave)
+                    total[chave] = list(valor) if atual is None else [a + b for a, b in zip(atual, valor)]
+                else:
+                    total[chave] = total.get(chave, 0) + valor
+        for coletor in self._coletores:
+            for nome, rotulos, valor in coletor():
+                chave = (nome, tuple(sorted(rotulos.items())))
+                total[chave] = total.get(chave, 0) + valor
+        return total
+
+    def texto_prometheus(self) -> str:
+        """Exposição no formato texto 0.0.4 do Prometheus"""
+        por_nome = defaultdict(list)
+        for (nome, rotulos), valor in sorted(self.coletar().items()):
+            por_nome[nome].append((rotulos, valor))
+        linhas = []
+        for nome, amostras in por_nome.items():
+            tipo, ajuda = self._descricoes.get(nome, ("untyped", ""))
+            linhas.append(f"# HELP {nome} {ajuda}")
+            linhas.append(f"# TYPE {nome} {tipo}")
+            for rotulos, valor in amostras:
+                if not isinstance(valor, list):
+                    linhas.append(f"{nome}{_formatar_rotulos(rotulos)} {_formatar_valor(valor)}")
+                    continue
+                acumulado = 0
+                for limite, contagem in zip(self.baldes + (float("inf"),), valor):
+                    acumulado += contagem
+                    le = "+Inf" if limite == float("inf") else repr(limite)
+                    linhas.append(f"{nome}_bucket{_formatar_rotulos(rotulos + (('le', le),))} {acumulado}")
+                linhas.append(f"{nome}_sum{_formatar_rotulos(rotulos)} {_formatar_valor(valor[-1])}")
+                linhas.append(f"{nome}_count{_formatar_rotulos(rotulos)} {acumulado}")
+        return "\n".join(linhas) + "\n"
+
+
+def _formatar_rotulos(rotulos: tuple) -> str:
+    if not rotulos:
+        return ""
+    pares = (
+        f'{chave}="' + str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for chave, valor in rotulos
+    )
+    return "{" + ",".join(pares) + "}"
+
+
+def _formatar_valor(valor) -> str:
+    return str(valor) if isinstance(valor, int) else repr(float(valor))
+
+
+def _coletar_caches():
+    """Consultas, acertos e taxa de acerto dos caches da instância"""
+    caches = {
+        "busca": simular_busca.cache_info(),
+        "resumo": _resumo_memorizado.cache_info(),
+        "projecao": compilar_projecao.cache_info(),
+        "corpo_erro": corpo_erro.cache_info(),
+    }
+    contagens = {nome: (info.hits, info.misses) for nome, info in caches.items()}
+    contagens["dashboard"] = (_cache_dashboard.acertos, _cache_dashboard.falhas)
+    contagens["etag"] = (_validadores_etag.acertos, _validadores_etag.falhas)
+    for cache, (acertos, falhas) in contagens.items():
+        yield "estudai_cache_consultas_total", {"cache": cache, "resultado": "acerto"}, acertos
+        yield "estudai_cache_consultas_total", {"cache": cache, "resultado": "falha"}, falhas
+        yield "estudai_cache_taxa_acerto", {"cache": cache}, acertos / (acertos + falhas) if acertos + falhas else 0.0
+
+
+def _coletar_filas():
+    """Sessões aguardando gravação na fila de progresso"""
+    profundidade = _fila_progresso.profundidade() if _fila_progresso is not None else 0
+    yield "estudai_fila_profundidade", {"fila": "progresso"}, profundidade
+
+
+_metricas = RegistroMetricas()
+_metricas.descrever("estudai_requisicoes_total", "counter", "Requisições atendidas por rota e status HTTP")
+_metricas.descrever("estudai_requisicoes_em_andamento", "gauge", "Requisições em execução por rota")
+_metricas.descrever("estudai_requisicao_duracao_segundos", "histogram", "Latência das requisições por rota")
+_metricas.descrever("estudai_busca_externa_total", "counter", "Chamadas às fontes de busca por resultado (sucesso, falha, timeout)")
+_metricas.descrever("estudai_busca_externa_duracao_segundos", "histogram", "Latência das chamadas às fontes de busca")
+_metricas.descrever("estudai_cache_consultas_total", "counter", "Consultas aos caches por resultado (acerto, falha)")
+_metricas.descrever("estudai_cache_taxa_acerto", "gauge", "Fração das consultas ao cache que foram acertos")
+_metricas.descrever("estudai_fila_profundidade", "gauge", "Itens aguardando nas filas internas")
+_metricas.registrar_coletor(_coletar_caches)
+_metricas.registrar_coletor(_coletar_filas)
+
+
 @app.route(route="buscar")
-def buscar_web(req: func.HttpRequest) -> func.HttpResponse:
+@medir_tempo
+async def buscar_web(req: func.HttpRequest) -> func.HttpResponse:
     """
     Função que busca informações na web usando simulação inteligente
     """
-    start_time = datetime.now()
-    logging.info(f'[{start_time}] Função de busca web acionada')
+    logging.info('Função de busca web acionada')
 
     try:
         # Obter parâmetros da requisição com validação
-        req_body = req.get_json()
+        req_body = ler_json(req)
+        try:
+            projecao = obter_projecao(req, req_body)
+        except ValueError as e:
+            return resposta_erro("Campo 'fields' inválido", str(e))
         
         # Validação: query é obrigatória
         query = req_body.get('query', '').strip()
         if not query:
             logging.warning('Query vazia recebida')
-            return func.HttpResponse(
-                json.dumps({
-                    "erro": "Query não fornecida ou vazia",
-                    "mensagem": "Por favor, forneça um termo de busca válido"
-                }, ensure_ascii=False),
-                status_code=400,
-                mimetype="application/json"
+            return resposta_erro(
+                "Query não fornecida ou vazia", "Por favor, forneça um termo de busca válido"
             )
         
         # Validação: query não pode ser muito longa
         if len(query) > 200:
             logging.warning(f'Query muito longa: {len(query)} caracteres')
-            return func.HttpResponse(
-                json.dumps({
-                    "erro": "Query muito longa",
-                    "mensagem": "Limite de 200 caracteres"
-                }, ensure_ascii=False),
-                status_code=400,
-                mimetype="application/json"
-            )
+            return resposta_erro("Query muito longa", "Limite de 200 caracteres")
         
         # Validação: max_results
         max_results = req_body.get('max_results', 5)
@@ -55,12 +348,13 @@ def buscar_web(req: func.HttpRequest) -> func.HttpResponse:
             max_results = 5  # Default
         
         logging.info(f'Buscando: "{query}" (max_results: {max_results})')
+        marcar_etapa("validacao")
         
         # Buscar resultados reais (DuckDuckGo + Wikipedia + fallback simulação)
-        resultados = buscar_web_real(query, max_results)
+        resultados = await buscar_web_real(query, max_results)
         
         # Calcular tempo de resposta
-        elapsed = (datetime.now() - start_time).total_seconds() * 1000
+        elapsed = medicao_atual().total_ms()
         
         response_data = {
             "query": query,
@@ -72,43 +366,31 @@ def buscar_web(req: func.HttpRequest) -> func.HttpResponse:
         
         logging.info(f'Busca concluída: {len(resultados)} resultados em {elapsed:.2f}ms')
         
-        return func.HttpResponse(
-            json.dumps(response_data, ensure_ascii=False),
-            status_code=200,
-            mimetype="application/json"
-        )
+        return resposta_json(response_data, req=req, projecao=projecao)
         
     except ValueError as e:
         logging.error(f"Erro de validação JSON: {str(e)}")
-        return func.HttpResponse(
-            json.dumps({
-                "erro": "JSON inválido",
-                "mensagem": "O corpo da requisição deve ser um JSON válido"
-            }, ensure_ascii=False),
-            status_code=400,
-            mimetype="application/json"
-        )
+        return resposta_erro("JSON inválido", "O corpo da requisição deve ser um JSON válido")
     except Exception as e:
         logging.error(f"Erro inesperado: {str(e)}", exc_info=True)
-        return func.HttpResponse(
-            json.dumps({
-                "erro": "Erro interno do servidor",
-                "mensagem": "Ocorreu um erro ao processar sua requisição"
-            }, ensure_ascii=False),
-            status_code=500,
-            mimetype="application/json"
+        return resposta_erro(
+            "Erro interno do servidor", "Ocorreu um erro ao processar sua requisição", status_code=500
         )
 
 @app.route(route="gerar-cronograma")
-def gerar_cronograma(req: func.HttpRequest) -> func.HttpResponse:
+@medir_tempo
+async def gerar_cronograma(req: func.HttpRequest) -> func.HttpResponse:
     """
     Gera um cronograma personalizado de estudos
     """
-    start_time = datetime.now()
-    logging.info(f'[{start_time}] Função de geração de cronograma acionada')
+    logging.info('Função de geração de cronograma acionada')
     
     try:
-        req_body = req.get_json()
+        req_body = ler_json(req)
+        try:
+            projecao = obter_projecao(req, req_body)
+        except ValueError as e:
+            return resposta_erro("Campo 'fields' inválido", str(e))
         
         # Validar parâmetros
         materias = req_body.get('materias', [])
@@ -118,14 +400,7 @@ def gerar_cronograma(req: func.HttpRequest) -> func.HttpResponse:
         
         # Validações
         if not materias or not isinstance(materias, list):
-            return func.HttpResponse(
-                json.dumps({
-                    "erro": "Lista de matérias inválida",
-                    "mensagem": "Forneça uma lista de matérias para estudar"
-                }, ensure_ascii=False),
-                status_code=400,
-                mimetype="application/json"
-            )
+            return resposta_erro("Lista de matérias inválida", "Forneça uma lista de matérias para estudar")
         
         if dias_semana < 1 or dias_semana > 7:
             dias_semana = 5
@@ -133,12 +408,25 @@ def gerar_cronograma(req: func.HttpRequest) -> func.HttpResponse:
         if horas_dia < 1 or horas_dia > 12:
             horas_dia = 3
         
+        marcar_etapa("validacao")
+        
+        # Cronograma é função só da entrada: cliente com o ETag atual recebe 304
+        chave = chave_condicional("gerar-cronograma", materias, dias_semana, horas_dia, prioridades, projecao)
+        nao_modificado = resposta_nao_modificada(req, chave)
+        if nao_modificado is not None:
+            return nao_modificado
+        
         logging.info(f'Gerando cronograma: {len(materias)} matérias, {dias_semana} dias, {horas_dia}h/dia')
         
         # Gerar cronograma
-        cronograma = criar_cronograma(materias, dias_semana, horas_dia, prioridades)
+        # Dicas só são geradas se fizerem parte dos campos pedidos
+        com_dicas = campo_solicitado(projecao, "cronograma", "sessoes", "dica")
+        cronograma = await asyncio.to_thread(
+            criar_cronograma, materias, dias_semana, horas_dia, prioridades, com_dicas
+        )
+        marcar_etapa("geracao")
         
-        elapsed = (datetime.now() - start_time).total_seconds() * 1000
+        elapsed = medicao_atual().total_ms()
         
         response_data = {
             "cronograma": cronograma,
@@ -154,34 +442,16 @@ def gerar_cronograma(req: func.HttpRequest) -> func.HttpResponse:
         
         logging.info(f'Cronograma gerado em {elapsed:.2f}ms')
         
-        return func.HttpResponse(
-            json.dumps(response_data, ensure_ascii=False, indent=2),
-            status_code=200,
-            mimetype="application/json"
-        )
+        return resposta_condicional(req, chave, response_data, projecao)
         
     except ValueError as e:
         logging.error(f"Erro de validação JSON: {str(e)}")
-        return func.HttpResponse(
-            json.dumps({
-                "erro": "JSON inválido",
-                "mensagem": "O corpo da requisição deve ser um JSON válido"
-            }, ensure_ascii=False),
-            status_code=400,
-            mimetype="application/json"
-        )
+        return resposta_erro("JSON inválido", "O corpo da requisição deve ser um JSON válido")
     except Exception as e:
         logging.error(f"Erro inesperado: {str(e)}", exc_info=True)
-        return func.HttpResponse(
-            json.dumps({
-                "erro": "Erro interno",
-                "mensagem": "Erro ao gerar cronograma"
-            }, ensure_ascii=False),
-            status_code=500,
-            mimetype="application/json"
-        )
+        return resposta_erro("Erro interno", "Erro ao gerar cronograma", status_code=500)
 
-def criar_cronograma(materias, dias_semana, horas_dia, prioridades):
+def criar_cronograma(materias, dias_semana, horas_dia, prioridades, com_dicas=True):
     """
     Cria um cronograma distribuído de forma inteligente
     """
@@ -214,12 +484,14 @@ def criar_cronograma(materias, dias_semana, horas_dia, prioridades):
             horas_materia = round(horas_materia * 2) / 2
             
             if horas_materia > 0:
-                sessoes.append({
+                sessao = {
                     "materia": materia,
                     "duracao_horas": horas_materia,
-                    "prioridade": pesos[materia],
-                    "dica": gerar_dica_estudo(materia, horas_materia)
-                })
+                    "prioridade": pesos[materia]
+                }
+                if com_dicas:
+                    sessao["dica"] = gerar_dica_estudo(materia, horas_materia)
+                sessoes.append(sessao)
                 horas_restantes -= horas_materia
         
         cronograma.append({
@@ -234,12 +506,6 @@ def gerar_dica_estudo(materia, horas):
     """
     Gera dica personalizada baseada na matéria e duração
     """
-    dicas_gerais = {
-        "curta": "Sessão rápida: foco em revisão e exercícios",
-        "media": "Tempo ideal para: teoria + prática + revisão",
-        "longa": "Sessão extensa: aprofunde conceitos e faça muitos exercícios"
-    }
-    
     if horas <= 1:
         tipo = "curta"
     elif horas <= 2:
@@ -247,27 +513,93 @@ def gerar_dica_estudo(materia, horas):
     else:
         tipo = "longa"
     
-    dica_base = dicas_gerais[tipo]
-    
-    # Dicas específicas por matéria
-    dicas_especificas = {
-        "matematica": "Use muitos exercícios práticos",
-        "fisica": "Desenhe diagramas e esquemas",
-        "quimica": "Revise reações e faça resumos",
-        "historia": "Crie linhas do tempo",
-        "portugues": "Leia e pratique redação",
-        "biologia": "Use mapas mentais"
-    }
+    dica_base = DICAS_GERAIS[tipo]
     
-    materia_lower = materia.lower()
-    for key in dicas_especificas:
-        if key in materia_lower:
-            return f"{dica_base}. {dicas_especificas[key]}"
+    # Dicas específicas por matéria (chaves já sem acentos)
+    materia_norm = normalizar_texto(materia)
+    for chave, dica in DICAS_ESPECIFICAS:
+        if chave in materia_norm:
+            return f"{dica_base}. {dica}"
     
     return dica_base
 
 
-def buscar_web_real(query: str, max_results: int = 5):
+# Cliente HTTP assíncrono compartilhado (um por event loop)
+BUSCA_TIMEOUT_SEGUNDOS = 10
+_sessao_http = None
+
+
+async def obter_sessao_http() -> "aiohttp.ClientSession":
+    """
+    Sessão aiohttp do event loop atual, reaproveitando conexões entre
+    buscas; recriada se o loop mudou (ex.: testes com asyncio.run)
+    """
+    # Importado só na primeira busca: aiohttp (e o contexto SSL que ele
+    # cria) custa mais de 100 ms no cold start das rotas que não usam rede
+    import aiohttp
+    global _sessao_http
+    loop = asyncio.get_running_loop()
+    if _sessao_http is None or _sessao_http[0] is not loop or _sessao_http[1].closed:
+        anterior = _sessao_http
+        sessao = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=BUSCA_TIMEOUT_SEGUNDOS))
+        _sessao_http = (loop, sessao)
+        if anterior is not None and not anterior[1].closed:
+            # A sessão do loop anterior nunca mais é usada: fechá-la evita o
+            # vazamento das conexões e o aviso "Unclosed client session"
+            loop_anterior, sessao_anterior = anterior
+            if loop_anterior.is_running():
+                asyncio.run_coroutine_threadsafe(sessao_anterior.close(), loop_anterior)
+            else:
+                try:
+                    await sessao_anterior.close()
+                except Exception as e:
+                    logging.warning(f"Erro ao fechar a sessão HTTP anterior: {str(e)}")
+    return _sessao_http[1]
+
+
+def _fechar_sessao_http() -> None:
+    """Fecha a sessão aiohttp no encerramento do worker (registrado no atexit)"""
+    global _sessao_http
+    if _sessao_http is None:
+        return
+    loop, sessao = _sessao_http
+    _sessao_http = None
+    if sessao.closed:
+        return
+    try:
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(sessao.close(), loop).result(timeout=BUSCA_TIMEOUT_SEGUNDOS)
+        else:
+            asyncio.run(sessao.close())
+    except Exception as e:
+        logging.warning(f"Erro ao fechar a sessão HTTP: {str(e)}")
+
+
+atexit.register(_fechar_sessao_http)
+
+
+@contextmanager
+def chamada_externa(fonte: str):
+    """
+    Etapa 'busca-<fonte>' da requisição, mais contagem por resultado
+    (sucesso, falha, timeout) e latência da fonte nas métricas
+    """
+    inicio = time.perf_counter_ns()
+    resultado = "falha"
+    try:
+        with etapa(f"busca-{fonte}"):
+            yield
+        resultado = "sucesso"
+    except asyncio.TimeoutError:
+        resultado = "timeout"
+        raise
+    finally:
+        _metricas.incrementar("estudai_busca_externa_total", fonte=fonte, resultado=resultado)
+        _metricas.observar("estudai_busca_externa_duracao_segundos",
+                           (time.perf_counter_ns() - inicio) / 1e9, fonte=fonte)
+
+
+async def buscar_web_real(query: str, max_results: int = 5):
     """
     Busca real usando DuckDuckGo API + Wikipedia (100% grátis)
     Estratégia em camadas: DuckDuckGo → Wikipedia → Simulação
@@ -283,9 +615,12 @@ def buscar_web_real(query: str, max_results: int = 5):
         }
         
         logging.info(f"Buscando em DuckDuckGo: {query}")
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        with chamada_externa("duckduckgo"):
+            sessao = await obter_sessao_http()
+            async with sessao.get(url, params=params) as response:
+                response.raise_for_status()
+                # A API responde com content-type application/x-javascript
+                data = await response.json(content_type=None)
         
         resultados = []
         
@@ -311,7 +646,7 @@ def buscar_web_real(query: str, max_results: int = 5):
         # Se não encontrou resultados, fazer busca alternativa
         if not resultados:
             logging.warning(f"DuckDuckGo sem resultados para: {query}")
-            return buscar_wikipedia(query, max_results)
+            return await buscar_wikipedia(query, max_results)
         
         logging.info(f"DuckDuckGo retornou {len(resultados)} resultados")
         return resultados[:max_results]
@@ -319,10 +654,10 @@ def buscar_web_real(query: str, max_results: int = 5):
     except Exception as e:
         logging.error(f"Erro DuckDuckGo: {str(e)}")
         # Tentar Wikipedia como fallback
-        return buscar_wikipedia(query, max_results)
+        return await buscar_wikipedia(query, max_results)
 
 
-def buscar_wikipedia(query: str, max_results: int = 5):
+async def buscar_wikipedia(query: str, max_results: int = 5):
     """
     Busca na Wikipedia em português (fallback gratuito)
     """
@@ -342,9 +677,11 @@ def buscar_wikipedia(query: str, max_results: int = 5):
         }
         
         logging.info(f"Buscando na Wikipedia: {query}")
-        response = requests.get(url, params=params, headers=headers, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        with chamada_externa("wikipedia"):
+            sessao = await obter_sessao_http()
+            async with sessao.get(url, params=params, headers=headers) as response:
+                response.raise_for_status()
+                data = await response.json(content_type=None)
         
         resultados = []
         if len(data) >= 4:
@@ -383,209 +720,24 @@ def simular_busca(query: str, max_results: int):
     """
     logging.info(f'simular_busca chamada para: "{query}"')
     
-    # Base de conhecimento simulada para diferentes tópicos de estudo
-    base_conhecimento = {
-        "matematica": [
-            {
-                "titulo": "Khan Academy - Matemática",
-                "url": "https://pt.khanacademy.org/math",
-                "snippet": "Aprenda matemática gratuitamente com vídeos e exercícios interativos"
-            },
-            {
-                "titulo": "Técnicas de Estudo para Matemática",
-                "url": "https://exemplo.com/tecnicas-matematica",
-                "snippet": "Pratique regularmente, entenda conceitos ao invés de decorar fórmulas, refaça exercícios errados"
-            },
-            {
-                "titulo": "Calculadora Científica Online",
-                "url": "https://www.wolframalpha.com",
-                "snippet": "Resolva equações e visualize gráficos com WolframAlpha"
-            }
-        ],
-        "historia": [
-            {
-                "titulo": "Brasil Escola - História",
-                "url": "https://brasilescola.uol.com.br/historia",
-                "snippet": "Conteúdo completo de história do Brasil e história geral"
-            },
-            {
-                "titulo": "Dicas para Estudar História",
-                "url": "https://exemplo.com/dicas-historia",
-                "snippet": "Crie linhas do tempo, conecte eventos causais, use mapas mentais"
-            }
-        ],
-        "portugues": [
-            {
-                "titulo": "Português - Gramática e Literatura",
-                "url": "https://exemplo.com/portugues",
-                "snippet": "Guia completo de gramática, literatura e redação"
-            },
-            {
-                "titulo": "Acordo Ortográfico - Guia Prático",
-                "url": "https://exemplo.com/acordo-ortografico",
-                "snippet": "Entenda as mudanças da reforma ortográfica com exemplos práticos"
-            }
-        ],
-        "fisica": [
-            {
-                "titulo": "Física Interativa",
-                "url": "https://phet.colorado.edu/pt_BR",
-                "snippet": "Simulações interativas de física para facilitar o entendimento de conceitos"
-            },
-            {
-                "titulo": "Fórmulas de Física - Guia Completo",
-                "url": "https://exemplo.com/formulas-fisica",
-                "snippet": "Principais fórmulas de mecânica, termodinâmica, eletromagnetismo e óptica"
-            }
-        ],
-        "quimica": [
-            {
-                "titulo": "Tabela Periódica Interativa",
-                "url": "https://ptable.com/pt",
-                "snippet": "Explore elementos químicos com informações detalhadas e propriedades"
-            },
-            {
-                "titulo": "Química Orgânica - Reações e Mecanismos",
-                "url": "https://exemplo.com/quimica-organica",
-                "snippet": "Guia completo de reações orgânicas, nomenclatura e mecanismos"
-            }
-        ],
-        "biologia": [
-            {
-                "titulo": "Só Biologia - Conteúdo Completo",
-                "url": "https://www.sobiologia.com.br",
-                "snippet": "Citologia, genética, ecologia, evolução e fisiologia explicados"
-            },
-            {
-                "titulo": "Atlas de Anatomia Humana",
-                "url": "https://exemplo.com/anatomia",
-                "snippet": "Ilustrações detalhadas dos sistemas do corpo humano"
-            }
-        ],
-        "ingles": [
-            {
-                "titulo": "Duolingo - Aprenda Inglês Grátis",
-                "url": "https://www.duolingo.com",
-                "snippet": "Pratique inglês de forma gamificada e interativa"
-            },
-            {
-                "titulo": "BBC Learning English",
-                "url": "https://www.bbc.co.uk/learningenglish",
-                "snippet": "Recursos gratuitos para melhorar gramática, vocabulário e pronúncia"
-            }
-        ],
-        "redacao": [
-            {
-                "titulo": "Guia de Redação ENEM",
-                "url": "https://exemplo.com/redacao-enem",
-                "snippet": "Estrutura, competências, repertório sociocultural e temas frequentes"
-            },
-            {
-                "titulo": "Banco de Redações Nota 1000",
-                "url": "https://exemplo.com/redacoes-nota-1000",
-                "snippet": "Exemplos comentados de redações que tiraram nota máxima"
-            }
-        ],
-        "memorizar": [
-            {
-                "titulo": "Técnicas de Memorização - Palácio da Memória",
-                "url": "https://exemplo.com/palacio-memoria",
-                "snippet": "Use visualização espacial para memorizar grandes quantidades de informação"
-            },
-            {
-                "titulo": "Flashcards Anki - Sistema de Repetição Espaçada",
-                "url": "https://apps.ankiweb.net",
-                "snippet": "Software gratuito que otimiza a retenção de longo prazo"
-            },
-            {
-                "titulo": "Mnemônicos e Acrônimos para Estudos",
-                "url": "https://exemplo.com/mnemonicos",
-                "snippet": "Crie associações criativas para lembrar listas, fórmulas e conceitos"
-            }
-        ],
-        "organizacao": [
-            {
-                "titulo": "Como Criar um Cronograma de Estudos Eficiente",
-                "url": "https://exemplo.com/cronograma",
-                "snippet": "Planeje horários fixos, intercale matérias e inclua pausas estratégicas"
-            },
-            {
-                "titulo": "Notion para Estudantes",
-                "url": "https://www.notion.so",
-                "snippet": "Organize anotações, tarefas e projetos em um workspace digital"
-            }
-        ],
-        "concentracao": [
-            {
-                "titulo": "Técnica Pomodoro - Estudo Focado",
-                "url": "https://francescocirillo.com/pages/pomodoro-technique",
-                "snippet": "Estude 25 minutos, descanse 5. Melhora foco e produtividade drasticamente"
-            },
-            {
-                "titulo": "Como Evitar Distrações Durante o Estudo",
-                "url": "https://exemplo.com/evitar-distracoes",
-                "snippet": "Desligue notificações, use bloqueadores de sites e crie ambiente adequado"
-            }
-        ],
-        "enem": [
-            {
-                "titulo": "Guia Completo do ENEM 2025",
-                "url": "https://exemplo.com/enem-2025",
-                "snippet": "Datas, conteúdo programático, dicas de estudo e simulados"
-            },
-            {
-                "titulo": "Questões Comentadas ENEM",
-                "url": "https://exemplo.com/questoes-enem",
-                "snippet": "Resolução detalhada de provas anteriores por disciplina"
-            }
-        ],
-        "vestibular": [
-            {
-                "titulo": "Estratégias para Vestibulares Concorridos",
-                "url": "https://exemplo.com/vestibular-estrategias",
-                "snippet": "Foco em editais específicos, provas anteriores e simulados cronometrados"
-            }
-        ]
-    }
-    
-    # Detectar tema da query
-    query_lower = query.lower()
+    # Detectar tema da query (palavras-chave já sem acentos)
+    query_norm = normalizar_texto(query)
     resultados = []
     
-    # Mapeamento de palavras-chave para temas
-    keywords_map = {
-        "matematica": ["matematica", "calculo", "algebra", "geometria", "equacao"],
-        "fisica": ["fisica", "mecanica", "termodinamica", "eletricidade", "optica"],
-        "quimica": ["quimica", "reacao", "tabela periodica", "organica", "inorganica"],
-        "biologia": ["biologia", "celula", "genetica", "ecologia", "anatomia"],
-        "historia": ["historia", "historico", "guerra", "revolucao", "imperio"],
-        "portugues": ["portugues", "gramatica", "literatura", "ortografia", "sintaxe"],
-        "ingles": ["ingles", "english", "vocabulary", "grammar"],
-        "redacao": ["redacao", "dissertacao", "texto", "enem redacao"],
-        "memorizar": ["memorizar", "memoria", "decorar", "lembrar", "memorização"],
-        "organizacao": ["organizar", "cronograma", "planejar", "rotina"],
-        "concentracao": ["concentrar", "foco", "atencao", "pomodoro", "distracao"],
-        "enem": ["enem", "exame nacional"],
-        "vestibular": ["vestibular", "fuvest", "unicamp", "unesp"]
-    }
-    
     # Buscar temas relevantes
-    temas_encontrados = []
-    for tema, keywords in keywords_map.items():
-        if any(kw in query_lower for kw in keywords):
-            temas_encontrados.append(tema)
+    temas_encontrados = [
+        tema for tema, palavras in PALAVRAS_CHAVE_TEMAS
+        if any(palavra in query_norm for palavra in palavras)
+    ]
     
     # Se não encontrou tema específico, buscar por palavras gerais de estudo
-    if not temas_encontrados:
-        palavras_gerais = ["estudo", "estudar", "aprender", "tecnica", "dica", "ajuda"]
-        if any(palavra in query_lower for palavra in palavras_gerais):
-            # Retorna uma mistura de técnicas gerais
-            temas_encontrados = ["memorizar", "concentracao", "organizacao"]
+    if not temas_encontrados and any(palavra in query_norm for palavra in PALAVRAS_GERAIS_ESTUDO):
+        # Retorna uma mistura de técnicas gerais
+        temas_encontrados = TEMAS_ESTUDO_GERAL
     
     # Coletar resultados dos temas encontrados
     for tema in temas_encontrados:
-        if tema in base_conhecimento:
-            resultados.extend(base_conhecimento[tema])
+        resultados.extend(BASE_CONHECIMENTO[tema])
     
     # Se ainda não encontrou nada, retorna resultado genérico
     if not resultados:
@@ -602,111 +754,108 @@ def simular_busca(query: str, max_results: int):
 
 
 @app.route(route="gerar-simulado", methods=["POST"])
-def gerar_simulado(req: func.HttpRequest) -> func.HttpResponse:
+@medir_tempo
+async def gerar_simulado(req: func.HttpRequest) -> func.HttpResponse:
     """
     Gera um simulado personalizado com questões de múltipla escolha
     """
-    start_time = datetime.now()
-    logging.info(f'[{start_time}] Função gerar-simulado acionada')
+    logging.info('Função gerar-simulado acionada')
     
     try:
-        req_body = req.get_json()
+        req_body = ler_json(req)
+        try:
+            projecao = obter_projecao(req, req_body)
+        except ValueError as e:
+            return resposta_erro("Campo 'fields' inválido", str(e))
         
         # Validações
         materia = req_body.get('materia', '').strip()
         if not materia:
-            return func.HttpResponse(
-                json.dumps({
-                    "erro": "Matéria não fornecida",
-                    "mensagem": "Informe a matéria do simulado"
-                }, ensure_ascii=False),
-                status_code=400,
-                mimetype="application/json"
-            )
+            return resposta_erro("Matéria não fornecida", "Informe a matéria do simulado")
         
         num_questoes = req_body.get('num_questoes', 5)
         dificuldade = req_body.get('dificuldade', 'medio').lower()
         
         # Validar parâmetros
-        if num_questoes < 1 or num_questoes > 20:
-            return func.HttpResponse(
-                json.dumps({
-                    "erro": "Número de questões inválido",
-                    "mensagem": "Escolha entre 1 e 20 questões"
-                }, ensure_ascii=False),
-                status_code=400,
-                mimetype="application/json"
-            )
+        if num_questoes < 1 or num_questoes > SIMULADO_MAX_QUESTOES:
+            return resposta_erro("Número de questões inválido", f"Escolha entre 1 e {SIMULADO_MAX_QUESTOES} questões")
         
         if dificuldade not in ['facil', 'medio', 'dificil']:
             dificuldade = 'medio'
         
+        semente = req_body.get('semente')
+        if semente is not None and (isinstance(semente, bool) or not isinstance(semente, int)):
+            return resposta_erro("Semente inválida", "A semente deve ser um número inteiro")
+        
+        marcar_etapa("validacao")
+        
+        # Simulado com semente é reprodutível: vale a requisição condicional
+        chave = None
+        if semente is not None:
+            chave = chave_condicional("gerar-simulado", materia, num_questoes, dificuldade, semente, projecao)
+            nao_modificado = resposta_nao_modificada(req, chave)
+            if nao_modificado is not None:
+                return nao_modificado
+        
         # Gerar questões
-        questoes = criar_questoes(materia, num_questoes, dificuldade)
+        questoes = await asyncio.to_thread(criar_questoes, materia, num_questoes, dificuldade, semente)
+        marcar_etapa("geracao")
         
         # Calcular tempo estimado (2-3 min por questão)
         tempo_estimado = num_questoes * 2.5
         
-        response_time = (datetime.now() - start_time).total_seconds() * 1000
+        response_time = medicao_atual().total_ms()
         logging.info(f'Simulado gerado: {materia}, {num_questoes} questões, {dificuldade} - {response_time:.2f}ms')
         
-        return func.HttpResponse(
-            json.dumps({
-                "materia": materia,
-                "dificuldade": dificuldade,
-                "num_questoes": len(questoes),
-                "tempo_estimado_minutos": tempo_estimado,
-                "questoes": questoes,
-                "instrucoes": "Leia cada questão com atenção. Marque apenas uma alternativa por questão.",
-                "response_time_ms": round(response_time, 2)
-            }, ensure_ascii=False),
-            mimetype="application/json"
-        )
+        simulado = {
+            "materia": materia,
+            "dificuldade": dificuldade,
+            "num_questoes": len(questoes),
+            "tempo_estimado_minutos": tempo_estimado,
+            "questoes": questoes,
+            "instrucoes": "Leia cada questão com atenção. Marque apenas uma alternativa por questão.",
+            "tempo_resposta_ms": round(response_time, 2)
+        }
+        if semente is not None:
+            simulado["semente"] = semente
+            return resposta_condicional(req, chave, simulado, projecao)
+        return resposta_json(simulado, req=req, projecao=projecao)
         
     except ValueError as e:
         logging.error(f'Erro de validação: {str(e)}')
-        return func.HttpResponse(
-            json.dumps({
-                "erro": "Dados inválidos",
-                "mensagem": str(e)
-            }, ensure_ascii=False),
-            status_code=400,
-            mimetype="application/json"
-        )
+        return resposta_erro("Dados inválidos", str(e))
     except Exception as e:
         logging.error(f'Erro ao gerar simulado: {str(e)}')
-        return func.HttpResponse(
-            json.dumps({
-                "erro": "Erro interno",
-                "mensagem": "Não foi possível gerar o simulado"
-            }, ensure_ascii=False),
-            status_code=500,
-            mimetype="application/json"
-        )
+        return resposta_erro("Erro interno", "Não foi possível gerar o simulado", status_code=500)
 
 
 @app.route(route="gerar-resumo", methods=["POST"])
-def gerar_resumo(req: func.HttpRequest) -> func.HttpResponse:
+@medir_tempo
+async def gerar_resumo(req: func.HttpRequest) -> func.HttpResponse:
     """
     Gera resumo estruturado de um tópico educacional
     """
-    start_time = datetime.now()
-    logging.info(f'[{start_time}] Função gerar-resumo acionada')
+    logging.info('Função gerar-resumo acionada')
     
     try:
-        req_body = req.get_json()
+        req_body = ler_json(req)
+        try:
+            projecao = obter_projecao(req, req_body)
+        except ValueError as e:
+            return resposta_erro("Campo 'fields' inválido", str(e))
         
         # Validações
         topico = req_body.get('topico', '').strip()
-        if not topico:
-            return func.HttpResponse(
-                json.dumps({
-                    "erro": "Tópico não fornecido",
-                    "mensagem": "Informe o tópico para resumir"
-                }, ensure_ascii=False),
-                status_code=400,
-                mimetype="application/json"
-            )
+        texto = req_body.get('texto', '')
+        if not isinstance(texto, str):
+            texto = ''
+        texto = texto.strip()
+        
+        if not topico and not texto:
+            return resposta_erro("Tópico não fornecido", "Informe o tópico para resumir")
+        
+        if len(texto) > LIMITE_TEXTO_RESUMO:
+            return resposta_erro("Texto muito longo", f"Limite de {LIMITE_TEXTO_RESUMO} caracteres")
         
         materia = req_body.get('materia', '').strip()
         tipo = req_body.get('tipo', 'completo').lower()
@@ -714,372 +863,1718 @@ def gerar_resumo(req: func.HttpRequest) -> func.HttpResponse:
         if tipo not in ['rapido', 'completo', 'detalhado']:
             tipo = 'completo'
         
-        # Gerar resumo
-        resumo = criar_resumo(topico, materia, tipo)
-        
-        response_time = (datetime.now() - start_time).total_seconds() * 1000
-        logging.info(f'Resumo gerado: {topico} ({tipo}) - {response_time:.2f}ms')
-        
-        return func.HttpResponse(
-            json.dumps({
-                "topico": topico,
-                "materia": materia or "Geral",
-                "tipo": tipo,
-                "resumo": resumo,
-                "response_time_ms": round(response_time, 2)
-            }, ensure_ascii=False),
-            mimetype="application/json"
-        )
+        marcar_etapa("validacao")
+        
+        # Texto enviado pelo estudante com stream=true: um resultado parcial
+        # por bloco do texto, em NDJSON, terminando no resumo final
+        if texto and req_body.get('stream') is True:
+            parciais = await asyncio.to_thread(list, resumir_texto_incremental(texto, tipo))
+            marcar_etapa("geracao")
+            with etapa("serializacao"):
+                linhas = [serializar_json(projetar(parcial, projecao)) for parcial in parciais]
+            response_time = medicao_atual().total_ms()
+            logging.info(f'Resumo de texto (stream) gerado: {len(linhas)} partes - {response_time:.2f}ms')
+            return resposta_bytes(b"\n".join(linhas) + b"\n", mimetype="application/x-ndjson", req=req)
+        
+        chave = chave_condicional("gerar-resumo", topico, texto, materia, tipo, projecao)
+        nao_modificado = resposta_nao_modificada(req, chave)
+        if nao_modificado is not None:
+            return nao_modificado
+        
+        # Gerar resumo (extrativo quando há texto, senão da base de resumos)
+        if texto:
+            resumo = await asyncio.to_thread(resumir_texto, texto, topico, tipo)
+        else:
+            resumo = await asyncio.to_thread(criar_resumo, topico, materia, tipo)
+        marcar_etapa("geracao")
         
+        response_time = medicao_atual().total_ms()
+        logging.info(f'Resumo gerado: {topico or "texto enviado"} ({tipo}) - {response_time:.2f}ms')
+        
+        return resposta_condicional(req, chave, {
+            "topico": topico or "Texto enviado",
+            "materia": materia or "Geral",
+            "tipo": tipo,
+            "fonte": "texto" if texto else "base",
+            "resumo": resumo,
+            "tempo_resposta_ms": round(response_time, 2)
+        }, projecao)
+        
+    except ValueError as e:
+        logging.error(f'Erro de validação: {str(e)}')
+        return resposta_erro("Dados inválidos", str(e))
     except Exception as e:
         logging.error(f'Erro ao gerar resumo: {str(e)}')
-        return func.HttpResponse(
-            json.dumps({
-                "erro": "Erro interno",
-                "mensagem": "Não foi possível gerar o resumo"
-            }, ensure_ascii=False),
-            status_code=500,
-            mimetype="application/json"
-        )
+        return resposta_erro("Erro interno", "Não foi possível gerar o resumo", status_code=500)
 
 
 @app.route(route="registrar-progresso", methods=["POST"])
-def registrar_progresso(req: func.HttpRequest) -> func.HttpResponse:
+@medir_tempo
+async def registrar_progresso(req: func.HttpRequest) -> func.HttpResponse:
     """
     Registra progresso de estudo do usuário
     """
-    start_time = datetime.now()
-    logging.info(f'[{start_time}] Função registrar-progresso acionada')
+    logging.info('Função registrar-progresso acionada')
     
     try:
-        req_body = req.get_json()
+        req_body = ler_json(req)
+        try:
+            projecao = obter_projecao(req, req_body)
+        except ValueError as e:
+            return resposta_erro("Campo 'fields' inválido", str(e))
         
         # Validações
-        usuario_id = req_body.get('usuario_id', 'default')
-        materia = req_body.get('materia', '').strip()
-        tempo_minutos = req_body.get('tempo_minutos', 0)
-        topicos_estudados = req_body.get('topicos_estudados', [])
-        
-        if not materia:
-            return func.HttpResponse(
-                json.dumps({
-                    "erro": "Matéria não fornecida"
-                }, ensure_ascii=False),
-                status_code=400,
-                mimetype="application/json"
-            )
-        
-        if tempo_minutos < 1:
-            return func.HttpResponse(
-                json.dumps({
-                    "erro": "Tempo de estudo inválido"
-                }, ensure_ascii=False),
-                status_code=400,
-                mimetype="application/json"
-            )
+        try:
+            progresso_registrado = validar_sessao(req_body)
+        except ValueError as e:
+            return resposta_erro(str(e))
         
-        # Registrar progresso (simulado - em produção usaria banco de dados)
-        progresso_registrado = {
-            "usuario_id": usuario_id,
-            "materia": materia,
-            "tempo_minutos": tempo_minutos,
-            "topicos_estudados": topicos_estudados,
-            "data_registro": datetime.now().isoformat(),
-            "status": "registrado"
-        }
+        marcar_etapa("validacao")
+        usuario_id = progresso_registrado["usuario_id"]
+        materia = progresso_registrado["materia"]
+        tempo_minutos = progresso_registrado["tempo_minutos"]
+        topicos_estudados = progresso_registrado["topicos_estudados"]
         
         # Calcular estatísticas
         horas_total = tempo_minutos / 60
         pontos_conquistados = calcular_pontos(tempo_minutos, len(topicos_estudados))
         
-        response_time = (datetime.now() - start_time).total_seconds() * 1000
+        # Registrar progresso no armazenamento local (SQLite WAL)
+        # Gravação em segundo plano (write-behind): a resposta não espera o disco
+        try:
+            await asyncio.to_thread(ingerir_sessao, {**progresso_registrado, "pontos": pontos_conquistados})
+        except FilaProgressoCheia:
+            logging.warning(f'Fila de progresso cheia, recusando sessão de {usuario_id}')
+            return resposta_erro(
+                "Serviço ocupado", "Muitos registros simultâneos, tente novamente em instantes",
+                status_code=503, headers={"Retry-After": "1"}
+            )
+        progresso_registrado["status"] = "registrado"
+        
+        # Tópicos estudados entram (ou avançam) na agenda de revisão espaçada;
+        # a sessão já está na fila, então uma falha aqui não vira erro da requisição
+        try:
+            revisoes = await asyncio.to_thread(
+                lambda: obter_revisoes().registrar_estudo(usuario_id, materia, topicos_estudados)
+            )
+        except Exception as e:
+            logging.error(f'Erro ao agendar revisões de {usuario_id}: {str(e)}')
+            revisoes = []
+        marcar_etapa("gravacao")
+        
+        response_time = medicao_atual().total_ms()
         logging.info(f'Progresso registrado: {materia}, {tempo_minutos}min - {response_time:.2f}ms')
         
-        return func.HttpResponse(
-            json.dumps({
-                "mensagem": "Progresso registrado com sucesso!",
-                "progresso": progresso_registrado,
-                "estatisticas": {
-                    "horas_estudadas": round(horas_total, 2),
-                    "topicos_concluidos": len(topicos_estudados),
-                    "pontos_ganhos": pontos_conquistados
-                },
-                "motivacao": gerar_mensagem_motivacao(tempo_minutos),
-                "response_time_ms": round(response_time, 2)
-            }, ensure_ascii=False),
-            mimetype="application/json"
-        )
+        return resposta_json({
+            "mensagem": "Progresso registrado com sucesso!",
+            "progresso": progresso_registrado,
+            "estatisticas": {
+                "horas_estudadas": round(horas_total, 2),
+                "topicos_concluidos": len(topicos_estudados),
+                "pontos_ganhos": pontos_conquistados,
+                "revisoes_agendadas": len(revisoes)
+            },
+            "motivacao": gerar_mensagem_motivacao(tempo_minutos),
+            "tempo_resposta_ms": round(response_time, 2)
+        }, req=req, projecao=projecao)
         
     except Exception as e:
         logging.error(f'Erro ao registrar progresso: {str(e)}')
-        return func.HttpResponse(
-            json.dumps({
-                "erro": "Erro interno",
-                "mensagem": "Não foi possível registrar o progresso"
-            }, ensure_ascii=False),
-            status_code=500,
-            mimetype="application/json"
+        return resposta_erro("Erro interno", "Não foi possível registrar o progresso", status_code=500)
+
+
+@app.route(route="importar-progresso", methods=["POST"])
+@medir_tempo
+async def importar_progresso(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Importa sessões de estudo em lote (NDJSON: uma sessão JSON por linha)
+    
+    Cada linha é validada separadamente; as válidas são gravadas em lotes
+    e as inválidas retornam com o número da linha e o motivo do erro.
+    O parâmetro de query usuario_id vale para linhas que não o informam.
+    """
+    logging.info('Função importar-progresso acionada')
+    
+    try:
+        corpo = req.get_body() or b''
+        usuario_padrao = req.params.get('usuario_id', 'default')
+        try:
+            projecao = obter_projecao(req, None)
+        except ValueError as e:
+            return resposta_erro("Campo 'fields' inválido", str(e))
+        
+        # Parse, validação e gravação rodam fora do event loop
+        total_linhas, importadas, total_erros, erros = await asyncio.to_thread(
+            importar_linhas, corpo, usuario_padrao
         )
+        marcar_etapa("importacao")
+        
+        if total_linhas == 0:
+            return resposta_erro("Nenhuma sessão enviada", "Envie uma sessão JSON por linha (NDJSON)")
+        
+        response_time = medicao_atual().total_ms()
+        logging.info(f'Importação concluída: {importadas} sessões, {total_erros} erros - {response_time:.2f}ms')
+        
+        return resposta_json({
+            "mensagem": f"{importadas} sessões importadas",
+            "total_linhas": total_linhas,
+            "importadas": importadas,
+            "rejeitadas": total_erros,
+            "erros": erros,
+            "erros_omitidos": total_erros - len(erros),
+            "tempo_resposta_ms": round(response_time, 2)
+        }, req=req, projecao=projecao)
+        
+    except Exception as e:
+        logging.error(f'Erro ao importar progresso: {str(e)}')
+        return resposta_erro("Erro interno", "Não foi possível importar o progresso", status_code=500)
 
 
 @app.route(route="obter-dashboard", methods=["POST"])
-def obter_dashboard(req: func.HttpRequest) -> func.HttpResponse:
+@medir_tempo
+async def obter_dashboard(req: func.HttpRequest) -> func.HttpResponse:
     """
     Retorna dashboard com estatísticas de progresso
     """
-    start_time = datetime.now()
-    logging.info(f'[{start_time}] Função obter-dashboard acionada')
+    logging.info('Função obter-dashboard acionada')
     
     try:
-        req_body = req.get_json()
+        req_body = ler_json(req)
+        try:
+            projecao = obter_projecao(req, req_body)
+        except ValueError as e:
+            return resposta_erro("Campo 'fields' inválido", str(e))
         usuario_id = req_body.get('usuario_id', 'default')
         periodo = req_body.get('periodo', 'semanal').lower()
         
         if periodo not in ['diario', 'semanal', 'mensal']:
             periodo = 'semanal'
+        marcar_etapa("validacao")
         
-        # Gerar dashboard (simulado - em produção viria do banco)
-        dashboard = gerar_dashboard_demo(usuario_id, periodo)
-        
-        response_time = (datetime.now() - start_time).total_seconds() * 1000
-        logging.info(f'Dashboard gerado: {periodo} - {response_time:.2f}ms')
-        
-        return func.HttpResponse(
-            json.dumps({
+        if projecao is not None:
+            dashboard = None
+            if campo_solicitado(projecao, "dashboard"):
+                dashboard = await asyncio.to_thread(
+                    obter_dashboard_parcial, usuario_id, periodo, subprojecao(projecao, "dashboard")
+                )
+            marcar_etapa("geracao")
+            response_time = medicao_atual().total_ms()
+            logging.info(f'Dashboard parcial gerado: {periodo} - {response_time:.2f}ms')
+            return resposta_json({
                 "usuario_id": usuario_id,
                 "periodo": periodo,
                 "dashboard": dashboard,
-                "response_time_ms": round(response_time, 2)
-            }, ensure_ascii=False),
-            mimetype="application/json"
-        )
+                "tempo_resposta_ms": round(response_time, 2)
+            }, req=req, projecao=projecao)
         
-    except Exception as e:
-        logging.error(f'Erro ao gerar dashboard: {str(e)}')
-        return func.HttpResponse(
-            json.dumps({
-                "erro": "Erro interno",
-                "mensagem": "Não foi possível gerar o dashboard"
-            }, ensure_ascii=False),
-            status_code=500,
-            mimetype="application/json"
-        )
-
-
-# ============ FUNÇÕES AUXILIARES ============
+        # Dashboard dos rollups do usuário, já serializado quando em cache
+        _, dashboard_json = await asyncio.to_thread(obter_dashboard_cacheado, usuario_id, periodo)
+        marcar_etapa("geracao")
+        
+        response_time = medicao_atual().total_ms()
+        logging.info(f'Dashboard gerado: {periodo} - {response_time:.2f}ms')
+        
+        # Monta o envelope em bytes ao redor do dashboard serializado; só o
+        # tempo de resposta muda entre requisições, então em gzip o restante
+        # do envelope é comprimido uma vez e reaproveitado do cache
+        with etapa("serializacao"):
+            envelope = b''.join([
+                b'{"usuario_id":', serializar_json(usuario_id),
+                b',"periodo":', serializar_json(periodo),
+                b',"dashboard":', dashboard_json
+            ])
+            sufixo = b',"tempo_resposta_ms":' + serializar_json(round(response_time, 2)) + b'}'
+        
+        if len(envelope) >= COMPRESSAO_MIN_BYTES and negociar_codificacao(req, ("gzip",)):
+            prefixo = await asyncio.to_thread(
+                _cache_dashboard.prefixo_gzip, usuario_id, periodo, dashboard_json, envelope
+            )
+            with etapa("compressao"):
+                corpo = gzip_concluir(prefixo, sufixo)
+            return func.HttpResponse(
+                corpo,
+                headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"},
+                mimetype="application/json"
+            )
+        return resposta_bytes(envelope + sufixo, req=req)
+        
+    except Exception as e:
+        logging.error(f'Erro ao gerar dashboard: {str(e)}')
+        return resposta_erro("Erro interno", "Não foi possível gerar o dashboard", status_code=500)
+
 
-def criar_questoes(materia: str, num_questoes: int, dificuldade: str) -> list:
-    """Gera questões de múltipla escolha personalizadas"""
+@app.route(route="ranking", methods=["POST"])
+@medir_tempo
+async def ranking(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Retorna o ranking de pontos (global, da turma ou da escola)
     
-    # Base de questões por matéria
-    questoes_base = {
-        "matematica": [
-            {
-                "enunciado": "Qual é o valor de x na equação 2x + 5 = 15?",
-                "alternativas": ["A) 3", "B) 5", "C) 7", "D) 10", "E) 15"],
-                "resposta_correta": "B",
-                "explicacao": "2x = 15 - 5 → 2x = 10 → x = 5",
-                "dificuldade": "facil"
-            },
-            {
-                "enunciado": "A área de um triângulo com base 8cm e altura 6cm é:",
-                "alternativas": ["A) 14 cm²", "B) 24 cm²", "C) 28 cm²", "D) 48 cm²", "E) 56 cm²"],
-                "resposta_correta": "B",
-                "explicacao": "Área = (base × altura) / 2 = (8 × 6) / 2 = 24 cm²",
-                "dificuldade": "medio"
-            },
-            {
-                "enunciado": "Qual é a derivada de f(x) = 3x² + 2x - 1?",
-                "alternativas": ["A) 6x + 2", "B) 3x + 2", "C) 6x - 1", "D) 3x² + 2", "E) 6x"],
-                "resposta_correta": "A",
-                "explicacao": "f'(x) = 6x + 2 (regra da potência)",
-                "dificuldade": "dificil"
-            }
-        ],
-        "fisica": [
-            {
-                "enunciado": "A fórmula da velocidade média é:",
-                "alternativas": ["A) v = d/t", "B) v = t/d", "C) v = d×t", "D) v = a×t", "E) v = m×a"],
-                "resposta_correta": "A",
-                "explicacao": "Velocidade média = distância / tempo",
-                "dificuldade": "facil"
-            },
-            {
-                "enunciado": "Um corpo em queda livre acelera a aproximadamente:",
-                "alternativas": ["A) 5 m/s²", "B) 9,8 m/s²", "C) 15 m/s²", "D) 20 m/s²", "E) 30 m/s²"],
-                "resposta_correta": "B",
-                "explicacao": "A aceleração da gravidade na Terra é aproximadamente 9,8 m/s²",
-                "dificuldade": "medio"
-            },
-            {
-                "enunciado": "A energia cinética é dada pela fórmula:",
-                "alternativas": ["A) Ec = mv", "B) Ec = mv²", "C) Ec = mv²/2", "D) Ec = mgh", "E) Ec = ma"],
-                "resposta_correta": "C",
-                "explicacao": "Energia cinética = (massa × velocidade²) / 2",
-                "dificuldade": "dificil"
-            }
-        ],
-        "quimica": [
-            {
-                "enunciado": "Quantos prótons tem o átomo de Carbono (C)?",
-                "alternativas": ["A) 4", "B) 6", "C) 8", "D) 12", "E) 14"],
-                "resposta_correta": "B",
-                "explicacao": "O número atômico do Carbono é 6, portanto tem 6 prótons",
-                "dificuldade": "facil"
-            },
-            {
-                "enunciado": "A fórmula da água é:",
-                "alternativas": ["A) H₂O", "B) HO", "C) H₃O", "D) H₂O₂", "E) HO₂"],
-                "resposta_correta": "A",
-                "explicacao": "Água é formada por 2 átomos de Hidrogênio e 1 de Oxigênio",
-                "dificuldade": "facil"
-            },
-            {
-                "enunciado": "O pH neutro na escala de pH é:",
-                "alternativas": ["A) 0", "B) 3", "C) 7", "D) 10", "E) 14"],
-                "resposta_correta": "C",
-                "explicacao": "pH 7 é neutro (nem ácido nem básico)",
-                "dificuldade": "medio"
-            }
-        ],
-        "biologia": [
-            {
-                "enunciado": "A menor unidade viva dos seres vivos é:",
-                "alternativas": ["A) Molécula", "B) Célula", "C) Tecido", "D) Órgão", "E) Átomo"],
-                "resposta_correta": "B",
-                "explicacao": "A célula é a unidade básica da vida",
-                "dificuldade": "facil"
-            },
-            {
-                "enunciado": "A fotossíntese ocorre principalmente nas:",
-                "alternativas": ["A) Raízes", "B) Flores", "C) Folhas", "D) Frutos", "E) Sementes"],
-                "resposta_correta": "C",
-                "explicacao": "As folhas contêm clorofila para realizar fotossíntese",
-                "dificuldade": "medio"
-            },
-            {
-                "enunciado": "O DNA é uma molécula de:",
-                "alternativas": ["A) Proteína", "B) Lipídio", "C) Carboidrato", "D) Ácido nucleico", "E) Vitamina"],
-                "resposta_correta": "D",
-                "explicacao": "DNA (ácido desoxirribonucleico) é um ácido nucleico",
-                "dificuldade": "medio"
-            }
-        ],
-        "historia": [
-            {
-                "enunciado": "A Independência do Brasil ocorreu em:",
-                "alternativas": ["A) 1500", "B) 1789", "C) 1822", "D) 1889", "E) 1922"],
-                "resposta_correta": "C",
-                "explicacao": "O Brasil declarou independência em 7 de setembro de 1822",
-                "dificuldade": "facil"
-            },
-            {
-                "enunciado": "A Revolução Francesa aconteceu no século:",
-                "alternativas": ["A) XVI", "B) XVII", "C) XVIII", "D) XIX", "E) XX"],
-                "resposta_correta": "C",
-                "explicacao": "A Revolução Francesa começou em 1789 (século XVIII)",
-                "dificuldade": "medio"
-            }
-        ],
-        "portugues": [
-            {
-                "enunciado": "Qual é o plural de 'cidadão'?",
-                "alternativas": ["A) cidadões", "B) cidadães", "C) cidadãos", "D) cidadans", "E) cidadaos"],
-                "resposta_correta": "C",
-                "explicacao": "Palavras terminadas em -ão podem fazer plural em -ãos",
-                "dificuldade": "facil"
-            },
-            {
-                "enunciado": "Qual frase está correta?",
-                "alternativas": [
-                    "A) Haviam muitas pessoas", 
-                    "B) Havia muitas pessoas", 
-                    "C) Houveram muitas pessoas",
-                    "D) Houve muitas pessoas",
-                    "E) Ambas B e D"
-                ],
-                "resposta_correta": "E",
-                "explicacao": "O verbo 'haver' no sentido de existir é impessoal (singular)",
-                "dificuldade": "medio"
-            }
-        ]
+    Inclui o top-K do escopo e, para o usuário informado, sua posição,
+    a variação desde o último instantâneo e os vizinhos ao redor.
+    """
+    logging.info('Função ranking acionada')
+    
+    try:
+        req_body = ler_json(req)
+        try:
+            projecao = obter_projecao(req, req_body)
+        except ValueError as e:
+            return resposta_erro("Campo 'fields' inválido", str(e))
+        usuario_id = req_body.get('usuario_id', 'default')
+        escopo = str(req_body.get('escopo', 'global')).lower()
+        grupo = req_body.get('grupo')
+        
+        if escopo not in ESCOPOS_RANKING or (grupo is not None and not isinstance(grupo, str)):
+            return resposta_erro("Escopo inválido", f"Use um dos escopos: {', '.join(ESCOPOS_RANKING)}")
+        
+        try:
+            k = ler_inteiro(req_body, 'k', 10, 1, RANKING_MAX_K)
+            raio = ler_inteiro(req_body, 'raio', 2, 0, RANKING_MAX_RAIO)
+        except ValueError as e:
+            return resposta_erro("Parâmetro inválido", str(e))
+        marcar_etapa("validacao")
+        
+        resultado = await asyncio.to_thread(lambda: obter_placar().consultar(usuario_id, escopo, grupo, k, raio))
+        marcar_etapa("geracao")
+        
+        response_time = medicao_atual().total_ms()
+        logging.info(f'Ranking consultado: {escopo} ({resultado["participantes"]} participantes) - {response_time:.2f}ms')
+        
+        return resposta_json({
+            "usuario_id": usuario_id,
+            "escopo": escopo,
+            **resultado,
+            "tempo_resposta_ms": round(response_time, 2)
+        }, req=req, projecao=projecao)
+        
+    except Exception as e:
+        logging.error(f'Erro ao consultar ranking: {str(e)}')
+        return resposta_erro("Erro interno", "Não foi possível consultar o ranking", status_code=500)
+
+
+@app.route(route="analise-coorte", methods=["POST"])
+@medir_tempo
+async def analise_coorte(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Retorna o dashboard agregado de uma turma, escola ou lista de alunos (visão do professor)
+    """
+    logging.info('Função analise-coorte acionada')
+    
+    try:
+        req_body = ler_json(req)
+        try:
+            projecao = obter_projecao(req, req_body)
+        except ValueError as e:
+            return resposta_erro("Campo 'fields' inválido", str(e))
+        usuario_ids = req_body.get('usuario_ids')
+        turma = req_body.get('turma')
+        escola = req_body.get('escola')
+        periodo = str(req_body.get('periodo', 'semanal')).lower()
+        try:
+            dias_risco = ler_inteiro(req_body, 'dias_risco', COORTE_DIAS_RISCO, 1, 365)
+        except ValueError as e:
+            return resposta_erro("Parâmetro inválido", str(e))
+        
+        if periodo not in ['diario', 'semanal', 'mensal']:
+            periodo = 'semanal'
+        
+        if usuario_ids is not None:
+            if not isinstance(usuario_ids, list) or not all(isinstance(u, str) for u in usuario_ids):
+                usuario_ids = []
+            grupo = None
+        elif turma:
+            usuario_ids = await asyncio.to_thread(lambda: obter_placar().participantes('turma', str(turma)))
+            grupo = {"turma": turma}
+        elif escola:
+            usuario_ids = await asyncio.to_thread(lambda: obter_placar().participantes('escola', str(escola)))
+            grupo = {"escola": escola}
+        else:
+            usuario_ids = []
+            grupo = None
+        
+        if not usuario_ids or len(usuario_ids) > COORTE_MAX_ALUNOS:
+            return resposta_erro(
+                "Coorte inválida", f"Informe usuario_ids (até {COORTE_MAX_ALUNOS}), turma ou escola com alunos registrados"
+            )
+        
+        marcar_etapa("validacao")
+        analise = await asyncio.to_thread(analisar_coorte, usuario_ids, periodo, dias_risco=dias_risco)
+        marcar_etapa("geracao")
+        
+        response_time = medicao_atual().total_ms()
+        logging.info(f'Análise de coorte: {len(usuario_ids)} alunos, {periodo} - {response_time:.2f}ms')
+        
+        return resposta_json({
+            "grupo": grupo,
+            "periodo": periodo,
+            "analise": analise,
+            "tempo_resposta_ms": round(response_time, 2)
+        }, req=req, projecao=projecao)
+        
+    except Exception as e:
+        logging.error(f'Erro na análise de coorte: {str(e)}')
+        return resposta_erro("Erro interno", "Não foi possível gerar a análise da coorte", status_code=500)
+
+
+@app.route(route="revisoes-pendentes", methods=["POST"])
+@medir_tempo
+async def revisoes_pendentes(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Retorna os itens com revisão vencida (revisão espaçada SM-2)
+    """
+    logging.info('Função revisoes-pendentes acionada')
+    
+    try:
+        req_body = ler_json(req)
+        try:
+            projecao = obter_projecao(req, req_body)
+        except ValueError as e:
+            return resposta_erro("Campo 'fields' inválido", str(e))
+        usuario_id = req_body.get('usuario_id', 'default')
+        try:
+            limite = ler_inteiro(req_body, 'limite', 20, 1, REVISAO_MAX_PENDENTES)
+        except ValueError as e:
+            return resposta_erro("Parâmetro inválido", str(e))
+        marcar_etapa("validacao")
+        
+        agenda = await asyncio.to_thread(lambda: obter_revisoes().pendentes(usuario_id, limite))
+        marcar_etapa("geracao")
+        
+        response_time = medicao_atual().total_ms()
+        logging.info(f'Revisões pendentes: {len(agenda["pendentes"])} de {agenda["total_itens"]} - {response_time:.2f}ms')
+        
+        return resposta_json({
+            "usuario_id": usuario_id,
+            **agenda,
+            "tempo_resposta_ms": round(response_time, 2)
+        }, req=req, projecao=projecao)
+        
+    except Exception as e:
+        logging.error(f'Erro ao listar revisões: {str(e)}')
+        return resposta_erro("Erro interno", "Não foi possível listar as revisões", status_code=500)
+
+
+@app.route(route="responder-revisao", methods=["POST"])
+@medir_tempo
+async def responder_revisao(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Registra respostas de revisão e reagenda os itens (SM-2)
+    
+    Cada resposta tem 'item' e 'nota' (0 a 5) ou 'acertou' (questões de
+    simulado: acerto vale 4, erro vale 1). Aceita uma resposta no corpo
+    ou uma lista em 'respostas'.
+    """
+    logging.info('Função responder-revisao acionada')
+    
+    try:
+        req_body = ler_json(req)
+        try:
+            projecao = obter_projecao(req, req_body)
+        except ValueError as e:
+            return resposta_erro("Campo 'fields' inválido", str(e))
+        usuario_id = req_body.get('usuario_id', 'default')
+        respostas = req_body.get('respostas', [req_body])
+        
+        try:
+            if not isinstance(respostas, list) or not respostas:
+                raise ValueError("Envie ao menos uma resposta")
+            avaliadas = [_nota_resposta(r) for r in respostas]
+        except ValueError as e:
+            return resposta_erro("Resposta inválida", str(e))
+        
+        marcar_etapa("validacao")
+        
+        agora = time.time()
+        cartoes = await asyncio.to_thread(lambda: obter_revisoes().responder(usuario_id, avaliadas, agora))
+        marcar_etapa("gravacao")
+        
+        response_time = medicao_atual().total_ms()
+        logging.info(f'Revisões respondidas: {len(cartoes)} - {response_time:.2f}ms')
+        
+        return resposta_json({
+            "usuario_id": usuario_id,
+            "reagendados": [c.para_dict(agora) for c in cartoes],
+            "tempo_resposta_ms": round(response_time, 2)
+        }, req=req, projecao=projecao)
+        
+    except Exception as e:
+        logging.error(f'Erro ao responder revisão: {str(e)}')
+        return resposta_erro("Erro interno", "Não foi possível registrar a revisão", status_code=500)
+
+
+def importar_linhas(corpo: bytes, usuario_padrao: str) -> tuple:
+    """
+    Valida e grava as sessões de um corpo NDJSON em lotes
+    Retorna (total_linhas, importadas, total_erros, erros)
+    """
+    total_linhas = 0
+    importadas = 0
+    total_erros = 0
+    erros = []
+    lote = []
+    
+    # Percorre o corpo linha a linha, sem decodificar o documento inteiro
+    for numero, linha in enumerate(io.BytesIO(corpo), 1):
+        if not linha.strip():
+            continue
+        if total_linhas >= IMPORTACAO_MAX_LINHAS:
+            total_erros += 1
+            erros.append({"linha": numero, "erro": f"Limite de {IMPORTACAO_MAX_LINHAS} linhas atingido"})
+            break
+        total_linhas += 1
+        
+        try:
+            registro = json.loads(linha)
+            if not isinstance(registro, dict):
+                raise ValueError("Cada linha deve ser um objeto JSON")
+            registro.setdefault('usuario_id', usuario_padrao)
+            sessao = validar_sessao(registro, aceitar_data=True)
+        except ValueError as e:  # inclui JSONDecodeError e UnicodeDecodeError
+            total_erros += 1
+            if len(erros) < IMPORTACAO_MAX_ERROS:
+                erros.append({"linha": numero, "erro": str(e)})
+            continue
+        
+        sessao["pontos"] = calcular_pontos(sessao["tempo_minutos"], len(sessao["topicos_estudados"]))
+        lote.append(sessao)
+        if len(lote) >= IMPORTACAO_LOTE:
+            ingerir_lote(lote)
+            importadas += len(lote)
+            lote = []
+    
+    if lote:
+        ingerir_lote(lote)
+        importadas += len(lote)
+    
+    return total_linhas, importadas, total_erros, erros
+
+
+def _nota_resposta(resposta) -> tuple:
+    """(item, nota) de uma resposta de revisão (levanta ValueError com o motivo)"""
+    if not isinstance(resposta, dict):
+        raise ValueError("Cada resposta deve ser um objeto")
+    item = resposta.get('item')
+    if not isinstance(item, str) or not item.strip():
+        raise ValueError("Item não fornecido")
+    if 'nota' in resposta:
+        nota = resposta['nota']
+        if isinstance(nota, bool) or not isinstance(nota, int) or not 0 <= nota <= 5:
+            raise ValueError("Nota deve ser um inteiro de 0 a 5")
+    elif isinstance(resposta.get('acertou'), bool):
+        nota = 4 if resposta['acertou'] else 1
+    else:
+        raise ValueError("Informe 'nota' (0 a 5) ou 'acertou'")
+    return item.strip(), nota
+
+
+@app.route(route="batch", methods=["POST"])
+@medir_tempo
+async def executar_lote(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Executa várias operações em uma única chamada
+    
+    Cada operação tem 'rota' (qualquer rota da API), 'corpo' e, opcionalmente,
+    'id' e 'depende_de' (ids de operações anteriores). Operações independentes
+    rodam concorrentemente; as dependentes esperam as suas dependências.
+    """
+    logging.info('Função batch acionada')
+    
+    try:
+        req_body = ler_json(req)
+        try:
+            projecao = obter_projecao(req, req_body)
+        except ValueError as e:
+            return resposta_erro("Campo 'fields' inválido", str(e))
+        
+        try:
+            operacoes = validar_operacoes_lote(req_body.get('operacoes'))
+        except ValueError as e:
+            return resposta_erro("Lote inválido", str(e))
+        
+        marcar_etapa("validacao")
+        
+        resultados = await executar_operacoes_lote(operacoes)
+        marcar_etapa("operacoes")
+        
+        response_time = medicao_atual().total_ms()
+        falhas = sum(1 for r in resultados if r["status"] >= 400)
+        logging.info(f'Lote executado: {len(resultados)} operações, {falhas} com erro - {response_time:.2f}ms')
+        
+        return resposta_json({
+            "total_operacoes": len(resultados),
+            "falhas": falhas,
+            "resultados": resultados,
+            "tempo_resposta_ms": round(response_time, 2)
+        }, req=req, projecao=projecao)
+        
+    except ValueError as e:
+        logging.error(f"Erro de validação JSON: {str(e)}")
+        return resposta_erro("JSON inválido", "O corpo da requisição deve ser um JSON válido")
+    except Exception as e:
+        logging.error(f'Erro ao executar lote: {str(e)}')
+        return resposta_erro("Erro interno", "Não foi possível executar o lote", status_code=500)
+
+
+@app.route(route="metrics", methods=["GET"], auth_level=func.AuthLevel.FUNCTION)
+@medir_tempo
+async def metricas_prometheus(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Métricas em memória desta instância no formato texto do Prometheus
+    
+    Contadores e latências por rota, resultados das fontes de busca,
+    acertos dos caches e profundidade das filas. Exige a chave da função
+    (header x-functions-key ou parâmetro code).
+    """
+    with etapa("serializacao"):
+        corpo = _metricas.texto_prometheus().encode("utf-8")
+    return resposta_bytes(corpo, mimetype="text/plain; version=0.0.4", req=req)
+
+
+# ============ LOTE DE OPERAÇÕES ============
+
+LOTE_MAX_OPERACOES = 20
+# Operações do lote em andamento ao mesmo tempo
+LOTE_TRABALHADORES = int(os.environ.get("LOTE_TRABALHADORES", "8"))
+
+# Rotas que podem ser chamadas dentro de um lote (o próprio /batch não)
+ROTAS_LOTE = {
+    "buscar": buscar_web,
+    "gerar-cronograma": gerar_cronograma,
+    "gerar-simulado": gerar_simulado,
+    "gerar-resumo": gerar_resumo,
+    "registrar-progresso": registrar_progresso,
+    "importar-progresso": importar_progresso,
+    "obter-dashboard": obter_dashboard,
+    "ranking": ranking,
+    "analise-coorte": analise_coorte,
+    "revisoes-pendentes": revisoes_pendentes,
+    "responder-revisao": responder_revisao
+}
+
+def validar_operacoes_lote(operacoes) -> list:
+    """
+    Normaliza as operações do lote em dicts {id, rota, corpo, params, depende_de}
+    (levanta ValueError com o motivo)
+    """
+    if not isinstance(operacoes, list) or not operacoes:
+        raise ValueError("Informe uma lista não vazia em 'operacoes'")
+    if len(operacoes) > LOTE_MAX_OPERACOES:
+        raise ValueError(f"Limite de {LOTE_MAX_OPERACOES} operações por lote")
+    
+    normalizadas = []
+    ids = set()
+    for indice, operacao in enumerate(operacoes):
+        if not isinstance(operacao, dict):
+            raise ValueError(f"Operação {indice} deve ser um objeto")
+        rota = str(operacao.get('rota', '')).strip().strip('/')
+        if rota.startswith('api/'):
+            rota = rota[4:]
+        if rota not in ROTAS_LOTE:
+            raise ValueError(f"Operação {indice}: rota '{rota}' não disponível em lote")
+        id_operacao = str(operacao.get('id', indice))
+        if id_operacao in ids:
+            raise ValueError(f"Operação {indice}: id '{id_operacao}' repetido")
+        depende_de = operacao.get('depende_de', [])
+        if isinstance(depende_de, str):
+            depende_de = [depende_de]
+        if not isinstance(depende_de, list) or not all(str(d) in ids for d in depende_de):
+            raise ValueError(f"Operação {indice}: 'depende_de' deve citar ids de operações anteriores")
+        params = operacao.get('params') or {}
+        if not isinstance(params, dict):
+            raise ValueError(f"Operação {indice}: 'params' deve ser um objeto")
+        ids.add(id_operacao)
+        normalizadas.append({
+            "id": id_operacao,
+            "rota": rota,
+            "corpo": operacao.get('corpo', {}),
+            "params": {str(k): str(v) for k, v in params.items()},
+            "depende_de": [str(d) for d in depende_de]
+        })
+    return normalizadas
+
+
+async def executar_operacao_lote(operacao: dict) -> dict:
+    """Chama o handler da rota com uma requisição montada a partir da operação"""
+    corpo = operacao["corpo"]
+    # Texto vai como está (ex.: NDJSON de importar-progresso); o resto, como JSON
+    corpo = corpo.encode("utf-8") if isinstance(corpo, str) else serializar_json(corpo)
+    requisicao = func.HttpRequest(
+        "POST", f"/api/{operacao['rota']}", body=corpo, params=operacao["params"],
+        headers={"Content-Type": "application/json"}
+    )
+    inicio = time.perf_counter()
+    try:
+        resposta = await ROTAS_LOTE[operacao["rota"]](requisicao)
+        status = resposta.status_code
+        conteudo = resposta.get_body()
+        if resposta.mimetype == "application/json" and conteudo:
+            conteudo = json.loads(conteudo)
+        else:
+            conteudo = conteudo.decode("utf-8")
+    except Exception as e:
+        logging.error(f'Erro na operação {operacao["id"]} do lote: {str(e)}')
+        status = 500
+        conteudo = {"erro": "Erro interno", "mensagem": "Falha ao executar a operação"}
+    return {
+        "id": operacao["id"],
+        "rota": operacao["rota"],
+        "status": status,
+        "tempo_ms": round((time.perf_counter() - inicio) * 1000, 2),
+        "resposta": conteudo
     }
+
+
+async def executar_operacoes_lote(operacoes: list) -> list:
+    """
+    Executa as operações concorrentemente no event loop (no máximo
+    LOTE_TRABALHADORES ao mesmo tempo): cada uma começa assim que todas as
+    suas dependências terminam. Se uma dependência falhou (status >= 400),
+    a operação não roda e recebe 424. Resultados na ordem do pedido.
+    """
+    limite = asyncio.Semaphore(LOTE_TRABALHADORES)
+    tarefas = {}
     
-    # Buscar questões da matéria
-    materia_lower = materia.lower()
-    questoes_disponiveis = []
+    async def executar(operacao: dict) -> dict:
+        dependencias = [await tarefas[d] for d in operacao["depende_de"]]
+        falhou = [r["id"] for r in dependencias if r["status"] >= 400]
+        if falhou:
+            return {
+                "id": operacao["id"],
+                "rota": operacao["rota"],
+                "status": 424,
+                "tempo_ms": 0.0,
+                "resposta": {"erro": "Dependência falhou", "mensagem": f"Operações com erro: {', '.join(falhou)}"}
+            }
+        # Operação pronta esperando vaga no semáforo conta como fila do lote
+        _metricas.incrementar("estudai_fila_profundidade", fila="lote")
+        try:
+            await limite.acquire()
+        finally:
+            _metricas.incrementar("estudai_fila_profundidade", -1, fila="lote")
+        try:
+            return await executar_operacao_lote(operacao)
+        finally:
+            limite.release()
     
-    for mat_key in questoes_base.keys():
-        if mat_key in materia_lower or materia_lower in mat_key:
-            questoes_disponiveis = questoes_base[mat_key]
+    # depende_de só cita operações anteriores, então as tarefas já existem
+    for operacao in operacoes:
+        tarefas[operacao["id"]] = asyncio.ensure_future(executar(operacao))
+    return list(await asyncio.gather(*tarefas.values()))
+
+
+# ============ RESPOSTAS JSON ============
+
+try:
+    import orjson
+except ImportError:  # opcional: sem orjson cai no json da biblioteca padrão
+    orjson = None
+
+
+def serializar_json(dados) -> bytes:
+    """
+    Serializa para JSON compacto em UTF-8 (sem espaços após ',' e ':').
+    Usa orjson quando instalado; o json padrão, usado sem ele ou para tipos
+    que ele não conhece, gera os mesmos bytes: NaN/Infinity viram null e
+    floats em notação científica seguem o formato do orjson (1e16, 1e-7,
+    0.00001 em vez de 1e+16, 1e-07, 1e-05).
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(dados, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # Tipos que o orjson não conhece (ex.: inteiros > 64 bits)
+            pass
+    try:
+        texto = json.dumps(dados, ensure_ascii=False, separators=(",", ":"), allow_nan=False)
+    except ValueError:
+        # NaN/Infinity não são JSON válido: o orjson emite null
+        texto = json.dumps(_sem_nao_finitos(dados), ensure_ascii=False, separators=(",", ":"), allow_nan=False)
+    return _NUMERO_COM_EXPOENTE.sub(_expoente_orjson, texto).encode("utf-8")
+
+
+# Strings JSON são casadas inteiras (e mantidas); fora delas, números com expoente
+_NUMERO_COM_EXPOENTE = re.compile(r'"(?:[^"\\]|\\.)*"|(-?[0-9.]+)e([+-])0*([0-9]+)')
+
+
+def _expoente_orjson(m: re.Match) -> str:
+    mantissa, sinal, expoente = m.group(1), m.group(2), m.group(3)
+    if mantissa is None:
+        return m.group(0)
+    if sinal == "-" and expoente == "5":
+        # O orjson só escreve por extenso o expoente -5 entre os que o json padrão abrevia
+        negativo = mantissa.startswith("-")
+        return ("-" if negativo else "") + "0.0000" + mantissa.lstrip("-").replace(".", "")
+    return f"{mantissa}e{'-' if sinal == '-' else ''}{expoente}"
+
+
+def _sem_nao_finitos(valor):
+    """Cópia com NaN/Infinity trocados por None"""
+    if isinstance(valor, float):
+        return valor if math.isfinite(valor) else None
+    if isinstance(valor, dict):
+        return {chave: _sem_nao_finitos(v) for chave, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_sem_nao_finitos(v) for v in valor]
+    return valor
+
+
+@lru_cache(maxsize=256)
+def corpo_erro(erro: str, mensagem: str = None) -> bytes:
+    """Corpo de erro serializado uma única vez por combinação erro/mensagem"""
+    dados = {"erro": erro}
+    if mensagem is not None:
+        dados["mensagem"] = mensagem
+    return serializar_json(dados)
+
+
+def resposta_json(dados, status_code: int = 200, headers: dict = None,
+                  req: func.HttpRequest = None, projecao=None) -> func.HttpResponse:
+    """
+    Resposta HTTP application/json com o corpo compacto; com a requisição,
+    o corpo é comprimido conforme o Accept-Encoding do cliente e, com a
+    projeção (ver obter_projecao), só os campos pedidos são enviados
+    """
+    with etapa("serializacao"):
+        corpo = serializar_json(projetar(dados, projecao))
+    return resposta_bytes(corpo, status_code, headers, req=req)
+
+
+def resposta_bytes(corpo: bytes, status_code: int = 200, headers: dict = None,
+                   mimetype: str = "application/json", req: func.HttpRequest = None) -> func.HttpResponse:
+    """Resposta com corpo já serializado, comprimido quando negociado"""
+    if req is not None:
+        headers = {**(headers or {}), "Vary": "Accept-Encoding"}
+        codificacao = negociar_codificacao(req) if len(corpo) >= COMPRESSAO_MIN_BYTES else None
+        if codificacao is not None:
+            with etapa("compressao"):
+                corpo = comprimir_corpo(corpo, codificacao)
+            headers["Content-Encoding"] = codificacao
+    return func.HttpResponse(
+        corpo,
+        status_code=status_code,
+        headers=headers,
+        mimetype=mimetype
+    )
+
+
+def resposta_erro(erro: str, mensagem: str = None, status_code: int = 400,
+                  headers: dict = None) -> func.HttpResponse:
+    """Resposta de erro no formato {"erro", "mensagem"}"""
+    return func.HttpResponse(
+        corpo_erro(erro, mensagem),
+        status_code=status_code,
+        headers=headers,
+        mimetype="application/json"
+    )
+
+
+# ============ COMPRESSÃO DE RESPOSTAS ============
+
+try:
+    import brotli
+except ImportError:  # opcional: sem brotli só gzip é oferecido
+    brotli = None
+
+# Corpos menores que isso saem sem compressão (o ganho não paga o custo)
+COMPRESSAO_MIN_BYTES = int(os.environ.get("COMPRESSAO_MIN_BYTES", "1024"))
+COMPRESSAO_NIVEL_GZIP = int(os.environ.get("COMPRESSAO_NIVEL_GZIP", "6"))
+COMPRESSAO_NIVEL_BROTLI = int(os.environ.get("COMPRESSAO_NIVEL_BROTLI", "5"))
+
+# Cabeçalho gzip fixo: deflate, sem nome de arquivo, mtime zero, SO desconhecido
+GZIP_CABECALHO = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+
+def codificacoes_disponiveis() -> tuple:
+    """Codificações suportadas, em ordem de preferência do servidor"""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negociar_codificacao(req: func.HttpRequest, disponiveis: tuple = None):
+    """
+    Escolhe a codificação pelo Accept-Encoding (com pesos q) ou None.
+    Em empate de peso vale a preferência do servidor.
+    """
+    aceitas = req.headers.get("accept-encoding")
+    if not aceitas:
+        return None
+    pesos = {}
+    for item in aceitas.split(","):
+        nome, _, parametros = item.strip().partition(";")
+        nome = nome.strip().lower()
+        peso = 1.0
+        parametro = parametros.strip()
+        if parametro.startswith("q="):
+            try:
+                peso = float(parametro[2:])
+            except ValueError:
+                peso = 0.0
+        if nome:
+            pesos[nome] = peso
+    escolhida, melhor = None, 0.0
+    for codificacao in disponiveis or codificacoes_disponiveis():
+        peso = pesos.get(codificacao, pesos.get("*", 0.0))
+        if peso > melhor:
+            escolhida, melhor = codificacao, peso
+    return escolhida
+
+
+def comprimir_corpo(corpo: bytes, codificacao: str) -> bytes:
+    if codificacao == "br":
+        return brotli.compress(corpo, quality=COMPRESSAO_NIVEL_BROTLI)
+    return zlib.compress(corpo, COMPRESSAO_NIVEL_GZIP, wbits=16 + zlib.MAX_WBITS)
+
+
+def gzip_prefixo(dados: bytes) -> tuple:
+    """
+    Comprime o início de um corpo gzip que ainda receberá um sufixo.
+    O flush completo zera o dicionário do deflate: o sufixo é comprimido
+    depois por outro compressor e o prefixo pode ser guardado em cache.
+    """
+    compressor = zlib.compressobj(COMPRESSAO_NIVEL_GZIP, zlib.DEFLATED, -zlib.MAX_WBITS)
+    comprimido = GZIP_CABECALHO + compressor.compress(dados) + compressor.flush(zlib.Z_FULL_FLUSH)
+    return comprimido, zlib.crc32(dados), len(dados)
+
+
+def gzip_concluir(prefixo: tuple, sufixo: bytes) -> bytes:
+    """Fecha o corpo gzip com o sufixo e o rodapé (CRC32 e tamanho)"""
+    comprimido, crc, tamanho = prefixo
+    compressor = zlib.compressobj(COMPRESSAO_NIVEL_GZIP, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return b"".join([
+        comprimido,
+        compressor.compress(sufixo),
+        compressor.flush(),
+        struct.pack("<II", zlib.crc32(sufixo, crc), (tamanho + len(sufixo)) & 0xFFFFFFFF)
+    ])
+
+
+# ============ PROJEÇÃO DE CAMPOS ============
+
+# Tamanho máximo da lista de campos pedida em 'fields'
+PROJECAO_MAX_CARACTERES = 1000
+
+
+class ProjecaoInvalida(ValueError):
+    pass
+
+
+@lru_cache(maxsize=512)
+def compilar_projecao(campos: str):
+    """
+    Compila 'a.b,c' na árvore {"a": {"b": None}, "c": None} (None = campo
+    inteiro), uma única vez por lista de campos. Sem campos, retorna None.
+    """
+    if len(campos) > PROJECAO_MAX_CARACTERES:
+        raise ProjecaoInvalida(f"Limite de {PROJECAO_MAX_CARACTERES} caracteres")
+    arvore = {}
+    for caminho in campos.split(","):
+        caminho = caminho.strip()
+        if not caminho:
+            continue
+        partes = [parte.strip() for parte in caminho.split(".")]
+        if not all(partes):
+            raise ProjecaoInvalida(f"Caminho inválido: '{caminho}'")
+        no = arvore
+        for i, parte in enumerate(partes):
+            if parte in no and no[parte] is None:
+                break  # um ancestral já pede o campo inteiro
+            if i == len(partes) - 1:
+                no[parte] = None
+            else:
+                no = no.setdefault(parte, {})
+    return congelar(arvore) if arvore else None
+
+
+def obter_projecao(req: func.HttpRequest, req_body: dict = None):
+    """
+    Árvore de projeção do parâmetro 'fields' (corpo ou query), ou None.
+    Aceita uma string separada por vírgulas ou uma lista de caminhos.
+    """
+    campos = req_body.get('fields') if isinstance(req_body, dict) else None
+    if campos is None:
+        campos = req.params.get('fields')
+    if campos is None:
+        return None
+    if isinstance(campos, list) and all(isinstance(c, str) for c in campos):
+        campos = ",".join(campos)
+    if not isinstance(campos, str):
+        raise ProjecaoInvalida("Use uma string separada por vírgulas ou uma lista de caminhos")
+    return compilar_projecao(campos)
+
+
+def campo_solicitado(projecao, *caminho) -> bool:
+    """Se o caminho (ou parte dele) foi pedido: permite pular seções não pedidas"""
+    for parte in caminho:
+        if projecao is None:
+            return True
+        if parte not in projecao:
+            return False
+        projecao = projecao[parte]
+    return True
+
+
+def subprojecao(projecao, campo: str):
+    """Projeção de um campo já solicitado (ver campo_solicitado)"""
+    return None if projecao is None else projecao[campo]
+
+
+def projetar(valor, projecao):
+    """Mantém só os campos da projeção; listas são projetadas item a item"""
+    if projecao is None:
+        return valor
+    if isinstance(valor, dict):
+        return {k: projetar(v, projecao[k]) for k, v in valor.items() if k in projecao}
+    if isinstance(valor, (list, tuple)):
+        return [projetar(item, projecao) for item in valor]
+    return valor
+
+
+# ============ REQUISIÇÕES CONDICIONAIS ============
+
+# Campos que mudam a cada resposta sem mudar o conteúdo; ficam fora do ETag
+CAMPOS_VOLATEIS = frozenset({"timestamp", "tempo_resposta_ms"})
+ETAG_CACHE_TAMANHO = 4096
+
+
+class ValidadoresEtag:
+    """
+    LRU de chave da requisição -> ETag da última resposta gerada para ela
+
+    Permite responder 304 antes de gerar o conteúdo. Sem a chave (cache
+    frio ou outra instância), a resposta é gerada e o ETag comparado depois.
+    """
+
+    def __init__(self, tamanho: int = ETAG_CACHE_TAMANHO):
+        self.tamanho = tamanho
+        self._etags = OrderedDict()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    def obter(self, chave: bytes):
+        with self._lock:
+            etag = self._etags.get(chave)
+            if etag is None:
+                self.falhas += 1
+                return None
+            self._etags.move_to_end(chave)
+            self.acertos += 1
+            return etag
+
+    def guardar(self, chave: bytes, etag: str) -> None:
+        with self._lock:
+            self._etags[chave] = etag
+            self._etags.move_to_end(chave)
+            while len(self._etags) > self.tamanho:
+                self._etags.popitem(last=False)
+
+
+_validadores_etag = ValidadoresEtag()
+
+
+def chave_condicional(rota: str, *parametros) -> bytes:
+    """Chave compacta da requisição a partir dos parâmetros já normalizados"""
+    return hashlib.blake2b(serializar_json([rota, *parametros]), digest_size=16).digest()
+
+
+def calcular_etag(dados: dict) -> str:
+    """
+    ETag fraco do conteúdo sem os campos voláteis: o corpo não é idêntico
+    byte a byte (timestamp, compressão), mas é semanticamente o mesmo
+    """
+    estavel = {k: v for k, v in dados.items() if k not in CAMPOS_VOLATEIS}
+    return f'W/"{hashlib.blake2b(serializar_json(estavel), digest_size=16).hexdigest()}"'
+
+
+def etag_corresponde(req: func.HttpRequest, etag: str) -> bool:
+    """Compara com If-None-Match usando comparação fraca (ignora W/)"""
+    if_none_match = req.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    alvo = etag[2:] if etag.startswith("W/") else etag
+    for candidato in if_none_match.split(","):
+        candidato = candidato.strip()
+        if candidato.startswith("W/"):
+            candidato = candidato[2:]
+        if candidato == alvo:
+            return True
+    return False
+
+
+def _resposta_304(etag: str) -> func.HttpResponse:
+    return func.HttpResponse(status_code=304, headers={"ETag": etag, "Vary": "Accept-Encoding"})
+
+
+def resposta_nao_modificada(req: func.HttpRequest, chave: bytes):
+    """304 se o cliente já tem o ETag conhecido para a chave, senão None"""
+    etag = _validadores_etag.obter(chave)
+    if etag is not None and etag_corresponde(req, etag):
+        return _resposta_304(etag)
+    return None
+
+
+def resposta_condicional(req: func.HttpRequest, chave: bytes, dados: dict,
+                         projecao=None) -> func.HttpResponse:
+    """Resposta JSON com ETag; 304 se o cliente já tinha o mesmo conteúdo"""
+    dados = projetar(dados, projecao)
+    with etapa("etag"):
+        etag = calcular_etag(dados)
+    _validadores_etag.guardar(chave, etag)
+    if etag_corresponde(req, etag):
+        return _resposta_304(etag)
+    return resposta_json(dados, headers={"ETag": etag}, req=req)
+
+
+# ============ FUNÇÕES AUXILIARES ============
+
+def criar_questoes(materia: str, num_questoes: int, dificuldade: str, semente: int = None) -> list:
+    """
+    Gera questões de múltipla escolha personalizadas; com semente, a mesma
+    entrada sempre sorteia as mesmas questões
+    """
+    
+    # Questões da matéria (chaves já normalizadas), separadas por dificuldade
+    materia_norm = normalizar_texto(materia)
+    por_dificuldade = None
+    for mat_key, indice in QUESTOES_POR_MATERIA.items():
+        if mat_key in materia_norm or materia_norm in mat_key:
+            por_dificuldade = indice
             break
     
     # Se não encontrou questões específicas, criar questões genéricas
-    if not questoes_disponiveis:
-        questoes_disponiveis = [
-            {
-                "enunciado": f"Questão sobre {materia} - Em desenvolvimento",
-                "alternativas": ["A) Opção 1", "B) Opção 2", "C) Opção 3", "D) Opção 4", "E) Opção 5"],
-                "resposta_correta": "A",
-                "explicacao": "Esta é uma questão de exemplo para a matéria solicitada",
-                "dificuldade": dificuldade
-            }
-        ] * 5
+    if por_dificuldade is None:
+        generica = {
+            "enunciado": f"Questão sobre {materia} - Em desenvolvimento",
+            "alternativas": ["A) Opção 1", "B) Opção 2", "C) Opção 3", "D) Opção 4", "E) Opção 5"],
+            "resposta_correta": "A",
+            "explicacao": "Esta é uma questão de exemplo para a matéria solicitada",
+            "dificuldade": dificuldade
+        }
+        return [{**generica, "numero": numero} for numero in range(1, num_questoes + 1)]
     
     # Filtrar por dificuldade se possível
-    questoes_filtradas = [q for q in questoes_disponiveis if q.get('dificuldade') == dificuldade]
-    if not questoes_filtradas:
-        questoes_filtradas = questoes_disponiveis
+    questoes_filtradas = por_dificuldade.get(dificuldade) or por_dificuldade[None]
     
-    # Selecionar questões (repetindo se necessário para atingir num_questoes)
+    # Selecionar questões (repetindo se necessário para atingir num_questoes):
+    # cada sorteio devolve a visão compartilhada com o número da posição
+    sorteio = random.Random(semente) if semente is not None else random
     questoes_selecionadas = []
-    import random
-    
-    # Garantir que sempre temos questões suficientes
-    while len(questoes_selecionadas) < num_questoes:
-        questao = random.choice(questoes_filtradas).copy()
-        questao['numero'] = len(questoes_selecionadas) + 1
-        questoes_selecionadas.append(questao)
+    for numero in range(1, num_questoes + 1):
+        visoes = sorteio.choice(questoes_filtradas)
+        if numero <= len(visoes):
+            questoes_selecionadas.append(visoes[numero - 1])
+        else:
+            questoes_selecionadas.append(DictImutavel({**visoes[0], "numero": numero}))
     
     return questoes_selecionadas
 
 
-def criar_resumo(topico: str, materia: str, tipo: str) -> dict:
-    """Gera resumo estruturado de um tópico"""
-    
-    resumos_base = {
-        "fotossintese": {
-            "conceito": "Processo pelo qual plantas convertem luz solar em energia química",
-            "pontos_principais": [
-                "Ocorre nos cloroplastos das células vegetais",
-                "Equação: 6CO₂ + 6H₂O + luz → C₆H₁₂O₆ + 6O₂",
-                "Libera oxigênio para a atmosfera",
-                "Fase clara e fase escura (Ciclo de Calvin)"
-            ],
-            "palavras_chave": ["clorofila", "luz", "glicose", "oxigênio", "CO₂"],
-            "dica_memorizacao": "Lembre-se: Luz + CO₂ + Água = Glicose + O₂"
+class DictImutavel(dict):
+    """
+    dict somente leitura para conteúdo compartilhado entre requisições
+
+    Continua sendo um dict (serializa como JSON normalmente); alterações
+    levantam TypeError. Use copy() para obter uma cópia mutável.
+    """
+    __slots__ = ()
+
+    def _somente_leitura(self, *args, **kwargs):
+        raise TypeError(f"{type(self).__name__} é somente leitura")
+
+    __setitem__ = __delitem__ = __ior__ = _somente_leitura
+    clear = pop = popitem = setdefault = update = _somente_leitura
+
+    def copy(self) -> dict:
+        return dict(self)
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+
+class ListaImutavel(list):
+    """list somente leitura para conteúdo compartilhado entre requisições"""
+    __slots__ = ()
+
+    def _somente_leitura(self, *args, **kwargs):
+        raise TypeError(f"{type(self).__name__} é somente leitura")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _somente_leitura
+    append = extend = insert = pop = remove = clear = sort = reverse = _somente_leitura
+
+    def copy(self) -> list:
+        return list(self)
+
+    def __reduce__(self):
+        return (type(self), (list(self),))
+
+
+def congelar(valor):
+    """Converte recursivamente dicts e listas em DictImutavel/ListaImutavel"""
+    if isinstance(valor, dict):
+        if isinstance(valor, DictImutavel):
+            return valor
+        return DictImutavel((k, congelar(v)) for k, v in valor.items())
+    if isinstance(valor, (list, tuple)):
+        if isinstance(valor, ListaImutavel):
+            return valor
+        return ListaImutavel(congelar(v) for v in valor)
+    return valor
+
+
+def normalizar_texto(texto: str) -> str:
+    """Converte para minúsculas, remove acentos e normaliza espaços"""
+    decomposto = unicodedata.normalize('NFKD', texto.casefold())
+    sem_acentos = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    return ' '.join(sem_acentos.split())
+
+
+def distancia_edicao(a: str, b: str, limite: int) -> int:
+    """
+    Distância de Levenshtein entre a e b, interrompida ao passar de limite
+    (retorna limite + 1 nesse caso)
+    """
+    if abs(len(a) - len(b)) > limite:
+        return limite + 1
+    if len(a) < len(b):
+        a, b = b, a
+    anterior = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        atual = [i]
+        for j, cb in enumerate(b, 1):
+            atual.append(min(
+                anterior[j] + 1,
+                atual[j - 1] + 1,
+                anterior[j - 1] + (ca != cb)
+            ))
+        if min(atual) > limite:
+            return limite + 1
+        anterior = atual
+    return anterior[-1]
+
+
+def _trigramas(texto: str) -> set:
+    """Trigramas de caracteres do texto (já normalizado), com bordas de palavra"""
+    texto = f" {texto} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceTopicos:
+    """
+    Índice de tópicos construído uma única vez para busca aproximada
+
+    - Chaves e consultas passam por normalizar_texto (acentos e maiúsculas)
+    - Candidatos vêm de um índice invertido de trigramas de caracteres
+    - Candidatos são ranqueados por contenção e distância de edição, o que
+      tolera erros de digitação ("fotosintese" → "fotossintese")
+    """
+
+    def __init__(self, entradas=(), max_candidatos: int = 8):
+        self.max_candidatos = max_candidatos
+        self._chaves = []
+        self._valores = []
+        self._exatas = {}
+        self._postings = defaultdict(list)
+        for chave, valor in entradas:
+            self.adicionar(chave, valor)
+
+    def __len__(self):
+        return len(self._chaves)
+
+    def adicionar(self, chave: str, valor) -> None:
+        """Adiciona uma chave (ex: nome do tópico ou sinônimo) ao índice"""
+        chave_norm = normalizar_texto(chave)
+        if not chave_norm or chave_norm in self._exatas:
+            return
+        idx = len(self._chaves)
+        self._chaves.append(chave_norm)
+        self._valores.append(valor)
+        self._exatas[chave_norm] = idx
+        for tri in _trigramas(chave_norm):
+            self._postings[tri].append(idx)
+
+    def _distancia(self, consulta: str, chave: str, limite: int) -> int:
+        """Menor distância entre a chave e a consulta ou uma janela de palavras dela"""
+        if chave in consulta or (len(consulta) >= 3 and consulta in chave):
+            return 0
+        melhor = distancia_edicao(consulta, chave, limite)
+        palavras = consulta.split()
+        tamanho = len(chave.split())
+        if len(palavras) > tamanho:
+            for i in range(len(palavras) - tamanho + 1):
+                janela = ' '.join(palavras[i:i + tamanho])
+                melhor = min(melhor, distancia_edicao(janela, chave, limite))
+                if melhor == 0:
+                    break
+        return melhor
+
+    def buscar(self, consulta: str):
+        """Retorna o valor da chave mais próxima da consulta ou None"""
+        consulta_norm = normalizar_texto(consulta)
+        if not consulta_norm:
+            return None
+
+        idx = self._exatas.get(consulta_norm)
+        if idx is not None:
+            return self._valores[idx]
+
+        # Trigramas muito frequentes (ex: " de") pouco discriminam e custam
+        # caro; são ignorados quando existem trigramas mais raros na consulta
+        postings = [self._postings[tri] for tri in _trigramas(consulta_norm) if tri in self._postings]
+        limite_frequencia = max(64, len(self._chaves) // 20)
+        raros = [p for p in postings if len(p) <= limite_frequencia]
+        contagem = Counter()
+        for lista in (raros or postings):
+            contagem.update(lista)
+        if not contagem:
+            return None
+
+        melhor_idx = None
+        melhor_dist = None
+        for idx, _ in contagem.most_common(self.max_candidatos):
+            chave = self._chaves[idx]
+            limite = max(1, len(chave) // 4)
+            dist = self._distancia(consulta_norm, chave, limite)
+            if dist > limite:
+                continue
+            # Empate: preferir a chave mais longa (mais específica)
+            if melhor_dist is None or (dist, -len(chave)) < (melhor_dist, -len(self._chaves[melhor_idx])):
+                melhor_idx, melhor_dist = idx, dist
+                if dist == 0 and len(chave) >= len(consulta_norm):
+                    break
+
+        return self._valores[melhor_idx] if melhor_idx is not None else None
+
+
+# Tabelas de conteúdo montadas uma única vez na importação e compartilhadas (imutáveis)
+# entre requisições; as chaves de busca já ficam sem acentos e minúsculas
+
+# Base de conhecimento simulada para diferentes tópicos de estudo
+BASE_CONHECIMENTO = congelar({
+    "matematica": [
+        {
+            "titulo": "Khan Academy - Matemática",
+            "url": "https://pt.khanacademy.org/math",
+            "snippet": "Aprenda matemática gratuitamente com vídeos e exercícios interativos"
         },
-        "segunda guerra": {
-            "conceito": "Conflito global entre 1939-1945 envolvendo Aliados vs Eixo",
-            "pontos_principais": [
-                "Causas: Tratado de Versalhes, crise econômica, totalitarismo",
-                "Principais países: Alemanha, Itália, Japão (Eixo) vs EUA, Reino Unido, URSS (Aliados)",
-                "Eventos importantes: Pearl Harbor, Dia D, Bombas atômicas",
-                "Consequências: ONU, Guerra Fria, descolonização"
+        {
+            "titulo": "Técnicas de Estudo para Matemática",
+            "url": "https://exemplo.com/tecnicas-matematica",
+            "snippet": "Pratique regularmente, entenda conceitos ao invés de decorar fórmulas, refaça exercícios errados"
+        },
+        {
+            "titulo": "Calculadora Científica Online",
+            "url": "https://www.wolframalpha.com",
+            "snippet": "Resolva equações e visualize gráficos com WolframAlpha"
+        }
+    ],
+    "historia": [
+        {
+            "titulo": "Brasil Escola - História",
+            "url": "https://brasilescola.uol.com.br/historia",
+            "snippet": "Conteúdo completo de história do Brasil e história geral"
+        },
+        {
+            "titulo": "Dicas para Estudar História",
+            "url": "https://exemplo.com/dicas-historia",
+            "snippet": "Crie linhas do tempo, conecte eventos causais, use mapas mentais"
+        }
+    ],
+    "portugues": [
+        {
+            "titulo": "Português - Gramática e Literatura",
+            "url": "https://exemplo.com/portugues",
+            "snippet": "Guia completo de gramática, literatura e redação"
+        },
+        {
+            "titulo": "Acordo Ortográfico - Guia Prático",
+            "url": "https://exemplo.com/acordo-ortografico",
+            "snippet": "Entenda as mudanças da reforma ortográfica com exemplos práticos"
+        }
+    ],
+    "fisica": [
+        {
+            "titulo": "Física Interativa",
+            "url": "https://phet.colorado.edu/pt_BR",
+            "snippet": "Simulações interativas de física para facilitar o entendimento de conceitos"
+        },
+        {
+            "titulo": "Fórmulas de Física - Guia Completo",
+            "url": "https://exemplo.com/formulas-fisica",
+            "snippet": "Principais fórmulas de mecânica, termodinâmica, eletromagnetismo e óptica"
+        }
+    ],
+    "quimica": [
+        {
+            "titulo": "Tabela Periódica Interativa",
+            "url": "https://ptable.com/pt",
+            "snippet": "Explore elementos químicos com informações detalhadas e propriedades"
+        },
+        {
+            "titulo": "Química Orgânica - Reações e Mecanismos",
+            "url": "https://exemplo.com/quimica-organica",
+            "snippet": "Guia completo de reações orgânicas, nomenclatura e mecanismos"
+        }
+    ],
+    "biologia": [
+        {
+            "titulo": "Só Biologia - Conteúdo Completo",
+            "url": "https://www.sobiologia.com.br",
+            "snippet": "Citologia, genética, ecologia, evolução e fisiologia explicados"
+        },
+        {
+            "titulo": "Atlas de Anatomia Humana",
+            "url": "https://exemplo.com/anatomia",
+            "snippet": "Ilustrações detalhadas dos sistemas do corpo humano"
+        }
+    ],
+    "ingles": [
+        {
+            "titulo": "Duolingo - Aprenda Inglês Grátis",
+            "url": "https://www.duolingo.com",
+            "snippet": "Pratique inglês de forma gamificada e interativa"
+        },
+        {
+            "titulo": "BBC Learning English",
+            "url": "https://www.bbc.co.uk/learningenglish",
+            "snippet": "Recursos gratuitos para melhorar gramática, vocabulário e pronúncia"
+        }
+    ],
+    "redacao": [
+        {
+            "titulo": "Guia de Redação ENEM",
+            "url": "https://exemplo.com/redacao-enem",
+            "snippet": "Estrutura, competências, repertório sociocultural e temas frequentes"
+        },
+        {
+            "titulo": "Banco de Redações Nota 1000",
+            "url": "https://exemplo.com/redacoes-nota-1000",
+            "snippet": "Exemplos comentados de redações que tiraram nota máxima"
+        }
+    ],
+    "memorizar": [
+        {
+            "titulo": "Técnicas de Memorização - Palácio da Memória",
+            "url": "https://exemplo.com/palacio-memoria",
+            "snippet": "Use visualização espacial para memorizar grandes quantidades de informação"
+        },
+        {
+            "titulo": "Flashcards Anki - Sistema de Repetição Espaçada",
+            "url": "https://apps.ankiweb.net",
+            "snippet": "Software gratuito que otimiza a retenção de longo prazo"
+        },
+        {
+            "titulo": "Mnemônicos e Acrônimos para Estudos",
+            "url": "https://exemplo.com/mnemonicos",
+            "snippet": "Crie associações criativas para lembrar listas, fórmulas e conceitos"
+        }
+    ],
+    "organizacao": [
+        {
+            "titulo": "Como Criar um Cronograma de Estudos Eficiente",
+            "url": "https://exemplo.com/cronograma",
+            "snippet": "Planeje horários fixos, intercale matérias e inclua pausas estratégicas"
+        },
+        {
+            "titulo": "Notion para Estudantes",
+            "url": "https://www.notion.so",
+            "snippet": "Organize anotações, tarefas e projetos em um workspace digital"
+        }
+    ],
+    "concentracao": [
+        {
+            "titulo": "Técnica Pomodoro - Estudo Focado",
+            "url": "https://francescocirillo.com/pages/pomodoro-technique",
+            "snippet": "Estude 25 minutos, descanse 5. Melhora foco e produtividade drasticamente"
+        },
+        {
+            "titulo": "Como Evitar Distrações Durante o Estudo",
+            "url": "https://exemplo.com/evitar-distracoes",
+            "snippet": "Desligue notificações, use bloqueadores de sites e crie ambiente adequado"
+        }
+    ],
+    "enem": [
+        {
+            "titulo": "Guia Completo do ENEM 2025",
+            "url": "https://exemplo.com/enem-2025",
+            "snippet": "Datas, conteúdo programático, dicas de estudo e simulados"
+        },
+        {
+            "titulo": "Questões Comentadas ENEM",
+            "url": "https://exemplo.com/questoes-enem",
+            "snippet": "Resolução detalhada de provas anteriores por disciplina"
+        }
+    ],
+    "vestibular": [
+        {
+            "titulo": "Estratégias para Vestibulares Concorridos",
+            "url": "https://exemplo.com/vestibular-estrategias",
+            "snippet": "Foco em editais específicos, provas anteriores e simulados cronometrados"
+        }
+    ]
+})
+
+# Mapeamento de palavras-chave para temas, normalizadas como a query
+PALAVRAS_CHAVE_TEMAS = tuple(
+    (tema, tuple(normalizar_texto(palavra) for palavra in palavras))
+    for tema, palavras in {
+        "matematica": ["matematica", "calculo", "algebra", "geometria", "equacao"],
+        "fisica": ["fisica", "mecanica", "termodinamica", "eletricidade", "optica"],
+        "quimica": ["quimica", "reacao", "tabela periodica", "organica", "inorganica"],
+        "biologia": ["biologia", "celula", "genetica", "ecologia", "anatomia"],
+        "historia": ["historia", "historico", "guerra", "revolucao", "imperio"],
+        "portugues": ["portugues", "gramatica", "literatura", "ortografia", "sintaxe"],
+        "ingles": ["ingles", "english", "vocabulary", "grammar"],
+        "redacao": ["redacao", "dissertacao", "texto", "enem redacao"],
+        "memorizar": ["memorizar", "memoria", "decorar", "lembrar", "memorização"],
+        "organizacao": ["organizar", "cronograma", "planejar", "rotina"],
+        "concentracao": ["concentrar", "foco", "atencao", "pomodoro", "distracao"],
+        "enem": ["enem", "exame nacional"],
+        "vestibular": ["vestibular", "fuvest", "unicamp", "unesp"]
+    }.items()
+)
+PALAVRAS_GERAIS_ESTUDO = ("estudo", "estudar", "aprender", "tecnica", "dica", "ajuda")
+TEMAS_ESTUDO_GERAL = ("memorizar", "concentracao", "organizacao")
+
+SIMULADO_MAX_QUESTOES = 20
+
+# Base de questões por matéria
+QUESTOES_BASE = congelar({
+    "matematica": [
+        {
+            "enunciado": "Qual é o valor de x na equação 2x + 5 = 15?",
+            "alternativas": ["A) 3", "B) 5", "C) 7", "D) 10", "E) 15"],
+            "resposta_correta": "B",
+            "explicacao": "2x = 15 - 5 → 2x = 10 → x = 5",
+            "dificuldade": "facil"
+        },
+        {
+            "enunciado": "A área de um triângulo com base 8cm e altura 6cm é:",
+            "alternativas": ["A) 14 cm²", "B) 24 cm²", "C) 28 cm²", "D) 48 cm²", "E) 56 cm²"],
+            "resposta_correta": "B",
+            "explicacao": "Área = (base × altura) / 2 = (8 × 6) / 2 = 24 cm²",
+            "dificuldade": "medio"
+        },
+        {
+            "enunciado": "Qual é a derivada de f(x) = 3x² + 2x - 1?",
+            "alternativas": ["A) 6x + 2", "B) 3x + 2", "C) 6x - 1", "D) 3x² + 2", "E) 6x"],
+            "resposta_correta": "A",
+            "explicacao": "f'(x) = 6x + 2 (regra da potência)",
+            "dificuldade": "dificil"
+        }
+    ],
+    "fisica": [
+        {
+            "enunciado": "A fórmula da velocidade média é:",
+            "alternativas": ["A) v = d/t", "B) v = t/d", "C) v = d×t", "D) v = a×t", "E) v = m×a"],
+            "resposta_correta": "A",
+            "explicacao": "Velocidade média = distância / tempo",
+            "dificuldade": "facil"
+        },
+        {
+            "enunciado": "Um corpo em queda livre acelera a aproximadamente:",
+            "alternativas": ["A) 5 m/s²", "B) 9,8 m/s²", "C) 15 m/s²", "D) 20 m/s²", "E) 30 m/s²"],
+            "resposta_correta": "B",
+            "explicacao": "A aceleração da gravidade na Terra é aproximadamente 9,8 m/s²",
+            "dificuldade": "medio"
+        },
+        {
+            "enunciado": "A energia cinética é dada pela fórmula:",
+            "alternativas": ["A) Ec = mv", "B) Ec = mv²", "C) Ec = mv²/2", "D) Ec = mgh", "E) Ec = ma"],
+            "resposta_correta": "C",
+            "explicacao": "Energia cinética = (massa × velocidade²) / 2",
+            "dificuldade": "dificil"
+        }
+    ],
+    "quimica": [
+        {
+            "enunciado": "Quantos prótons tem o átomo de Carbono (C)?",
+            "alternativas": ["A) 4", "B) 6", "C) 8", "D) 12", "E) 14"],
+            "resposta_correta": "B",
+            "explicacao": "O número atômico do Carbono é 6, portanto tem 6 prótons",
+            "dificuldade": "facil"
+        },
+        {
+            "enunciado": "A fórmula da água é:",
+            "alternativas": ["A) H₂O", "B) HO", "C) H₃O", "D) H₂O₂", "E) HO₂"],
+            "resposta_correta": "A",
+            "explicacao": "Água é formada por 2 átomos de Hidrogênio e 1 de Oxigênio",
+            "dificuldade": "facil"
+        },
+        {
+            "enunciado": "O pH neutro na escala de pH é:",
+            "alternativas": ["A) 0", "B) 3", "C) 7", "D) 10", "E) 14"],
+            "resposta_correta": "C",
+            "explicacao": "pH 7 é neutro (nem ácido nem básico)",
+            "dificuldade": "medio"
+        }
+    ],
+    "biologia": [
+        {
+            "enunciado": "A menor unidade viva dos seres vivos é:",
+            "alternativas": ["A) Molécula", "B) Célula", "C) Tecido", "D) Órgão", "E) Átomo"],
+            "resposta_correta": "B",
+            "explicacao": "A célula é a unidade básica da vida",
+            "dificuldade": "facil"
+        },
+        {
+            "enunciado": "A fotossíntese ocorre principalmente nas:",
+            "alternativas": ["A) Raízes", "B) Flores", "C) Folhas", "D) Frutos", "E) Sementes"],
+            "resposta_correta": "C",
+            "explicacao": "As folhas contêm clorofila para realizar fotossíntese",
+            "dificuldade": "medio"
+        },
+        {
+            "enunciado": "O DNA é uma molécula de:",
+            "alternativas": ["A) Proteína", "B) Lipídio", "C) Carboidrato", "D) Ácido nucleico", "E) Vitamina"],
+            "resposta_correta": "D",
+            "explicacao": "DNA (ácido desoxirribonucleico) é um ácido nucleico",
+            "dificuldade": "medio"
+        }
+    ],
+    "historia": [
+        {
+            "enunciado": "A Independência do Brasil ocorreu em:",
+            "alternativas": ["A) 1500", "B) 1789", "C) 1822", "D) 1889", "E) 1922"],
+            "resposta_correta": "C",
+            "explicacao": "O Brasil declarou independência em 7 de setembro de 1822",
+            "dificuldade": "facil"
+        },
+        {
+            "enunciado": "A Revolução Francesa aconteceu no século:",
+            "alternativas": ["A) XVI", "B) XVII", "C) XVIII", "D) XIX", "E) XX"],
+            "resposta_correta": "C",
+            "explicacao": "A Revolução Francesa começou em 1789 (século XVIII)",
+            "dificuldade": "medio"
+        }
+    ],
+    "portugues": [
+        {
+            "enunciado": "Qual é o plural de 'cidadão'?",
+            "alternativas": ["A) cidadões", "B) cidadães", "C) cidadãos", "D) cidadans", "E) cidadaos"],
+            "resposta_correta": "C",
+            "explicacao": "Palavras terminadas em -ão podem fazer plural em -ãos",
+            "dificuldade": "facil"
+        },
+        {
+            "enunciado": "Qual frase está correta?",
+            "alternativas": [
+                "A) Haviam muitas pessoas", 
+                "B) Havia muitas pessoas", 
+                "C) Houveram muitas pessoas",
+                "D) Houve muitas pessoas",
+                "E) Ambas B e D"
             ],
-            "palavras_chave": ["Hitler", "nazismo", "holocausto", "aliados", "eixo"],
-            "dica_memorizacao": "1939-1945: Eixo (A-I-J) vs Aliados (EUA-UK-URSS)"
+            "resposta_correta": "E",
+            "explicacao": "O verbo 'haver' no sentido de existir é impessoal (singular)",
+            "dificuldade": "medio"
         }
+    ]
+})
+
+
+def _indexar_questoes(questoes) -> dict:
+    """
+    Questões de uma matéria por dificuldade (None = todas). Cada questão vira
+    a tupla das suas visões imutáveis já numeradas de 1 a SIMULADO_MAX_QUESTOES,
+    então o simulado só escolhe visões prontas, sem copiar dicts
+    """
+    numeradas = [
+        (questao["dificuldade"], tuple(
+            DictImutavel({**questao, "numero": numero}) for numero in range(1, SIMULADO_MAX_QUESTOES + 1)
+        ))
+        for questao in questoes
+    ]
+    indice = {None: tuple(visoes for _, visoes in numeradas)}
+    for dificuldade, visoes in numeradas:
+        indice[dificuldade] = indice.get(dificuldade, ()) + (visoes,)
+    return indice
+
+
+QUESTOES_POR_MATERIA = {
+    normalizar_texto(materia): _indexar_questoes(questoes) for materia, questoes in QUESTOES_BASE.items()
+}
+
+DICAS_GERAIS = congelar({
+    "curta": "Sessão rápida: foco em revisão e exercícios",
+    "media": "Tempo ideal para: teoria + prática + revisão",
+    "longa": "Sessão extensa: aprofunde conceitos e faça muitos exercícios"
+})
+
+# Dicas específicas por matéria (chave normalizada, dica)
+DICAS_ESPECIFICAS = (
+    ("matematica", "Use muitos exercícios práticos"),
+    ("fisica", "Desenhe diagramas e esquemas"),
+    ("quimica", "Revise reações e faça resumos"),
+    ("historia", "Crie linhas do tempo"),
+    ("portugues", "Leia e pratique redação"),
+    ("biologia", "Use mapas mentais")
+)
+
+
+# Base de resumos (chave → conteúdo), imutável e indexada uma única vez na importação
+RESUMOS_BASE = congelar({
+    "fotossintese": {
+        "conceito": "Processo pelo qual plantas convertem luz solar em energia química",
+        "pontos_principais": [
+            "Ocorre nos cloroplastos das células vegetais",
+            "Equação: 6CO₂ + 6H₂O + luz → C₆H₁₂O₆ + 6O₂",
+            "Libera oxigênio para a atmosfera",
+            "Fase clara e fase escura (Ciclo de Calvin)"
+        ],
+        "palavras_chave": ["clorofila", "luz", "glicose", "oxigênio", "CO₂"],
+        "dica_memorizacao": "Lembre-se: Luz + CO₂ + Água = Glicose + O₂"
+    },
+    "segunda guerra": {
+        "conceito": "Conflito global entre 1939-1945 envolvendo Aliados vs Eixo",
+        "pontos_principais": [
+            "Causas: Tratado de Versalhes, crise econômica, totalitarismo",
+            "Principais países: Alemanha, Itália, Japão (Eixo) vs EUA, Reino Unido, URSS (Aliados)",
+            "Eventos importantes: Pearl Harbor, Dia D, Bombas atômicas",
+            "Consequências: ONU, Guerra Fria, descolonização"
+        ],
+        "palavras_chave": ["Hitler", "nazismo", "holocausto", "aliados", "eixo"],
+        "dica_memorizacao": "1939-1945: Eixo (A-I-J) vs Aliados (EUA-UK-URSS)"
     }
+})
+
+TECNICAS_ESTUDO = congelar([
+    "Faça mapas mentais visuais",
+    "Crie flashcards com os pontos principais",
+    "Explique o conceito para outra pessoa",
+    "Resolva exercícios práticos"
+])
+
+# Sinônimos adicionais que apontam para as mesmas chaves de RESUMOS_BASE
+SINONIMOS_RESUMOS = {
+    "segunda guerra mundial": "segunda guerra",
+    "2a guerra mundial": "segunda guerra",
+    "ii guerra mundial": "segunda guerra"
+}
+
+INDICE_RESUMOS = IndiceTopicos(
+    [(chave, chave) for chave in RESUMOS_BASE]
+    + list(SINONIMOS_RESUMOS.items())
+)
+
+
+def criar_resumo(topico: str, materia: str, tipo: str) -> dict:
+    """
+    Gera resumo estruturado de um tópico
+
+    O resultado é imutável e compartilhado: respostas são memorizadas por
+    (tópico com espaços normalizados, matéria, tipo)
+    """
+    return _resumo_memorizado(' '.join(topico.split()), materia.strip().lower(), tipo)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _resumo_memorizado(topico: str, materia: str, tipo: str) -> DictImutavel:
+    """Resumo congelado para a combinação (tópico, matéria, tipo)"""
     
-    # Buscar resumo específico ou criar genérico
-    topico_lower = topico.lower()
-    resumo_encontrado = None
-    
-    for key in resumos_base.keys():
-        if key in topico_lower or topico_lower in key:
-            resumo_encontrado = resumos_base[key]
-            break
+    # Buscar resumo específico no índice ou criar genérico
+    chave = INDICE_RESUMOS.buscar(topico)
+    resumo_encontrado = RESUMOS_BASE[chave] if chave else None
     
     if not resumo_encontrado:
         # Criar resumo genérico
@@ -1095,7 +2590,16 @@ def criar_resumo(topico: str, materia: str, tipo: str) -> dict:
             "dica_memorizacao": f"Revise {topico} regularmente para fixar o conteúdo"
         }
     
-    # Ajustar conteúdo baseado no tipo
+    return congelar(formatar_resumo(congelar(resumo_encontrado), topico, tipo))
+
+
+def formatar_resumo(resumo_encontrado: dict, topico: str, tipo: str) -> dict:
+    """
+    Ajusta o conteúdo de um resumo conforme o tipo solicitado
+
+    Nunca altera resumo_encontrado: cada tipo é uma nova visão que
+    compartilha as listas do resumo original
+    """
     if tipo == 'rapido':
         return {
             "conceito": resumo_encontrado["conceito"],
@@ -1105,17 +2609,272 @@ def criar_resumo(topico: str, materia: str, tipo: str) -> dict:
     elif tipo == 'completo':
         return resumo_encontrado
     else:  # detalhado
-        resumo_encontrado["mapa_mental"] = {
-            "centro": topico,
-            "ramificacoes": resumo_encontrado["palavras_chave"]
+        return {
+            **resumo_encontrado,
+            "mapa_mental": {
+                "centro": topico,
+                "ramificacoes": resumo_encontrado["palavras_chave"]
+            },
+            "tecnicas_estudo": TECNICAS_ESTUDO
         }
-        resumo_encontrado["tecnicas_estudo"] = [
-            "Faça mapas mentais visuais",
-            "Crie flashcards com os pontos principais",
-            "Explique o conceito para outra pessoa",
-            "Resolva exercícios práticos"
-        ]
-        return resumo_encontrado
+
+
+# ============ RESUMO EXTRATIVO DE TEXTO ============
+
+# Limite de caracteres do texto enviado (~50 páginas de livro)
+LIMITE_TEXTO_RESUMO = 500_000
+
+# Sentenças por bloco: textos longos são ranqueados bloco a bloco e os
+# melhores candidatos de cada bloco disputam o resumo final
+BLOCO_SENTENCAS = 200
+
+# Quantidade de pontos principais e palavras-chave por tipo de resumo
+PONTOS_POR_TIPO = {"rapido": 2, "completo": 4, "detalhado": 6}
+PALAVRAS_CHAVE_POR_TIPO = {"rapido": 3, "completo": 5, "detalhado": 8}
+
+STOPWORDS_PT = frozenset("""
+    a ao aos as ate apos com como da das de dela dele deles do dos e ela elas
+    ele eles em entre era eram essa esse esta estao este foi for foram ha isso
+    isto ja la lhe mais mas me mesmo muito na nas nao nem no nos num numa o os
+    ou para pela pelas pelo pelos por pode podem qual quais quando que quem se
+    sem ser seu seus sua suas sao so sob sobre tambem tem ter toda todas todo
+    todos um uma umas uns voce cada onde assim porque pois apenas ainda depois
+    antes seja sendo sido tinha tem estar esta forma parte outro outra outros
+    outras tal tais the and of to in is are
+""".split())
+
+_SEPARADOR_SENTENCAS = re.compile(r'(?<=[.!?;])\s+|\n\s*\n|\n\s*[-•*]\s*')
+_PALAVRA = re.compile(r'[^\W\d_]+')
+
+
+def _remover_acentos(texto: str) -> str:
+    """Remove acentos preservando o número de caracteres alfabéticos"""
+    decomposto = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in decomposto if not unicodedata.combining(c))
+
+
+def _dividir_sentencas(texto: str) -> list:
+    """Divide o texto em sentenças (pontuação, parágrafos e marcadores de lista)"""
+    sentencas = []
+    for trecho in _SEPARADOR_SENTENCAS.split(texto):
+        trecho = ' '.join(trecho.split())
+        if trecho:
+            sentencas.append(trecho)
+    return sentencas
+
+
+def _textrank(vetores: np.ndarray, amortecimento: float = 0.85,
+              iteracoes: int = 50, tolerancia: float = 1e-6) -> np.ndarray:
+    """PageRank sobre o grafo de similaridade de cosseno entre sentenças"""
+    n = vetores.shape[0]
+    if n == 1:
+        return np.ones(1)
+    similaridade = vetores @ vetores.T
+    np.fill_diagonal(similaridade, 0.0)
+    soma = similaridade.sum(axis=1, keepdims=True)
+    soma[soma == 0] = 1.0
+    transicao = (similaridade / soma).T
+    scores = np.full(n, 1.0 / n)
+    for _ in range(iteracoes):
+        novo = (1 - amortecimento) / n + amortecimento * (transicao @ scores)
+        if np.abs(novo - scores).sum() < tolerancia:
+            return novo
+        scores = novo
+    return scores
+
+
+class _CorpusSentencas:
+    """Sentenças tokenizadas com IDF global, em formato esparso (COO) por sentença"""
+
+    def __init__(self, texto: str):
+        self.sentencas = _dividir_sentencas(texto)
+        self.vocabulario = {}
+        self.forma_original = []
+        self.termos = []
+        df = Counter()
+
+        for sentenca in self.sentencas:
+            originais = _PALAVRA.findall(sentenca.casefold())
+            normalizadas = _PALAVRA.findall(_remover_acentos(sentenca.casefold()))
+            if len(originais) != len(normalizadas):
+                originais = normalizadas
+            ids = []
+            for original, palavra in zip(originais, normalizadas):
+                if len(palavra) < 3 or palavra in STOPWORDS_PT:
+                    continue
+                termo_id = self.vocabulario.get(palavra)
+                if termo_id is None:
+                    termo_id = self.vocabulario[palavra] = len(self.forma_original)
+                    self.forma_original.append(original)
+                ids.append(termo_id)
+            self.termos.append(np.asarray(ids, dtype=np.int32))
+            df.update(set(ids))
+
+        n = max(len(self.sentencas), 1)
+        contagem_df = np.zeros(len(self.vocabulario), dtype=np.float64)
+        for termo_id, freq in df.items():
+            contagem_df[termo_id] = freq
+        self.idf = np.log((n + 1) / (contagem_df + 1)) + 1.0
+
+    def vetores(self, indices) -> np.ndarray:
+        """Matriz TF-IDF normalizada (L2) das sentenças indicadas, só com os termos presentes"""
+        linhas = [self.termos[i] for i in indices]
+        tamanhos = np.fromiter((len(t) for t in linhas), dtype=np.int64, count=len(linhas))
+        if not tamanhos.sum():
+            return np.zeros((len(linhas), 1))
+        colunas_globais = np.concatenate(linhas)
+        termos_locais, colunas = np.unique(colunas_globais, return_inverse=True)
+        matriz = np.zeros((len(linhas), len(termos_locais)))
+        np.add.at(matriz, (np.repeat(np.arange(len(linhas)), tamanhos), colunas), 1.0)
+        matriz *= self.idf[termos_locais]
+        normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+        normas[normas == 0] = 1.0
+        return matriz / normas
+
+    def palavras_chave(self, indices, quantidade: int) -> list:
+        """Termos com maior peso TF-IDF acumulado nas sentenças indicadas"""
+        if not len(indices):
+            return []
+        todos = np.concatenate([self.termos[i] for i in indices])
+        if not len(todos):
+            return []
+        pesos = np.bincount(todos, minlength=len(self.idf)) * self.idf
+        quantidade = min(quantidade, int(np.count_nonzero(pesos)))
+        melhores = np.argpartition(-pesos, quantidade - 1)[:quantidade]
+        melhores = melhores[np.argsort(-pesos[melhores], kind='stable')]
+        return [self.forma_original[i] for i in melhores]
+
+
+def _selecionar_sentencas(corpus: _CorpusSentencas, indices: np.ndarray, quantidade: int) -> np.ndarray:
+    """Ranqueia as sentenças indicadas por TextRank e retorna as melhores (ordem de score)"""
+    scores = _textrank(corpus.vetores(indices))
+    quantidade = min(quantidade, len(indices))
+    melhores = np.argpartition(-scores, quantidade - 1)[:quantidade]
+    melhores = melhores[np.argsort(-scores[melhores], kind='stable')]
+    return indices[melhores]
+
+
+def _montar_resumo_extrativo(corpus: _CorpusSentencas, ranqueadas: np.ndarray,
+                             indices: np.ndarray, tipo: str) -> dict:
+    """Monta conceito, pontos principais (na ordem do texto) e palavras-chave"""
+    conceito = corpus.sentencas[ranqueadas[0]]
+    pontos = sorted(int(i) for i in ranqueadas[1:PONTOS_POR_TIPO[tipo] + 1])
+    return {
+        "conceito": conceito,
+        "pontos_principais": [corpus.sentencas[i] for i in pontos],
+        "palavras_chave": corpus.palavras_chave(indices, PALAVRAS_CHAVE_POR_TIPO[tipo])
+    }
+
+
+def resumir_texto_incremental(texto: str, tipo: str = 'completo'):
+    """
+    Resumo extrativo (TF-IDF + TextRank) de um texto do estudante, sem rede
+
+    Gera um resumo parcial por bloco de BLOCO_SENTENCAS sentenças e, por fim,
+    o resumo do texto inteiro ({"final": True, "resumo": {...}}).
+    Textos curtos (um bloco só) produzem apenas o resultado final.
+    """
+    corpus = _CorpusSentencas(texto)
+    # Sentenças muito curtas (títulos, fragmentos) não disputam o resumo
+    elegiveis = np.array([i for i, t in enumerate(corpus.termos) if len(t) >= 3], dtype=np.int64)
+    if not len(elegiveis):
+        elegiveis = np.array([i for i, t in enumerate(corpus.termos) if len(t)], dtype=np.int64)
+    if not len(elegiveis):
+        raise ValueError("Texto sem conteúdo suficiente para resumir")
+
+    por_bloco = PONTOS_POR_TIPO[tipo] + 1
+    blocos = [elegiveis[i:i + BLOCO_SENTENCAS] for i in range(0, len(elegiveis), BLOCO_SENTENCAS)]
+
+    if len(blocos) == 1:
+        ranqueadas = _selecionar_sentencas(corpus, elegiveis, por_bloco)
+        yield {"final": True, "resumo": _montar_resumo_extrativo(corpus, ranqueadas, elegiveis, tipo)}
+        return
+
+    candidatos = []
+    for numero, bloco in enumerate(blocos, 1):
+        ranqueadas = _selecionar_sentencas(corpus, bloco, por_bloco)
+        candidatos.append(ranqueadas)
+        yield {
+            "final": False,
+            "bloco": numero,
+            "total_blocos": len(blocos),
+            "resumo": _montar_resumo_extrativo(corpus, ranqueadas, bloco, tipo)
+        }
+
+    candidatos = np.sort(np.concatenate(candidatos))
+    ranqueadas = _selecionar_sentencas(corpus, candidatos, por_bloco)
+    yield {"final": True, "resumo": _montar_resumo_extrativo(corpus, ranqueadas, elegiveis, tipo)}
+
+
+def resumir_texto(texto: str, topico: str = '', tipo: str = 'completo') -> dict:
+    """Resumo extrativo do texto inteiro, no mesmo formato de criar_resumo"""
+    resultado = None
+    for resultado in resumir_texto_incremental(texto, tipo):
+        pass
+    resumo = resultado["resumo"]
+    if tipo == 'rapido':
+        return resumo
+    resumo["dica_memorizacao"] = (
+        f"Revise {topico or 'o texto'} a partir das palavras-chave: "
+        + ", ".join(resumo["palavras_chave"][:3])
+    )
+    return formatar_resumo(resumo, topico or "Texto enviado", tipo)
+
+
+# Uma sessão não passa de um dia de estudo; acima disso é erro do cliente
+SESSAO_MAX_MINUTOS = 24 * 60
+
+
+def validar_sessao(dados: dict, aceitar_data: bool = False) -> dict:
+    """
+    Valida e normaliza uma sessão de estudo (levanta ValueError com o motivo)
+    
+    Com aceitar_data=True, data_registro (ISO 8601) pode vir do cliente,
+    como em importações de histórico; caso contrário é o momento atual.
+    """
+    usuario_id = dados.get('usuario_id', 'default')
+    if not isinstance(usuario_id, str) or not usuario_id.strip():
+        raise ValueError("Usuário inválido")
+    
+    materia = dados.get('materia', '')
+    if not isinstance(materia, str) or not materia.strip():
+        raise ValueError("Matéria não fornecida")
+    
+    tempo_minutos = dados.get('tempo_minutos', 0)
+    if isinstance(tempo_minutos, bool) or not isinstance(tempo_minutos, (int, float)) or tempo_minutos < 1:
+        raise ValueError("Tempo de estudo inválido")
+    # inf/NaN (ex.: 1e400 no JSON) e valores enormes não cabem no INTEGER do SQLite
+    if not math.isfinite(tempo_minutos) or tempo_minutos > SESSAO_MAX_MINUTOS:
+        raise ValueError(f"Tempo de estudo deve ser de até {SESSAO_MAX_MINUTOS} minutos")
+    
+    topicos_estudados = dados.get('topicos_estudados', [])
+    if not isinstance(topicos_estudados, list) or not all(isinstance(t, str) for t in topicos_estudados):
+        raise ValueError("Tópicos estudados devem ser uma lista de textos")
+    
+    grupos = {}
+    for campo in ('turma', 'escola'):
+        valor = dados.get(campo)
+        if valor is not None and (not isinstance(valor, str) or not valor.strip()):
+            raise ValueError(f"Campo {campo} inválido")
+        grupos[campo] = valor.strip() if valor else None
+    
+    data_registro = dados.get('data_registro') if aceitar_data else None
+    if data_registro is None:
+        data_registro = datetime.now().isoformat()
+    else:
+        try:
+            data_registro = datetime.fromisoformat(data_registro).isoformat()
+        except (TypeError, ValueError):
+            raise ValueError("Data de registro inválida (use ISO 8601)") from None
+    
+    return {
+        "usuario_id": usuario_id.strip(),
+        "materia": materia.strip(),
+        "tempo_minutos": int(tempo_minutos),
+        "topicos_estudados": topicos_estudados,
+        "data_registro": data_registro,
+        **grupos
+    }
 
 
 def calcular_pontos(tempo_minutos: int, num_topicos: int) -> int:
@@ -1138,11 +2897,9 @@ def gerar_mensagem_motivacao(tempo_minutos: int) -> str:
 
 
 def gerar_dashboard_demo(usuario_id: str, periodo: str) -> dict:
-    """Gera dashboard de demonstração com estatísticas"""
+    """Gera dashboard de demonstração com estatísticas aleatórias (ver gerar_dashboard)"""
     
     # Dados simulados (em produção viriam do banco de dados)
-    import random
-    
     if periodo == 'diario':
         total_horas = round(random.uniform(1, 4), 1)
         materias_estudadas = random.randint(2, 4)
@@ -1171,16 +2928,1170 @@ def gerar_dashboard_demo(usuario_id: str, periodo: str) -> dict:
             "Historia": round(total_horas * 0.10, 1),
             "Portugues": round(total_horas * 0.15, 1)
         },
-        "progresso_semanal": [
-            {"dia": "Seg", "horas": round(random.uniform(1, 3), 1)},
-            {"dia": "Ter", "horas": round(random.uniform(1, 3), 1)},
-            {"dia": "Qua", "horas": round(random.uniform(1, 3), 1)},
-            {"dia": "Qui", "horas": round(random.uniform(1, 3), 1)},
-            {"dia": "Sex", "horas": round(random.uniform(1, 3), 1)},
-            {"dia": "Sab", "horas": round(random.uniform(2, 4), 1)},
-            {"dia": "Dom", "horas": round(random.uniform(1, 2), 1)}
-        ],
-        "conquistas": [
+        "progresso_semanal": [
+            {"dia": "Seg", "horas": round(random.uniform(1, 3), 1)},
+            {"dia": "Ter", "horas": round(random.uniform(1, 3), 1)},
+            {"dia": "Qua", "horas": round(random.uniform(1, 3), 1)},
+            {"dia": "Qui", "horas": round(random.uniform(1, 3), 1)},
+            {"dia": "Sex", "horas": round(random.uniform(1, 3), 1)},
+            {"dia": "Sab", "horas": round(random.uniform(2, 4), 1)},
+            {"dia": "Dom", "horas": round(random.uniform(1, 2), 1)}
+        ],
+        "conquistas": [
+            {
+                "nome": "Estudante Dedicado",
+                "descricao": f"Estudou por {dias_consecutivos} dias consecutivos",
+                "icone": "🔥",
+                "desbloqueado": dias_consecutivos >= 5
+            },
+            {
+                "nome": "Maratonista",
+                "descricao": "Estudou mais de 3 horas em um dia",
+                "icone": "🏃",
+                "desbloqueado": periodo != 'diario' or total_horas > 3
+            },
+            {
+                "nome": "Multitask",
+                "descricao": "Estudou 5 ou mais matérias diferentes",
+                "icone": "🎯",
+                "desbloqueado": materias_estudadas >= 5
+            }
+        ],
+        "recomendacoes": [
+            "Continue mantendo a consistência nos estudos",
+            "Tente aumentar o tempo em matérias com menor dedicação",
+            "Faça pausas regulares para melhor absorção",
+            "Revise conteúdos antigos para fixação"
+        ],
+        "meta_semanal": {
+            "horas_objetivo": 20,
+            "horas_atual": total_horas if periodo == 'semanal' else random.randint(8, 15),
+            "percentual_atingido": round((total_horas / 20) * 100, 1) if periodo == 'semanal' else random.randint(40, 75)
+        }
+    }
+
+
+# ============ ARMAZENAMENTO DE PROGRESSO ============
+
+# Caminho do banco SQLite de progresso (no Azure, /tmp é local ao worker)
+PROGRESSO_DB_PATH = os.environ.get(
+    "PROGRESSO_DB_PATH", os.path.join(tempfile.gettempdir(), "estudai_progresso.db")
+)
+
+# Durabilidade das gravações (PRAGMA synchronous do SQLite):
+# - off: sem fsync (mais rápido, perde dados em queda do sistema)
+# - normal: em WAL, fsync apenas nos checkpoints (padrão)
+# - full: fsync a cada commit (cada group commit)
+PROGRESSO_DURABILIDADE = os.environ.get("PROGRESSO_DURABILIDADE", "normal").lower()
+NIVEIS_DURABILIDADE = {"off": "OFF", "normal": "NORMAL", "full": "FULL"}
+
+# Máximo de sessões gravadas por transação
+PROGRESSO_MAX_LOTE = 1024
+
+# Arquivos (shards) em que o progresso é particionado por hash estável do usuario_id;
+# cada shard tem seu próprio WAL e escritor. Mudar exige rebalancear (rebalancear_progresso.py)
+PROGRESSO_SHARDS = int(os.environ.get("PROGRESSO_SHARDS", "1"))
+
+# Importação em lote (NDJSON): sessões por gravação, linhas por requisição
+# e quantidade máxima de erros detalhados na resposta
+IMPORTACAO_LOTE = 500
+IMPORTACAO_MAX_LINHAS = 200_000
+IMPORTACAO_MAX_ERROS = 1000
+
+
+class ArmazenamentoProgresso:
+    """
+    Armazenamento local das sessões de estudo em SQLite no modo WAL
+
+    Escritas concorrentes usam group commit: cada thread enfileira suas
+    sessões; a primeira que encontra o banco livre vira líder, grava todas
+    as sessões pendentes em uma única transação e acorda as demais.
+    Leituras usam conexões próprias por thread e não bloqueiam escritas.
+    """
+
+    def __init__(self, caminho: str = PROGRESSO_DB_PATH,
+                 durabilidade: str = PROGRESSO_DURABILIDADE,
+                 max_lote: int = PROGRESSO_MAX_LOTE):
+        if durabilidade not in NIVEIS_DURABILIDADE:
+            raise ValueError(f"Durabilidade inválida: {durabilidade} (use off, normal ou full)")
+        self.caminho = caminho
+        self.durabilidade = durabilidade
+        self.max_lote = max_lote
+
+        self._conexao = self._conectar()
+        self._conexao.executescript("""
+            CREATE TABLE IF NOT EXISTS sessoes (
+                id INTEGER PRIMARY KEY,
+                usuario_id TEXT NOT NULL,
+                materia TEXT NOT NULL,
+                tempo_minutos INTEGER NOT NULL,
+                topicos TEXT NOT NULL,
+                pontos INTEGER NOT NULL,
+                data_registro TEXT NOT NULL,
+                turma TEXT,
+                escola TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessoes_usuario
+                ON sessoes (usuario_id, data_registro);
+            CREATE TABLE IF NOT EXISTS revisoes (
+                usuario_id TEXT NOT NULL,
+                item TEXT NOT NULL,
+                repeticoes INTEGER NOT NULL,
+                intervalo REAL NOT NULL,
+                facilidade REAL NOT NULL,
+                vencimento REAL NOT NULL,
+                PRIMARY KEY (usuario_id, item)
+            ) WITHOUT ROWID;
+        """)
+        # Bancos criados antes do ranking não têm as colunas de turma e escola
+        colunas = {linha[1] for linha in self._conexao.execute("PRAGMA table_info(sessoes)")}
+        for coluna in ("turma", "escola"):
+            if coluna not in colunas:
+                self._conexao.execute(f"ALTER TABLE sessoes ADD COLUMN {coluna} TEXT")
+
+        self._cond = threading.Condition()
+        self._pendentes = []
+        self._gravando = False
+        self._proximo_lote = 1
+        self._ultimo_lote_gravado = 0
+        self._erros_lote = {}
+        self._leitura = threading.local()
+        self.total_commits = 0
+
+    def _conectar(self) -> sqlite3.Connection:
+        conexao = sqlite3.connect(self.caminho, check_same_thread=False, isolation_level=None)
+        conexao.execute("PRAGMA journal_mode=WAL")
+        conexao.execute(f"PRAGMA synchronous={NIVEIS_DURABILIDADE[self.durabilidade]}")
+        conexao.execute("PRAGMA busy_timeout=5000")
+        return conexao
+
+    @staticmethod
+    def _linha(sessao: dict) -> tuple:
+        return (
+            sessao["usuario_id"],
+            sessao["materia"],
+            int(sessao["tempo_minutos"]),
+            json.dumps(sessao.get("topicos_estudados", []), ensure_ascii=False),
+            int(sessao.get("pontos", 0)),
+            sessao.get("data_registro") or datetime.now().isoformat(),
+            sessao.get("turma"),
+            sessao.get("escola")
+        )
+
+    def registrar(self, sessao: dict) -> None:
+        """Grava uma sessão; retorna quando ela estiver confirmada (commit)"""
+        self.registrar_lote([sessao])
+
+    def registrar_lote(self, sessoes) -> None:
+        """Grava várias sessões; retorna quando todas estiverem confirmadas"""
+        self.registrar_linhas([self._linha(s) for s in sessoes])
+
+    def registrar_linhas(self, linhas: list) -> None:
+        """Grava linhas já no formato da tabela (ver _linha e exportar_sessoes)"""
+        if not linhas:
+            return
+
+        with self._cond:
+            self._pendentes.extend(linhas)
+            # As linhas entram no próximo lote que ainda não começou a ser gravado
+            meu_lote = self._proximo_lote
+            while self._ultimo_lote_gravado < meu_lote:
+                if self._gravando:
+                    self._cond.wait()
+                    continue
+                self._gravar_pendentes()
+
+            erro = self._erros_lote.get(meu_lote)
+        if erro is not None:
+            raise erro
+
+    def _gravar_pendentes(self) -> None:
+        """Executado pela thread líder com self._cond adquirido"""
+        self._gravando = True
+        lote, self._pendentes = self._pendentes, []
+        numero = self._proximo_lote
+        self._proximo_lote += 1
+        erro = None
+
+        self._cond.release()
+        try:
+            self._conexao.execute("BEGIN")
+            try:
+                for inicio in range(0, len(lote), self.max_lote):
+                    self._conexao.executemany(
+                        "INSERT INTO sessoes (usuario_id, materia, tempo_minutos, topicos, pontos, "
+                        "data_registro, turma, escola) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        lote[inicio:inicio + self.max_lote]
+                    )
+                self._conexao.execute("COMMIT")
+            except Exception:
+                self._conexao.execute("ROLLBACK")
+                raise
+        except Exception as e:
+            logging.error(f"Erro ao gravar lote de progresso ({len(lote)} sessões): {str(e)}")
+            erro = e
+        finally:
+            self._cond.acquire()
+
+        if erro is not None:
+            self._erros_lote[numero] = erro
+            # Mantém só os erros recentes (as threads do lote já foram acordadas)
+            for antigo in [n for n in self._erros_lote if n < numero - 64]:
+                del self._erros_lote[antigo]
+        self.total_commits += 1
+        self._ultimo_lote_gravado = numero
+        self._gravando = False
+        self._cond.notify_all()
+
+    def _conexao_leitura(self) -> sqlite3.Connection:
+        conexao = getattr(self._leitura, "conexao", None)
+        if conexao is None:
+            conexao = self._leitura.conexao = self._conectar()
+        return conexao
+
+    def listar_sessoes(self, usuario_id: str, desde: str = None) -> list:
+        """Sessões do usuário em ordem de registro (opcionalmente a partir de uma data ISO)"""
+        sql = ("SELECT usuario_id, materia, tempo_minutos, topicos, pontos, data_registro "
+               "FROM sessoes WHERE usuario_id = ?")
+        parametros = [usuario_id]
+        if desde:
+            sql += " AND data_registro >= ?"
+            parametros.append(desde)
+        sql += " ORDER BY data_registro, id"
+        return [
+            {
+                "usuario_id": linha[0],
+                "materia": linha[1],
+                "tempo_minutos": linha[2],
+                "topicos_estudados": json.loads(linha[3]),
+                "pontos": linha[4],
+                "data_registro": linha[5]
+            }
+            for linha in self._conexao_leitura().execute(sql, parametros)
+        ]
+
+    def marca_leitura(self) -> int:
+        """Maior id gravado até agora: com iterar_sessoes(ate=...), lê um corte fixo da tabela"""
+        return self._conexao_leitura().execute("SELECT COALESCE(MAX(id), 0) FROM sessoes").fetchone()[0]
+
+    def iterar_sessoes(self, tamanho_lote: int = 10_000, ate: int = None):
+        """Todas as sessões (até o id `ate`) como tuplas (usuario_id, materia, tempo_minutos, pontos, data_registro)"""
+        cursor = self._conexao_leitura().execute(
+            "SELECT usuario_id, materia, tempo_minutos, pontos, data_registro FROM sessoes "
+            + ("WHERE id <= ? " if ate is not None else "") + "ORDER BY id",
+            (ate,) if ate is not None else ()
+        )
+        while True:
+            linhas = cursor.fetchmany(tamanho_lote)
+            if not linhas:
+                return
+            yield from linhas
+
+    def listar_membros(self) -> dict:
+        """Turma e escola mais recentes de cada usuário que as informou: {usuario_id: (turma, escola)}"""
+        membros = {}
+        for usuario_id, turma, escola in self._conexao_leitura().execute(
+            "SELECT usuario_id, turma, escola FROM sessoes "
+            "WHERE turma IS NOT NULL OR escola IS NOT NULL ORDER BY id"
+        ):
+            anterior = membros.get(usuario_id, (None, None))
+            membros[usuario_id] = (turma or anterior[0], escola or anterior[1])
+        return membros
+
+    def contar_sessoes(self) -> int:
+        """Total de sessões gravadas"""
+        return self._conexao_leitura().execute("SELECT COUNT(*) FROM sessoes").fetchone()[0]
+
+    def exportar_sessoes(self, tamanho_lote: int = 10_000):
+        """Lotes de linhas completas, no formato aceito por registrar_linhas"""
+        cursor = self._conexao_leitura().execute(
+            "SELECT usuario_id, materia, tempo_minutos, topicos, pontos, data_registro, turma, escola "
+            "FROM sessoes ORDER BY id"
+        )
+        while True:
+            linhas = cursor.fetchmany(tamanho_lote)
+            if not linhas:
+                return
+            yield linhas
+
+    def exportar_revisoes(self, tamanho_lote: int = 10_000):
+        """Lotes de linhas de revisão, no formato aceito por gravar_linhas_revisao"""
+        cursor = self._conexao_leitura().execute(
+            "SELECT usuario_id, item, repeticoes, intervalo, facilidade, vencimento FROM revisoes"
+        )
+        while True:
+            linhas = cursor.fetchmany(tamanho_lote)
+            if not linhas:
+                return
+            yield linhas
+
+    def gravar_revisoes(self, usuario_id: str, cartoes) -> None:
+        """Grava (insere ou substitui) cartões de revisão do usuário"""
+        self.gravar_linhas_revisao([
+            (usuario_id, c.item, c.repeticoes, c.intervalo, c.facilidade, c.vencimento)
+            for c in cartoes
+        ])
+
+    def gravar_linhas_revisao(self, linhas: list) -> None:
+        """Grava linhas (usuario_id, item, repeticoes, intervalo, facilidade, vencimento)"""
+        if not linhas:
+            return
+        # Usa a conexão de escrita fora de um lote: espera o líder atual e bloqueia o próximo
+        with self._cond:
+            while self._gravando:
+                self._cond.wait()
+            self._gravando = True
+        try:
+            self._conexao.execute("BEGIN")
+            try:
+                self._conexao.executemany(
+                    "INSERT OR REPLACE INTO revisoes (usuario_id, item, repeticoes, intervalo, facilidade, "
+                    "vencimento) VALUES (?, ?, ?, ?, ?, ?)",
+                    linhas
+                )
+                self._conexao.execute("COMMIT")
+            except Exception:
+                self._conexao.execute("ROLLBACK")
+                raise
+        finally:
+            with self._cond:
+                self._gravando = False
+                self._cond.notify_all()
+
+    def listar_revisoes(self, usuario_id: str) -> list:
+        """Cartões do usuário como tuplas (item, repeticoes, intervalo, facilidade, vencimento)"""
+        return self._conexao_leitura().execute(
+            "SELECT item, repeticoes, intervalo, facilidade, vencimento FROM revisoes WHERE usuario_id = ?",
+            (usuario_id,)
+        ).fetchall()
+
+    def fechar(self) -> None:
+        """Fecha a conexão de escrita e a de leitura desta thread (as demais fecham com suas threads)"""
+        conexao_leitura = getattr(self._leitura, "conexao", None)
+        if conexao_leitura is not None:
+            conexao_leitura.close()
+            self._leitura.conexao = None
+        with self._cond:
+            while self._gravando:
+                self._cond.wait()
+            self._conexao.close()
+
+
+def caminhos_shards(caminho_base: str, num_shards: int) -> list:
+    """Arquivos dos shards: o próprio caminho com 1 shard, senão base.<i>.db"""
+    if num_shards == 1:
+        return [caminho_base]
+    raiz, extensao = os.path.splitext(caminho_base)
+    return [f"{raiz}.{indice}{extensao}" for indice in range(num_shards)]
+
+
+class FalhaGravacaoParcial(Exception):
+    """Parte dos shards não gravou; `pendentes` são os itens que não foram confirmados"""
+
+    def __init__(self, pendentes: list, causa: Exception):
+        super().__init__(f"{len(pendentes)} itens não gravados: {causa}")
+        self.pendentes = pendentes
+
+
+def indice_shard(usuario_id: str, num_shards: int) -> int:
+    """Shard do usuário: CRC32 (estável entre processos, ao contrário de hash())"""
+    return zlib.crc32(usuario_id.encode("utf-8")) % num_shards
+
+
+class ArmazenamentoFragmentado:
+    """
+    Roteador sobre N ArmazenamentoProgresso, particionados por usuário
+
+    Cada shard é um arquivo SQLite com WAL, escritor e group commit
+    próprios, então escritas de usuários em shards diferentes não
+    disputam o mesmo lock. Leituras de um usuário tocam um único shard;
+    varreduras completas percorrem todos em sequência. Lotes que cobrem
+    vários shards são gravados em paralelo.
+    """
+
+    def __init__(self, caminho_base: str = PROGRESSO_DB_PATH, num_shards: int = PROGRESSO_SHARDS,
+                 durabilidade: str = PROGRESSO_DURABILIDADE, max_lote: int = PROGRESSO_MAX_LOTE):
+        if num_shards < 1:
+            raise ValueError(f"Quantidade de shards inválida: {num_shards}")
+        self.caminho_base = caminho_base
+        self.shards = [
+            ArmazenamentoProgresso(caminho, durabilidade, max_lote)
+            for caminho in caminhos_shards(caminho_base, num_shards)
+        ]
+        self._executor = ThreadPoolExecutor(max_workers=num_shards) if num_shards > 1 else None
+
+    def shard(self, usuario_id: str) -> ArmazenamentoProgresso:
+        return self.shards[indice_shard(usuario_id, len(self.shards))]
+
+    def _por_shard(self, itens, usuario_de) -> dict:
+        grupos = defaultdict(list)
+        for item in itens:
+            grupos[indice_shard(usuario_de(item), len(self.shards))].append(item)
+        return grupos
+
+    def _gravar_em_paralelo(self, grupos: dict, gravar) -> None:
+        """
+        Grava cada grupo no seu shard; com vários shards, ao mesmo tempo.
+        Cada shard confirma de forma independente: se algum falhar, levanta
+        FalhaGravacaoParcial só com os itens dos shards que não gravaram.
+        """
+        if len(grupos) == 1 or self._executor is None:
+            for indice, itens in grupos.items():
+                gravar(self.shards[indice], itens)
+            return
+        futuros = [(self._executor.submit(gravar, self.shards[i], itens), itens) for i, itens in grupos.items()]
+        pendentes = []
+        causa = None
+        for futuro, itens in futuros:
+            try:
+                futuro.result()
+            except Exception as e:
+                pendentes.extend(itens)
+                causa = causa or e
+        if pendentes:
+            raise FalhaGravacaoParcial(pendentes, causa) from causa
+
+    @property
+    def total_commits(self) -> int:
+        return sum(shard.total_commits for shard in self.shards)
+
+    def registrar(self, sessao: dict) -> None:
+        self.shard(sessao["usuario_id"]).registrar(sessao)
+
+    def registrar_lote(self, sessoes) -> None:
+        grupos = self._por_shard(sessoes, lambda s: s["usuario_id"])
+        self._gravar_em_paralelo(grupos, ArmazenamentoProgresso.registrar_lote)
+
+    def registrar_linhas(self, linhas: list) -> None:
+        grupos = self._por_shard(linhas, lambda linha: linha[0])
+        self._gravar_em_paralelo(grupos, ArmazenamentoProgresso.registrar_linhas)
+
+    def listar_sessoes(self, usuario_id: str, desde: str = None) -> list:
+        return self.shard(usuario_id).listar_sessoes(usuario_id, desde)
+
+    def marca_leitura(self) -> tuple:
+        return tuple(shard.marca_leitura() for shard in self.shards)
+
+    def iterar_sessoes(self, tamanho_lote: int = 10_000, ate: tuple = None):
+        for indice, shard in enumerate(self.shards):
+            yield from shard.iterar_sessoes(tamanho_lote, None if ate is None else ate[indice])
+
+    def listar_membros(self) -> dict:
+        membros = {}
+        for shard in self.shards:
+            membros.update(shard.listar_membros())
+        return membros
+
+    def contar_sessoes(self) -> int:
+        return sum(shard.contar_sessoes() for shard in self.shards)
+
+    def exportar_sessoes(self, tamanho_lote: int = 10_000):
+        for shard in self.shards:
+            yield from shard.exportar_sessoes(tamanho_lote)
+
+    def exportar_revisoes(self, tamanho_lote: int = 10_000):
+        for shard in self.shards:
+            yield from shard.exportar_revisoes(tamanho_lote)
+
+    def gravar_revisoes(self, usuario_id: str, cartoes) -> None:
+        self.shard(usuario_id).gravar_revisoes(usuario_id, cartoes)
+
+    def gravar_linhas_revisao(self, linhas: list) -> None:
+        grupos = self._por_shard(linhas, lambda linha: linha[0])
+        self._gravar_em_paralelo(grupos, ArmazenamentoProgresso.gravar_linhas_revisao)
+
+    def listar_revisoes(self, usuario_id: str) -> list:
+        return self.shard(usuario_id).listar_revisoes(usuario_id)
+
+    def fechar(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+        for shard in self.shards:
+            shard.fechar()
+
+
+def rebalancear_shards(caminho_base: str, shards_origem: int, shards_destino: int,
+                       durabilidade: str = "normal") -> dict:
+    """
+    Redistribui o progresso de N para M shards (offline: sem workers ativos)
+
+    Copia sessões e revisões para arquivos temporários no novo layout,
+    confere as contagens, guarda os arquivos antigos como .<data-hora>.bak
+    (cada execução tem os seus; nunca sobrescreve um backup) e só então
+    coloca os novos no lugar. Retorna as quantidades copiadas.
+    """
+    origens = [c for c in caminhos_shards(caminho_base, shards_origem) if os.path.exists(c)]
+    carimbo = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    backups = [(caminho + sufixo, f"{caminho}.{carimbo}.bak{sufixo}")
+               for caminho in origens for sufixo in ("", "-wal", "-shm")]
+    for _, backup in backups:
+        if os.path.exists(backup):
+            raise FileExistsError(f"Backup {backup} já existe; rebalanceamento não executado")
+    raiz, extensao = os.path.splitext(caminho_base)
+    base_temporaria = f"{raiz}.rebalanceando{extensao}"
+    temporarios = caminhos_shards(base_temporaria, shards_destino)
+    finais = caminhos_shards(caminho_base, shards_destino)
+    for caminho in temporarios:
+        if os.path.exists(caminho):
+            os.remove(caminho)
+
+    destino = ArmazenamentoFragmentado(base_temporaria, shards_destino, durabilidade)
+    sessoes = revisoes = 0
+    try:
+        for caminho in origens:
+            origem = ArmazenamentoProgresso(caminho, durabilidade)
+            try:
+                for linhas in origem.exportar_sessoes():
+                    destino.registrar_linhas(linhas)
+                    sessoes += len(linhas)
+                for linhas in origem.exportar_revisoes():
+                    destino.gravar_linhas_revisao(linhas)
+                    revisoes += len(linhas)
+            finally:
+                origem.fechar()
+        if destino.contar_sessoes() != sessoes:
+            raise RuntimeError("Contagem de sessões divergente após a cópia; arquivos originais mantidos")
+    finally:
+        destino.fechar()
+
+    # Arquivos auxiliares do WAL acompanham o banco (o último close normalmente os remove)
+    for atual, backup in backups:
+        if os.path.exists(atual):
+            os.replace(atual, backup)
+    for temporario, final in zip(temporarios, finais):
+        for sufixo in ("", "-wal", "-shm"):
+            if os.path.exists(temporario + sufixo):
+                os.replace(temporario + sufixo, final + sufixo)
+    logging.info(f"Rebalanceamento: {sessoes} sessões e {revisoes} revisões de {shards_origem} para {shards_destino} shards "
+                 f"(backups com o sufixo .{carimbo}.bak)")
+    return {"sessoes": sessoes, "revisoes": revisoes, "shards_origem": shards_origem, "shards_destino": shards_destino}
+
+
+_armazenamento = None
+_armazenamento_lock = threading.Lock()
+
+
+def obter_armazenamento() -> ArmazenamentoFragmentado:
+    """Armazenamento de progresso do worker, criado no primeiro uso"""
+    global _armazenamento
+    if _armazenamento is None:
+        with _armazenamento_lock:
+            if _armazenamento is None:
+                _armazenamento = ArmazenamentoFragmentado()
+                atexit.register(_armazenamento.fechar)
+    return _armazenamento
+
+
+# ============ FILA DE ESCRITA DE PROGRESSO ============
+
+# Capacidade da fila em memória e tamanho máximo de cada lote gravado
+FILA_PROGRESSO_CAPACIDADE = int(os.environ.get("FILA_PROGRESSO_CAPACIDADE", "10000"))
+FILA_PROGRESSO_LOTE = 512
+
+# Tempo máximo (s) que uma requisição espera por espaço na fila cheia
+FILA_PROGRESSO_TIMEOUT = 0.5
+
+# Sessões que não puderam ser gravadas, guardadas para inspeção/reimportação
+FILA_PROGRESSO_MAX_DESCARTADAS = 1000
+
+_FIM_FILA = object()
+
+
+class FilaProgressoCheia(Exception):
+    """A fila de escrita continuou cheia durante todo o tempo de espera"""
+
+
+class FilaEscritaProgresso:
+    """
+    Fila limitada de escrita atrasada (write-behind) para o armazenamento
+
+    - enfileirar() retorna sem esperar o disco; com a fila cheia espera até
+      `timeout` segundos por espaço e então levanta FilaProgressoCheia
+    - Uma thread escritora grava as sessões em lotes de até `tamanho_lote`;
+      um lote que continua falhando é dividido ao meio até isolar a sessão
+      com problema, que vai para `descartadas` sem levar as demais junto
+    - aguardar(usuario_id) bloqueia até as sessões já enfileiradas do usuário
+      estarem gravadas, garantindo que leituras vejam as próprias escritas
+    - drenar() grava tudo o que restou e encerra a thread (chamado no atexit)
+    """
+
+    def __init__(self, armazenamento, capacidade: int = FILA_PROGRESSO_CAPACIDADE,
+                 tamanho_lote: int = FILA_PROGRESSO_LOTE, timeout: float = FILA_PROGRESSO_TIMEOUT):
+        self._armazenamento = armazenamento
+        self._fila = queue.Queue(maxsize=capacidade)
+        self.tamanho_lote = tamanho_lote
+        self.timeout = timeout
+
+        self._lock_entrada = threading.Lock()
+        self._encerrada = False
+        # puts em andamento (fora do lock): o escritor só termina sem nenhum
+        self._produtores = 0
+        self._seq_enfileirada = 0
+        self._ultima_seq_usuario = {}
+
+        # _seq_gravada: todas as sequências até ela já foram gravadas (ou
+        # descartadas); as concluídas fora de ordem esperam em _concluidas
+        self._cond = threading.Condition()
+        self._seq_gravada = 0
+        self._concluidas = set()
+        self.total_falhas = 0
+        self.descartadas = deque(maxlen=FILA_PROGRESSO_MAX_DESCARTADAS)
+
+        self._thread = threading.Thread(target=self._escritor, name="escritor-progresso", daemon=True)
+        self._thread.start()
+
+    def profundidade(self) -> int:
+        """Sessões aguardando gravação"""
+        return self._fila.qsize()
+
+    def enfileirar(self, sessao: dict) -> int:
+        """Enfileira a sessão para gravação e retorna seu número de sequência"""
+        with self._lock_entrada:
+            if self._encerrada or not self._thread.is_alive():
+                raise RuntimeError("Fila de progresso encerrada")
+            self._seq_enfileirada += 1
+            seq = self._seq_enfileirada
+            self._ultima_seq_usuario[sessao["usuario_id"]] = seq
+            self._produtores += 1
+        # A espera por espaço fica fora do lock: com a fila cheia, cada
+        # requisição espera só o próprio timeout, não o das que estão na frente
+        try:
+            self._fila.put((seq, sessao), timeout=self.timeout)
+        except queue.Full:
+            self._concluir([seq])
+            raise FilaProgressoCheia() from None
+        finally:
+            with self._lock_entrada:
+                self._produtores -= 1
+        return seq
+
+    def _concluir(self, seqs) -> None:
+        """Marca sequências como gravadas e avança _seq_gravada até a primeira lacuna"""
+        with self._cond:
+            self._concluidas.update(seqs)
+            while self._seq_gravada + 1 in self._concluidas:
+                self._seq_gravada += 1
+                self._concluidas.remove(self._seq_gravada)
+            self._cond.notify_all()
+
+    def aguardar(self, usuario_id: str = None, timeout: float = 5.0) -> bool:
+        """Espera as sessões enfileiradas (do usuário ou de todos) serem gravadas"""
+        if usuario_id is None:
+            alvo = self._seq_enfileirada
+        else:
+            alvo = self._ultima_seq_usuario.get(usuario_id, 0)
+        with self._cond:
+            return self._cond.wait_for(lambda: self._seq_gravada >= alvo, timeout)
+
+    def _escritor(self) -> None:
+        encerrar = False
+        while not encerrar:
+            item = self._fila.get()
+            if item is _FIM_FILA:
+                break
+            lote = [item]
+            while len(lote) < self.tamanho_lote:
+                try:
+                    item = self._fila.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _FIM_FILA:
+                    encerrar = True
+                    break
+                lote.append(item)
+            self._gravar(lote)
+        # Sessões que entram depois do marco de fim (puts que esperavam
+        # espaço quando drenar foi chamado): grava até a fila esvaziar sem
+        # nenhum put em andamento — enfileirar já recusa novos
+        restantes = []
+        while True:
+            try:
+                item = self._fila.get(timeout=0.05)
+            except queue.Empty:
+                if restantes:
+                    self._gravar(restantes)
+                    restantes = []
+                    continue
+                with self._lock_entrada:
+                    if not self._produtores and self._fila.empty():
+                        break
+                continue
+            if item is not _FIM_FILA:
+                restantes.append(item)
+                if len(restantes) >= self.tamanho_lote:
+                    self._gravar(restantes)
+                    restantes = []
+
+    def _gravar(self, lote: list) -> None:
+        self._gravar_sessoes([sessao for _, sessao in lote], tentativas=3)
+        # Mesmo em falha a sequência avança, para leitores não ficarem presos
+        self._concluir(seq for seq, _ in lote)
+
+    def _gravar_sessoes(self, sessoes: list, tentativas: int) -> None:
+        """
+        Grava com novas tentativas (só do que faltou, em falha parcial entre
+        shards); persistindo o erro, divide o lote ao meio e descarta apenas
+        a sessão que não grava sozinha
+        """
+        for tentativa in range(tentativas):
+            try:
+                self._armazenamento.registrar_lote(sessoes)
+                return
+            except FalhaGravacaoParcial as e:
+                sessoes = e.pendentes
+                logging.error(f"Erro ao gravar {len(sessoes)} sessões (tentativa {tentativa + 1}): {str(e)}")
+            except Exception as e:
+                logging.error(f"Erro ao gravar {len(sessoes)} sessões (tentativa {tentativa + 1}): {str(e)}")
+        if len(sessoes) > 1:
+            meio = len(sessoes) // 2
+            for parte in (sessoes[:meio], sessoes[meio:]):
+                self._gravar_sessoes(parte, tentativas=1 if len(parte) > 1 else 3)
+            return
+        self.total_falhas += len(sessoes)
+        self.descartadas.extend(sessoes)
+        logging.error(f"Sessão descartada após falhas de gravação: {serializar_json(sessoes[0]).decode('utf-8')}")
+
+    def drenar(self, timeout: float = 10.0) -> None:
+        """Grava as sessões pendentes e encerra a thread escritora"""
+        with self._lock_entrada:
+            if self._encerrada or not self._thread.is_alive():
+                return
+            self._encerrada = True
+        self._fila.put(_FIM_FILA)
+        self._thread.join(timeout)
+
+
+_fila_progresso = None
+
+
+def obter_fila_progresso() -> FilaEscritaProgresso:
+    """Fila de escrita de progresso do worker, criada no primeiro uso"""
+    global _fila_progresso
+    if _fila_progresso is None:
+        armazenamento = obter_armazenamento()
+        with _armazenamento_lock:
+            if _fila_progresso is None:
+                _fila_progresso = FilaEscritaProgresso(armazenamento)
+                # atexit executa em ordem inversa: drena a fila antes de fechar o banco
+                atexit.register(_fila_progresso.drenar)
+    return _fila_progresso
+
+
+def listar_sessoes_usuario(usuario_id: str, desde: str = None) -> list:
+    """Sessões gravadas do usuário, incluindo as que ainda estavam na fila"""
+    if _fila_progresso is not None:
+        _fila_progresso.aguardar(usuario_id)
+    return obter_armazenamento().listar_sessoes(usuario_id, desde)
+
+
+# ============ ROLLUPS E DASHBOARD ============
+
+DIAS_SEMANA_ABREV = ["Seg", "Ter", "Qua", "Qui", "Sex", "Sab", "Dom"]
+
+# Meta semanal de horas exibida no dashboard
+META_SEMANAL_HORAS = 20
+
+# Locks por faixa de usuários (evita um lock por usuário e um lock global)
+ROLLUPS_FAIXAS_LOCK = 64
+
+
+class _Agregado:
+    """Totais de um período (dia, semana ou mês) de um usuário"""
+    __slots__ = ("minutos", "sessoes", "pontos", "materias", "minutos_por_dia")
+
+    def __init__(self):
+        self.minutos = 0
+        self.sessoes = 0
+        self.pontos = 0
+        self.materias = {}
+        self.minutos_por_dia = {}
+
+    def adicionar(self, dia: int, materia: str, minutos: int, pontos: int, sessoes: int = 1) -> None:
+        self.minutos += minutos
+        self.sessoes += sessoes
+        self.pontos += pontos
+        self.materias[materia] = self.materias.get(materia, 0) + minutos
+        self.minutos_por_dia[dia] = self.minutos_por_dia.get(dia, 0) + minutos
+
+
+_AGREGADO_VAZIO = _Agregado()
+
+
+class CalendarioAtividade:
+    """
+    Calendário de atividade de um usuário: um bit por dia desde o primeiro dia ativo
+
+    O bitmap é um int do Python (operações em C, palavra a palavra): anos
+    de histórico cabem em algumas dezenas de bytes, e sequências e contagens
+    usam deslocamentos, máscaras e bit_count em vez de percorrer dias.
+    """
+    __slots__ = ("origem", "bits")
+
+    def __init__(self):
+        self.origem = None
+        self.bits = 0
+
+    def marcar(self, ordinal: int) -> None:
+        if self.origem is None:
+            self.origem = ordinal
+        elif ordinal < self.origem:
+            # Sessão anterior ao primeiro dia conhecido (ex: importação de histórico)
+            self.bits <<= self.origem - ordinal
+            self.origem = ordinal
+        self.bits |= 1 << (ordinal - self.origem)
+
+    def ativo(self, ordinal: int) -> bool:
+        return self.origem is not None and ordinal >= self.origem and bool(self.bits >> (ordinal - self.origem) & 1)
+
+    def dias_ativos(self, inicio: int, fim: int) -> int:
+        """Dias com estudo no intervalo [inicio, fim] (ordinais)"""
+        if self.origem is None or fim < self.origem:
+            return 0
+        inicio = max(inicio, self.origem)
+        janela = (self.bits >> (inicio - self.origem)) & ((1 << (fim - inicio + 1)) - 1)
+        return janela.bit_count()
+
+    def sequencia_atual(self, hoje: int) -> int:
+        """Dias consecutivos com estudo terminando hoje (ou ontem, se hoje ainda não estudou)"""
+        if self.origem is None:
+            return 0
+        fim = hoje - self.origem
+        if fim >= 0 and not self.bits >> fim & 1:
+            fim -= 1
+        if fim < 0:
+            return 0
+        # Zeros até o fim: o zero mais alto marca o dia anterior à sequência
+        zeros = ~self.bits & ((1 << (fim + 1)) - 1)
+        return fim + 1 if not zeros else fim - (zeros.bit_length() - 1)
+
+    def maior_sequencia(self) -> int:
+        """Maior sequência de dias consecutivos: cada x &= x >> 1 encurta todas as sequências em 1"""
+        bits = self.bits
+        tamanho = 0
+        while bits:
+            bits &= bits >> 1
+            tamanho += 1
+        return tamanho
+
+
+class RollupUsuario:
+    """
+    Rollups diários, semanais (ISO) e mensais de um usuário
+
+    Cada sessão atualiza os três períodos que a contêm; ler o dashboard de
+    um período é uma consulta de dicionário, independente do histórico.
+    """
+    __slots__ = ("diario", "semanal", "mensal", "calendario", "pontos_total")
+
+    def __init__(self):
+        self.diario = {}
+        self.semanal = {}
+        self.mensal = {}
+        self.calendario = CalendarioAtividade()
+        self.pontos_total = 0
+
+    @staticmethod
+    def chaves_periodo(dia: date) -> dict:
+        iso = dia.isocalendar()
+        return {
+            "diario": dia.toordinal(),
+            "semanal": (iso[0], iso[1]),
+            "mensal": (dia.year, dia.month)
+        }
+
+    @staticmethod
+    def intervalo_periodo(periodo: str, dia: date) -> tuple:
+        """Primeiro e último dia (ordinais) do período que contém o dia"""
+        ordinal = dia.toordinal()
+        if periodo == "diario":
+            return ordinal, ordinal
+        if periodo == "semanal":
+            inicio = ordinal - dia.weekday()
+            return inicio, inicio + 6
+        inicio = dia.replace(day=1)
+        proximo = (inicio + timedelta(days=32)).replace(day=1)
+        return inicio.toordinal(), proximo.toordinal() - 1
+
+    def aplicar(self, sessao: dict) -> None:
+        dia = datetime.fromisoformat(sessao["data_registro"]).date()
+        self.adicionar(dia.toordinal(), sessao["materia"],
+                       int(sessao["tempo_minutos"]), int(sessao.get("pontos", 0)))
+
+    def adicionar(self, ordinal: int, materia: str, minutos: int, pontos: int, sessoes: int = 1) -> None:
+        """Soma minutos/pontos de uma ou mais sessões de um dia aos três períodos"""
+        for periodo, chave in self.chaves_periodo(date.fromordinal(ordinal)).items():
+            agregados = getattr(self, periodo)
+            agregado = agregados.get(chave)
+            if agregado is None:
+                agregado = agregados[chave] = _Agregado()
+            agregado.adicionar(ordinal, materia, minutos, pontos, sessoes)
+        self.calendario.marcar(ordinal)
+        self.pontos_total += pontos
+
+    def agregado(self, periodo: str, dia: date) -> _Agregado:
+        return getattr(self, periodo).get(self.chaves_periodo(dia)[periodo], _AGREGADO_VAZIO)
+
+    def dias_consecutivos(self, dia: date) -> int:
+        """Sequência de dias com estudo terminando hoje (ou ontem, se hoje ainda não estudou)"""
+        return self.calendario.sequencia_atual(dia.toordinal())
+
+
+class RollupsProgresso:
+    """
+    Rollups de todos os usuários do worker, mantidos incrementalmente
+
+    Usuários são carregados das sessões em colunas no primeiro acesso;
+    depois disso cada sessão ingerida atualiza o rollup em memória.
+    Ingestão e carga de um mesmo usuário são serializadas pelo lock da sua
+    faixa, de modo que nenhuma sessão é contada duas vezes.
+    """
+
+    def __init__(self, fonte=None, faixas: int = ROLLUPS_FAIXAS_LOCK):
+        self._fonte = fonte or obter_sessoes_colunares
+        self._usuarios = {}
+        self._locks = [threading.Lock() for _ in range(faixas)]
+
+    def _indice_lock(self, usuario_id: str) -> int:
+        return hash(usuario_id) % len(self._locks)
+
+    def lock_usuario(self, usuario_id: str) -> threading.Lock:
+        return self._locks[self._indice_lock(usuario_id)]
+
+    def locks_usuarios(self, usuarios=None) -> ExitStack:
+        """Adquire (em ordem, sem deadlock) os locks de vários usuários (None: todos)"""
+        if usuarios is None:
+            indices = range(len(self._locks))
+        else:
+            indices = sorted({self._indice_lock(u) for u in usuarios})
+        pilha = ExitStack()
+        for indice in indices:
+            pilha.enter_context(self._locks[indice])
+        return pilha
+
+    def aplicar(self, sessao: dict) -> None:
+        """Atualiza o rollup do usuário, se já carregado (chamar com o lock do usuário)"""
+        rollup = self._usuarios.get(sessao["usuario_id"])
+        if rollup is not None:
+            rollup.aplicar(sessao)
+
+    def obter(self, usuario_id: str) -> RollupUsuario:
+        """Rollup do usuário, carregando seu histórico no primeiro acesso"""
+        rollup = self._usuarios.get(usuario_id)
+        if rollup is not None:
+            return rollup
+        # Fora do lock do usuário: a primeira carga das colunas trava todas as faixas
+        colunas = self._fonte()
+        with self.lock_usuario(usuario_id):
+            rollup = self._usuarios.get(usuario_id)
+            if rollup is None:
+                rollup = self._usuarios[usuario_id] = colunas.rollup_usuario(usuario_id)
+        return rollup
+
+
+_rollups = None
+
+
+def obter_rollups() -> RollupsProgresso:
+    """Rollups de progresso do worker, criados no primeiro uso"""
+    global _rollups
+    if _rollups is None:
+        with _armazenamento_lock:
+            if _rollups is None:
+                _rollups = RollupsProgresso()
+    return _rollups
+
+
+def ingerir_sessao(sessao: dict) -> None:
+    """Enfileira a sessão para gravação e atualiza as estruturas em memória"""
+    rollups = obter_rollups()
+    with rollups.lock_usuario(sessao["usuario_id"]):
+        obter_fila_progresso().enfileirar(sessao)
+        _aplicar_em_memoria(rollups, [sessao])
+
+
+def ingerir_lote(sessoes: list) -> None:
+    """Grava um lote de sessões (síncrono) e atualiza as estruturas em memória"""
+    rollups = obter_rollups()
+    with rollups.locks_usuarios(s["usuario_id"] for s in sessoes):
+        obter_armazenamento().registrar_lote(sessoes)
+        _aplicar_em_memoria(rollups, sessoes)
+
+
+def _aplicar_em_memoria(rollups: RollupsProgresso, sessoes: list) -> None:
+    """Atualiza sessões em colunas e rollups já carregados (chamar com os locks dos usuários)"""
+    if _sessoes_colunares is not None:
+        _sessoes_colunares.adicionar_lote(sessoes)
+    elif _captura_colunas is not None:
+        _captura_colunas.extend(sessoes)
+    for sessao in sessoes:
+        rollups.aplicar(sessao)
+    if _placar is not None:
+        _placar.aplicar(sessoes)
+    for usuario_id in {s["usuario_id"] for s in sessoes}:
+        _cache_dashboard.invalidar(usuario_id)
+
+
+# Máximo de dashboards (usuário, período) mantidos em cache
+CACHE_DASHBOARD_TAMANHO = 10_000
+
+
+class CacheDashboard:
+    """
+    Cache LRU de dashboards por (usuário, período), com o objeto, seu JSON
+    e, sob demanda, o envelope da resposta já comprimido em gzip
+
+    Cada entrada vale enquanto a validade (dia e versão do modelo de
+    recomendações, ver validade_dashboard) não mudar. Uma nova sessão do
+    usuário invalida apenas as entradas dele; o contador de geração impede
+    que um cálculo iniciado antes da invalidação seja guardado depois dela.
+    """
+
+    def __init__(self, tamanho: int = CACHE_DASHBOARD_TAMANHO):
+        self.tamanho = tamanho
+        self._entradas = OrderedDict()
+        self._geracao = {}
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    def geracao(self, usuario_id: str) -> int:
+        return self._geracao.get(usuario_id, 0)
+
+    def obter(self, usuario_id: str, periodo: str, validade):
+        """(dashboard, json_bytes) em cache ou None"""
+        with self._lock:
+            entrada = self._entradas.get((usuario_id, periodo))
+            if entrada is None or entrada[0] != validade:
+                self.falhas += 1
+                return None
+            self._entradas.move_to_end((usuario_id, periodo))
+            self.acertos += 1
+            return entrada[1], entrada[2]
+
+    def guardar(self, usuario_id: str, periodo: str, validade, geracao: int,
+                dashboard: dict, dashboard_json: bytes) -> None:
+        with self._lock:
+            if self._geracao.get(usuario_id, 0) != geracao:
+                return
+            self._entradas[(usuario_id, periodo)] = (validade, dashboard, dashboard_json, {})
+            self._entradas.move_to_end((usuario_id, periodo))
+            while len(self._entradas) > self.tamanho:
+                self._entradas.popitem(last=False)
+
+    def prefixo_gzip(self, usuario_id: str, periodo: str, dashboard_json: bytes,
+                     envelope: bytes) -> tuple:
+        """
+        Prefixo gzip (ver gzip_prefixo) do envelope ao redor de dashboard_json,
+        comprimido uma vez enquanto a entrada continuar no cache
+        """
+        with self._lock:
+            entrada = self._entradas.get((usuario_id, periodo))
+            if entrada is not None and entrada[2] is dashboard_json and "gzip" in entrada[3]:
+                return entrada[3]["gzip"]
+        prefixo = gzip_prefixo(envelope)
+        if entrada is not None and entrada[2] is dashboard_json:
+            with self._lock:
+                entrada[3]["gzip"] = prefixo
+        return prefixo
+
+    def invalidar(self, usuario_id: str) -> None:
+        with self._lock:
+            self._geracao[usuario_id] = self._geracao.get(usuario_id, 0) + 1
+            for periodo in ("diario", "semanal", "mensal"):
+                self._entradas.pop((usuario_id, periodo), None)
+
+
+_cache_dashboard = CacheDashboard()
+
+
+def validade_dashboard(hoje: date) -> tuple:
+    """
+    Dia e versão do modelo de recomendações (treinado_em, None antes do
+    primeiro treino): um modelo novo torna velhos os dashboards em cache.
+    Lida sem chamar obter_recomendador, para não disparar treino
+    """
+    recomendador = _recomendador
+    return hoje.toordinal(), recomendador.treinado_em if recomendador is not None else None
+
+
+def obter_dashboard_cacheado(usuario_id: str, periodo: str):
+    """Dashboard do usuário e seu JSON (bytes UTF-8), do cache ou recalculado"""
+    hoje = date.today()
+    validade = validade_dashboard(hoje)
+    em_cache = _cache_dashboard.obter(usuario_id, periodo, validade)
+    if em_cache is not None:
+        return em_cache
+    geracao = _cache_dashboard.geracao(usuario_id)
+    dashboard = congelar(gerar_dashboard(usuario_id, periodo, hoje))
+    dashboard_json = serializar_json(dashboard)
+    _cache_dashboard.guardar(usuario_id, periodo, validade, geracao, dashboard, dashboard_json)
+    return dashboard, dashboard_json
+
+
+def obter_dashboard_parcial(usuario_id: str, periodo: str, projecao) -> dict:
+    """
+    Dashboard com ao menos as seções da projeção: o completo do cache, se
+    houver; senão só as seções pedidas, que não vão para o cache
+    """
+    if projecao is None:
+        return obter_dashboard_cacheado(usuario_id, periodo)[0]
+    em_cache = _cache_dashboard.obter(usuario_id, periodo, validade_dashboard(date.today()))
+    if em_cache is not None:
+        return em_cache[0]
+    return gerar_dashboard(usuario_id, periodo, projecao=projecao)
+
+
+def gerar_dashboard(usuario_id: str, periodo: str, hoje: date = None, projecao=None) -> dict:
+    """
+    Gera o dashboard do usuário a partir dos rollups de progresso; com uma
+    projeção, as seções não pedidas (conquistas, recomendações, progresso
+    semanal) nem são calculadas
+    """
+    hoje = hoje or date.today()
+    rollup = obter_rollups().obter(usuario_id)
+    agregado = rollup.agregado(periodo, hoje)
+    semana = rollup.agregado("semanal", hoje)
+    
+    total_horas = round(agregado.minutos / 60, 1)
+    materias_estudadas = len(agregado.materias)
+    calendario = rollup.calendario
+    dias_consecutivos = calendario.sequencia_atual(hoje.toordinal())
+    maior_sequencia = calendario.maior_sequencia()
+    dias_com_estudo = calendario.dias_ativos(*RollupUsuario.intervalo_periodo(periodo, hoje))
+    dias_ativos_30 = calendario.dias_ativos(hoje.toordinal() - 29, hoje.toordinal())
+    
+    distribuicao = sorted(agregado.materias.items(), key=lambda item: -item[1])
+    horas_semana_atual = round(semana.minutos / 60, 1)
+    
+    dashboard = {
+        "estatisticas_gerais": {
+            "total_horas_estudadas": total_horas,
+            "materias_diferentes": materias_estudadas,
+            "dias_consecutivos": dias_consecutivos,
+            "maior_sequencia_dias": maior_sequencia,
+            "dias_ativos_ultimos_30": dias_ativos_30,
+            "media_horas_dia": round(total_horas / max(dias_com_estudo, 1), 1),
+            "total_sessoes": agregado.sessoes,
+            "pontos_periodo": agregado.pontos
+        },
+        "distribuicao_materias": {
+            materia: round(minutos / 60, 1) for materia, minutos in distribuicao
+        }
+    }
+    
+    if campo_solicitado(projecao, "progresso_semanal"):
+        # Horas por dia da semana atual (segunda a domingo)
+        horas_semana = [0.0] * 7
+        for ordinal, minutos in semana.minutos_por_dia.items():
+            horas_semana[date.fromordinal(ordinal).weekday()] += minutos / 60
+        dashboard["progresso_semanal"] = [
+            {"dia": nome, "horas": round(horas, 1)}
+            for nome, horas in zip(DIAS_SEMANA_ABREV, horas_semana)
+        ]
+    
+    if campo_solicitado(projecao, "conquistas"):
+        maior_dia_horas = max(agregado.minutos_por_dia.values(), default=0) / 60
+        dashboard["conquistas"] = [
             {
                 "nome": "Estudante Dedicado",
                 "descricao": f"Estudou por {dias_consecutivos} dias consecutivos",
@@ -1191,24 +4102,1329 @@ def gerar_dashboard_demo(usuario_id: str, periodo: str) -> dict:
                 "nome": "Maratonista",
                 "descricao": "Estudou mais de 3 horas em um dia",
                 "icone": "🏃",
-                "desbloqueado": periodo != 'diario' or total_horas > 3
+                "desbloqueado": maior_dia_horas > 3
             },
             {
                 "nome": "Multitask",
                 "descricao": "Estudou 5 ou mais matérias diferentes",
                 "icone": "🎯",
                 "desbloqueado": materias_estudadas >= 5
+            },
+            {
+                "nome": "Constância",
+                "descricao": f"Estudou em {dias_ativos_30} dos últimos 30 dias",
+                "icone": "📅",
+                "desbloqueado": dias_ativos_30 >= 20
             }
-        ],
-        "recomendacoes": [
+        ]
+    
+    if campo_solicitado(projecao, "recomendacoes") or campo_solicitado(projecao, "recomendacoes_personalizadas"):
+        recomendacoes = []
+        if not agregado.sessoes:
+            recomendacoes.append("Registre suas sessões de estudo para acompanhar seu progresso")
+        elif len(distribuicao) > 1 and distribuicao[-1][1] < agregado.minutos * 0.1:
+            recomendacoes.append(f"Tente aumentar o tempo em {distribuicao[-1][0]}, sua matéria com menor dedicação")
+        personalizadas = obter_recomendador().recomendar(usuario_id)
+        for sugestao in personalizadas:
+            recomendacoes.append(
+                f"Estudantes com interesses parecidos também estudam {sugestao['materia']}: "
+                f"experimente buscar \"{sugestao['busca']}\""
+            )
+        recomendacoes += [
             "Continue mantendo a consistência nos estudos",
-            "Tente aumentar o tempo em matérias com menor dedicação",
             "Faça pausas regulares para melhor absorção",
             "Revise conteúdos antigos para fixação"
-        ],
-        "meta_semanal": {
-            "horas_objetivo": 20,
-            "horas_atual": total_horas if periodo == 'semanal' else random.randint(8, 15),
-            "percentual_atingido": round((total_horas / 20) * 100, 1) if periodo == 'semanal' else random.randint(40, 75)
+        ]
+        dashboard["recomendacoes"] = recomendacoes
+        dashboard["recomendacoes_personalizadas"] = personalizadas
+    
+    dashboard["meta_semanal"] = {
+        "horas_objetivo": META_SEMANAL_HORAS,
+        "horas_atual": horas_semana_atual,
+        "percentual_atingido": round(horas_semana_atual / META_SEMANAL_HORAS * 100, 1)
+    }
+    return dashboard
+
+
+# ============ SESSÕES EM COLUNAS ============
+
+_EPOCA = datetime(1970, 1, 1)
+_ORDINAL_EPOCA = _EPOCA.toordinal()
+
+
+def _segundos_desde_epoca(data_registro: str) -> int:
+    """Data ISO em segundos desde 1970, no horário local da própria data (o mesmo dia dos rollups)"""
+    return int((datetime.fromisoformat(data_registro).replace(tzinfo=None) - _EPOCA).total_seconds())
+
+
+class SessoesColunares:
+    """
+    Sessões de estudo do worker em colunas NumPy, para agregações vetorizadas
+
+    Colunas: timestamp (int64, segundos), usuario e materia (int32, códigos
+    de dicionário) e minutos/pontos (int64) — ~32 bytes por sessão, contra
+    centenas de bytes de um dict. Os arrays crescem por duplicação; leituras
+    usam um instantâneo das colunas e não precisam de lock.
+    """
+    _COLUNAS = (
+        ("timestamp", np.int64),
+        ("usuario", np.int32),
+        ("materia", np.int32),
+        ("minutos", np.int64),
+        ("pontos", np.int64)
+    )
+
+    def __init__(self, capacidade: int = 1024):
+        self._lock = threading.Lock()
+        self._n = 0
+        self._dados = {nome: np.empty(capacidade, dtype=tipo) for nome, tipo in self._COLUNAS}
+        self.usuarios = []
+        self.materias = []
+        self._codigo_usuario = {}
+        self._codigo_materia = {}
+
+    def __len__(self):
+        return self._n
+
+    @staticmethod
+    def _codificar(valor: str, codigos: dict, valores: list) -> int:
+        codigo = codigos.get(valor)
+        if codigo is None:
+            codigo = codigos[valor] = len(valores)
+            valores.append(valor)
+        return codigo
+
+    def adicionar_lote(self, sessoes) -> None:
+        """Adiciona sessões no formato de validar_sessao (com pontos)"""
+        self.adicionar_linhas([
+            (s["usuario_id"], s["materia"], s["tempo_minutos"], s.get("pontos", 0), s["data_registro"])
+            for s in sessoes
+        ])
+
+    def adicionar_linhas(self, linhas) -> None:
+        """Adiciona tuplas (usuario_id, materia, tempo_minutos, pontos, data_registro)"""
+        linhas = list(linhas)
+        if not linhas:
+            return
+        usuarios, materias, minutos, pontos, datas = zip(*linhas)
+        with self._lock:
+            inicio, fim = self._n, self._n + len(linhas)
+            if fim > len(self._dados["timestamp"]):
+                capacidade = max(fim, 2 * len(self._dados["timestamp"]))
+                for nome, coluna in self._dados.items():
+                    nova = np.empty(capacidade, dtype=coluna.dtype)
+                    nova[:inicio] = coluna[:inicio]
+                    self._dados[nome] = nova
+            self._dados["timestamp"][inicio:fim] = [_segundos_desde_epoca(d) for d in datas]
+            self._dados["usuario"][inicio:fim] = [
+                self._codificar(u, self._codigo_usuario, self.usuarios) for u in usuarios
+            ]
+            self._dados["materia"][inicio:fim] = [
+                self._codificar(m, self._codigo_materia, self.materias) for m in materias
+            ]
+            self._dados["minutos"][inicio:fim] = minutos
+            self._dados["pontos"][inicio:fim] = pontos
+            self._n = fim
+
+    def colunas(self) -> dict:
+        """Instantâneo somente leitura das colunas preenchidas"""
+        with self._lock:
+            n = self._n
+            dados = dict(self._dados)
+        visoes = {}
+        for nome, coluna in dados.items():
+            visao = coluna[:n]
+            visao.flags.writeable = False
+            visoes[nome] = visao
+        return visoes
+
+    def codigo_usuario(self, usuario_id: str):
+        """Código de dicionário do usuário nas colunas (None se não tem sessões)"""
+        return self._codigo_usuario.get(usuario_id)
+
+    def bytes_por_sessao(self) -> float:
+        return sum(np.dtype(tipo).itemsize for _, tipo in self._COLUNAS)
+
+    def mascara(self, colunas: dict, usuario_ids=None, inicio: datetime = None, fim: datetime = None) -> np.ndarray:
+        """Filtro vetorizado por usuários e intervalo [inicio, fim)"""
+        mascara = np.ones(len(colunas["timestamp"]), dtype=bool)
+        if usuario_ids is not None:
+            codigos = [self._codigo_usuario[u] for u in usuario_ids if u in self._codigo_usuario]
+            mascara &= np.isin(colunas["usuario"], codigos)
+        if inicio is not None:
+            mascara &= colunas["timestamp"] >= int((inicio - _EPOCA).total_seconds())
+        if fim is not None:
+            mascara &= colunas["timestamp"] < int((fim - _EPOCA).total_seconds())
+        return mascara
+
+    def minutos_por_materia(self, usuario_ids=None, inicio: datetime = None, fim: datetime = None) -> dict:
+        """Group-by matéria → minutos"""
+        colunas = self.colunas()
+        mascara = self.mascara(colunas, usuario_ids, inicio, fim)
+        somas = np.bincount(colunas["materia"][mascara], weights=colunas["minutos"][mascara],
+                            minlength=len(self.materias))
+        return {self.materias[i]: int(somas[i]) for i in np.flatnonzero(somas)}
+
+    def minutos_por_usuario(self, usuario_ids=None, inicio: datetime = None, fim: datetime = None) -> dict:
+        """Group-by usuário → minutos"""
+        colunas = self.colunas()
+        mascara = self.mascara(colunas, usuario_ids, inicio, fim)
+        somas = np.bincount(colunas["usuario"][mascara], weights=colunas["minutos"][mascara],
+                            minlength=len(self.usuarios))
+        return {self.usuarios[i]: int(somas[i]) for i in np.flatnonzero(somas)}
+
+    def pontos_por_usuario(self) -> dict:
+        """Group-by usuário → pontos acumulados"""
+        colunas = self.colunas()
+        somas = np.bincount(colunas["usuario"], weights=colunas["pontos"], minlength=len(self.usuarios))
+        return {self.usuarios[i]: int(somas[i]) for i in np.flatnonzero(somas)}
+
+    def rollup_usuario(self, usuario_id: str) -> RollupUsuario:
+        """Constrói o rollup do usuário com um group-by (dia, matéria) sobre as colunas"""
+        rollup = RollupUsuario()
+        codigo = self._codigo_usuario.get(usuario_id)
+        if codigo is None:
+            return rollup
+        colunas = self.colunas()
+        num_materias = len(self.materias)
+        mascara = colunas["usuario"] == codigo
+        dias = colunas["timestamp"][mascara] // 86400 + _ORDINAL_EPOCA
+        chaves = dias * num_materias + colunas["materia"][mascara]
+        grupos, inverso = np.unique(chaves, return_inverse=True)
+        minutos = np.bincount(inverso, weights=colunas["minutos"][mascara])
+        pontos = np.bincount(inverso, weights=colunas["pontos"][mascara])
+        sessoes = np.bincount(inverso)
+        for grupo, m, p, n in zip(grupos.tolist(), minutos.tolist(), pontos.tolist(), sessoes.tolist()):
+            dia, materia = divmod(grupo, num_materias)
+            rollup.adicionar(dia, self.materias[materia], int(m), int(p), n)
+        return rollup
+
+
+_sessoes_colunares = None
+_sessoes_colunares_lock = threading.Lock()
+# Sessões ingeridas durante a varredura da primeira carga (ver obter_sessoes_colunares)
+_captura_colunas = None
+
+
+def obter_sessoes_colunares() -> SessoesColunares:
+    """
+    Sessões do worker em colunas, carregadas do armazenamento no primeiro uso
+
+    A ingestão só fica travada enquanto a fila de escrita esvazia e o corte
+    da leitura é marcado. A varredura do banco roda sem locks; as sessões
+    ingeridas nesse meio-tempo (capturadas em _aplicar_em_memoria) entram
+    nas colunas na publicação, de novo com os locks.
+    """
+    global _sessoes_colunares, _captura_colunas
+    if _sessoes_colunares is None:
+        with _sessoes_colunares_lock:
+            if _sessoes_colunares is None:
+                rollups = obter_rollups()
+                armazenamento = obter_armazenamento()
+                with rollups.locks_usuarios():
+                    _esperar_fila_gravada()
+                    marca = armazenamento.marca_leitura()
+                    _captura_colunas = []
+                colunas = None
+                try:
+                    colunas = SessoesColunares()
+                    lote = []
+                    for linha in armazenamento.iterar_sessoes(ate=marca):
+                        lote.append(linha)
+                        if len(lote) >= 10_000:
+                            colunas.adicionar_linhas(lote)
+                            lote = []
+                    colunas.adicionar_linhas(lote)
+                except Exception:
+                    colunas = None
+                    raise
+                finally:
+                    with rollups.locks_usuarios():
+                        capturadas, _captura_colunas = _captura_colunas, None
+                        if colunas is not None:
+                            colunas.adicionar_lote(capturadas)
+                            _sessoes_colunares = colunas
+    return _sessoes_colunares
+
+
+def _esperar_fila_gravada(tentativas: int = 3) -> None:
+    """Espera a fila de escrita gravar tudo; sem isso o banco lido estaria incompleto"""
+    if _fila_progresso is None:
+        return
+    for tentativa in range(tentativas):
+        if _fila_progresso.aguardar():
+            return
+        logging.warning(f"Fila de progresso ainda gravando antes da carga em colunas (tentativa {tentativa + 1})")
+    raise RuntimeError("Fila de progresso não esvaziou; carga das sessões em colunas adiada")
+
+
+# ============ RANKING DE PONTOS ============
+
+# Escopos de ranking: todos os usuários do worker, por turma e por escola
+ESCOPOS_RANKING = ("global", "turma", "escola")
+RANKING_MAX_K = 100
+RANKING_MAX_RAIO = 10
+
+# Instantâneo periódico dos pontos (base da variação de posição entre instantâneos)
+RANKING_INSTANTANEO_PATH = os.environ.get(
+    "RANKING_INSTANTANEO_PATH",
+    os.path.join(tempfile.gettempdir(), "estudai_ranking.json")
+)
+RANKING_INTERVALO_INSTANTANEO = int(os.environ.get("RANKING_INTERVALO_INSTANTANEO", "300"))
+
+
+@contextmanager
+def _coletor_pausado():
+    """
+    Pausa o coletor de ciclos durante construções em massa
+
+    Criar centenas de milhares de nós dispara coletas que varrem todos os
+    objetos vivos repetidamente; as estruturas montadas não têm ciclos.
+    """
+    ativo = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if ativo:
+            gc.enable()
+
+
+class _NoSalto:
+    __slots__ = ("chave", "proximos", "larguras")
+
+    def __init__(self, chave, nivel: int):
+        self.chave = chave
+        self.proximos = [None] * nivel
+        self.larguras = [1] * nivel
+
+
+class ListaSaltosIndexada:
+    """
+    Skip list indexável: lista ordenada com inserção, remoção, posição e
+    acesso por índice em O(log n) esperado
+
+    Cada ligação guarda quantos elementos do nível 0 ela salta (largura);
+    somar larguras no caminho da busca dá a posição de uma chave. As buscas
+    percorrem só os níveis em uso, que crescem com log2(n).
+    """
+    NIVEIS = 32
+
+    def __init__(self, chaves_ordenadas=(), semente=None):
+        self._rng = random.Random(semente)
+        self._fim = _NoSalto(float("inf"), 0)
+        self._cabeca = _NoSalto(None, self.NIVEIS)
+        self._cabeca.proximos = [self._fim] * self.NIVEIS
+        self._nivel = 1
+        self._n = 0
+        self._construir(chaves_ordenadas)
+
+    def __len__(self):
+        return self._n
+
+    def _nivel_aleatorio(self) -> int:
+        # 1 + número de bits 1 consecutivos no fim: nível k com probabilidade 2^-k,
+        # no máximo um nível acima dos já em uso
+        bits = self._rng.getrandbits(min(self._nivel, self.NIVEIS - 1))
+        return (~bits & (bits + 1)).bit_length()
+
+    def _construir(self, chaves_ordenadas) -> None:
+        """Construção em O(n) a partir de chaves já ordenadas e distintas"""
+        chaves_ordenadas = list(chaves_ordenadas)
+        # Alturas sorteadas de uma vez (geométrica, p = 1/2)
+        alturas = np.random.default_rng(self._rng.getrandbits(64)).geometric(
+            0.5, len(chaves_ordenadas)).clip(max=self.NIVEIS).tolist()
+        cabeca = self._cabeca
+        ultimos = [cabeca] * self.NIVEIS
+        posicoes = [0] * self.NIVEIS
+        posicao = 0
+        with _coletor_pausado():
+            for posicao, (chave, altura) in enumerate(zip(chaves_ordenadas, alturas), 1):
+                no = _NoSalto(chave, altura)
+                for nivel in range(altura):
+                    ultimos[nivel].proximos[nivel] = no
+                    ultimos[nivel].larguras[nivel] = posicao - posicoes[nivel]
+                    ultimos[nivel] = no
+                    posicoes[nivel] = posicao
+        self._n = posicao
+        for nivel in range(self.NIVEIS):
+            ultimos[nivel].proximos[nivel] = self._fim
+            ultimos[nivel].larguras[nivel] = self._n + 1 - posicoes[nivel]
+            if ultimos[nivel] is not cabeca:
+                self._nivel = nivel + 1
+
+    def _caminho(self, chave, incluir_iguais: bool):
+        """Último nó antes da chave em cada nível em uso e os elementos saltados em cada nível"""
+        caminho = [None] * self._nivel
+        passos = [0] * self._nivel
+        no = self._cabeca
+        for nivel in reversed(range(self._nivel)):
+            proximo = no.proximos[nivel]
+            while proximo.chave < chave or (incluir_iguais and proximo.chave == chave):
+                passos[nivel] += no.larguras[nivel]
+                no = proximo
+                proximo = no.proximos[nivel]
+            caminho[nivel] = no
+        return caminho, passos
+
+    def inserir(self, chave) -> None:
+        altura = self._nivel_aleatorio()
+        if altura > self._nivel:
+            # Níveis novos começam com a cabeça ligada ao fim, saltando tudo
+            for nivel in range(self._nivel, altura):
+                self._cabeca.larguras[nivel] = self._n + 1
+            self._nivel = altura
+        caminho, passos = self._caminho(chave, True)
+
+        novo = _NoSalto(chave, altura)
+        saltados = 0
+        for nivel in range(altura):
+            anterior = caminho[nivel]
+            novo.proximos[nivel] = anterior.proximos[nivel]
+            anterior.proximos[nivel] = novo
+            novo.larguras[nivel] = anterior.larguras[nivel] - saltados
+            anterior.larguras[nivel] = saltados + 1
+            saltados += passos[nivel]
+        for nivel in range(altura, self._nivel):
+            caminho[nivel].larguras[nivel] += 1
+        self._n += 1
+
+    def remover(self, chave) -> None:
+        caminho, _ = self._caminho(chave, False)
+        alvo = caminho[0].proximos[0]
+        if alvo.chave != chave:
+            raise KeyError(chave)
+        for nivel in range(len(alvo.proximos)):
+            anterior = caminho[nivel]
+            anterior.larguras[nivel] += alvo.larguras[nivel] - 1
+            anterior.proximos[nivel] = alvo.proximos[nivel]
+        for nivel in range(len(alvo.proximos), self._nivel):
+            caminho[nivel].larguras[nivel] -= 1
+        self._n -= 1
+
+    def posicao(self, chave) -> int:
+        """Quantidade de elementos menores que a chave (posição 0-based, se presente)"""
+        return sum(self._caminho(chave, False)[1])
+
+    def fatia(self, inicio: int, quantidade: int) -> list:
+        """Até `quantidade` chaves a partir do índice `inicio`"""
+        if inicio >= self._n or quantidade <= 0:
+            return []
+        restante = inicio + 1
+        no = self._cabeca
+        for nivel in reversed(range(self._nivel)):
+            while no.larguras[nivel] <= restante:
+                restante -= no.larguras[nivel]
+                no = no.proximos[nivel]
+        chaves = []
+        while no is not self._fim and len(chaves) < quantidade:
+            chaves.append(no.chave)
+            no = no.proximos[0]
+        return chaves
+
+
+class PlacarPontos:
+    """
+    Rankings de pontos do worker: global, por turma e por escola
+
+    Cada ranking é uma ListaSaltosIndexada de chaves inteiras
+    (-pontos << 32) | código do usuário — comparar ints é bem mais barato
+    que comparar tuplas —, então posição, top-K e vizinhos custam
+    O(log n + k) e cada sessão registrada atualiza os rankings do usuário
+    em O(log n). Empates dividem a posição (1, 2, 2, 4).
+    """
+
+    def __init__(self, pontos: dict = None, membros: dict = None,
+                 caminho_instantaneo: str = None, intervalo_instantaneo: int = RANKING_INTERVALO_INSTANTANEO,
+                 semente=None):
+        self._lock = threading.Lock()
+        self._semente = semente
+        self._pontos = dict(pontos or {})
+        self._membros = {u: tuple(m) for u, m in (membros or {}).items()}
+        for usuario_id in self._membros:
+            self._pontos.setdefault(usuario_id, 0)
+        self._usuarios = list(self._pontos)
+        self._codigos = {u: codigo for codigo, u in enumerate(self._usuarios)}
+        self._caminho_instantaneo = caminho_instantaneo
+        self._intervalo_instantaneo = intervalo_instantaneo
+        self._ultimo_instantaneo = time.monotonic()
+        # Serializa as gravações (periódica em segundo plano e a do atexit)
+        self._lock_arquivo = threading.Lock()
+        self._salvando = False
+
+        with _coletor_pausado():
+            grupos = defaultdict(list)
+            for usuario_id, total in self._pontos.items():
+                chave = self._chave(total, self._codigos[usuario_id])
+                for escopo in self._escopos(usuario_id):
+                    grupos[escopo].append(chave)
+            self._rankings = {
+                escopo: ListaSaltosIndexada(sorted(chaves), semente)
+                for escopo, chaves in grupos.items()
+            }
+        self._anterior = self._carregar_instantaneo()
+
+    @staticmethod
+    def _chave(pontos: int, codigo: int = 0) -> int:
+        return (-pontos << 32) | codigo
+
+    def _escopos(self, usuario_id: str, membros: tuple = None) -> list:
+        turma, escola = membros or self._membros.get(usuario_id, (None, None))
+        escopos = [("global", None)]
+        if turma:
+            escopos.append(("turma", turma))
+        if escola:
+            escopos.append(("escola", escola))
+        return escopos
+
+    def _ranking(self, escopo: tuple) -> ListaSaltosIndexada:
+        ranking = self._rankings.get(escopo)
+        if ranking is None:
+            ranking = self._rankings[escopo] = ListaSaltosIndexada(semente=self._semente)
+        return ranking
+
+    def aplicar(self, sessoes) -> None:
+        """Soma os pontos das sessões e atualiza turma/escola informadas"""
+        deltas = defaultdict(int)
+        novos_membros = {}
+        for sessao in sessoes:
+            usuario_id = sessao["usuario_id"]
+            deltas[usuario_id] += int(sessao.get("pontos", 0))
+            if sessao.get("turma") or sessao.get("escola"):
+                turma, escola = novos_membros.get(usuario_id) or self._membros.get(usuario_id, (None, None))
+                novos_membros[usuario_id] = (sessao.get("turma") or turma, sessao.get("escola") or escola)
+
+        with self._lock:
+            for usuario_id, delta in deltas.items():
+                codigo = self._codigos.get(usuario_id)
+                if codigo is None:
+                    codigo = self._codigos[usuario_id] = len(self._usuarios)
+                    self._usuarios.append(usuario_id)
+                else:
+                    chave_anterior = self._chave(self._pontos[usuario_id], codigo)
+                    for escopo in self._escopos(usuario_id):
+                        self._rankings[escopo].remover(chave_anterior)
+                membros = novos_membros.get(usuario_id, self._membros.get(usuario_id, (None, None)))
+                total = self._pontos[usuario_id] = self._pontos.get(usuario_id, 0) + delta
+                self._membros[usuario_id] = membros
+                chave = self._chave(total, codigo)
+                for escopo in self._escopos(usuario_id, membros):
+                    self._ranking(escopo).inserir(chave)
+        self._instantaneo_periodico()
+
+    def membros(self, usuario_id: str) -> tuple:
+        """(turma, escola) do usuário"""
+        return self._membros.get(usuario_id, (None, None))
+
+    def participantes(self, escopo: str, grupo: str = None) -> list:
+        """Usuários de um escopo, do maior para o menor total de pontos"""
+        with self._lock:
+            ranking = self._rankings.get((escopo, grupo if escopo != "global" else None))
+            if ranking is None:
+                return []
+            return [self._usuarios[chave & 0xFFFFFFFF] for chave in ranking.fatia(0, len(ranking))]
+
+    def consultar(self, usuario_id: str, escopo: str = "global", grupo: str = None,
+                  k: int = 10, raio: int = 2) -> dict:
+        """Top-K do escopo e, se o usuário participa dele, sua posição e vizinhos"""
+        if escopo == "global":
+            grupo = None
+        elif grupo is None:
+            grupo = dict(zip(("turma", "escola"), self.membros(usuario_id))).get(escopo)
+        chave_escopo = (escopo, grupo)
+
+        with self._lock:
+            ranking = self._rankings.get(chave_escopo)
+            if ranking is None:
+                return {"grupo": grupo, "participantes": 0, "top": [], "usuario": None, "vizinhos": []}
+            top = self._entradas(ranking, 0, k)
+            usuario = vizinhos = None
+            if usuario_id in self._pontos and chave_escopo in self._escopos(usuario_id):
+                indice = ranking.posicao(self._chave(self._pontos[usuario_id], self._codigos[usuario_id]))
+                inicio = max(0, indice - raio)
+                vizinhos = self._entradas(ranking, inicio, indice - inicio + raio + 1)
+                usuario = next(e for e in vizinhos if e["usuario_id"] == usuario_id)
+            participantes = len(ranking)
+
+        if usuario is not None:
+            usuario = {**usuario, "variacao_posicao": self._variacao(chave_escopo, usuario_id, usuario["posicao"])}
+        return {
+            "grupo": grupo,
+            "participantes": participantes,
+            "top": top,
+            "usuario": usuario,
+            "vizinhos": vizinhos or []
         }
+
+    def _entradas(self, ranking: ListaSaltosIndexada, inicio: int, quantidade: int) -> list:
+        """Entradas com posição de competição: empatados dividem a posição do primeiro"""
+        entradas = []
+        posicao = None
+        pontos_anterior = None
+        for indice, chave in enumerate(ranking.fatia(inicio, quantidade), inicio):
+            pontos = -(chave >> 32)
+            if pontos != pontos_anterior:
+                posicao = indice + 1 if entradas else ranking.posicao(self._chave(pontos)) + 1
+                pontos_anterior = pontos
+            entradas.append({
+                "posicao": posicao,
+                "usuario_id": self._usuarios[chave & 0xFFFFFFFF],
+                "pontos": pontos
+            })
+        return entradas
+
+    # ---- instantâneos ----
+
+    def instantaneo(self) -> dict:
+        """Cópia dos pontos e turmas/escolas, serializável em JSON"""
+        with self._lock:
+            return {
+                "gerado_em": datetime.now().isoformat(),
+                "pontos": dict(self._pontos),
+                "membros": {u: list(m) for u, m in self._membros.items() if any(m)}
+            }
+
+    def salvar_instantaneo(self) -> None:
+        """Grava o instantâneo (troca atômica do arquivo) e o torna a base de variação"""
+        with self._lock_arquivo:
+            dados = self.instantaneo()
+            if self._caminho_instantaneo:
+                temporario = f"{self._caminho_instantaneo}.tmp"
+                with open(temporario, "w", encoding="utf-8") as arquivo:
+                    json.dump(dados, arquivo, ensure_ascii=False, separators=(",", ":"))
+                os.replace(temporario, self._caminho_instantaneo)
+            self._anterior = self._indexar_instantaneo(dados)
+            self._ultimo_instantaneo = time.monotonic()
+
+    def _instantaneo_periodico(self) -> None:
+        """
+        Dispara o instantâneo vencido numa thread: aplicar roda com os locks
+        dos usuários, que não podem esperar a gravação do arquivo
+        """
+        if time.monotonic() - self._ultimo_instantaneo < self._intervalo_instantaneo:
+            return
+        with self._lock:
+            if self._salvando:
+                return
+            self._salvando = True
+            self._ultimo_instantaneo = time.monotonic()
+        threading.Thread(target=self._salvar_em_segundo_plano, daemon=True).start()
+
+    def _salvar_em_segundo_plano(self) -> None:
+        try:
+            self.salvar_instantaneo()
+        except OSError as e:
+            logging.error(f"Erro ao salvar instantâneo do ranking: {str(e)}")
+        finally:
+            self._salvando = False
+
+    def _carregar_instantaneo(self):
+        if not self._caminho_instantaneo or not os.path.exists(self._caminho_instantaneo):
+            return None
+        try:
+            with open(self._caminho_instantaneo, encoding="utf-8") as arquivo:
+                return self._indexar_instantaneo(json.load(arquivo))
+        except (OSError, ValueError) as e:
+            logging.warning(f"Instantâneo do ranking ignorado: {str(e)}")
+            return None
+
+    @staticmethod
+    def _indexar_instantaneo(dados: dict) -> tuple:
+        """Pontos do instantâneo e, por escopo, os pontos negativos ordenados (para searchsorted)"""
+        pontos = dados.get("pontos", {})
+        membros = dados.get("membros", {})
+        grupos = defaultdict(list)
+        for usuario_id, total in pontos.items():
+            turma, escola = membros.get(usuario_id, (None, None))
+            grupos[("global", None)].append(-total)
+            if turma:
+                grupos[("turma", turma)].append(-total)
+            if escola:
+                grupos[("escola", escola)].append(-total)
+        return pontos, {escopo: np.sort(np.array(v, dtype=np.int64)) for escopo, v in grupos.items()}
+
+    def _variacao(self, escopo: tuple, usuario_id: str, posicao: int):
+        """Posições ganhas (positivo) ou perdidas desde o último instantâneo"""
+        if self._anterior is None:
+            return None
+        pontos, ordenados = self._anterior
+        if usuario_id not in pontos or escopo not in ordenados:
+            return None
+        anterior = int(np.searchsorted(ordenados[escopo], -pontos[usuario_id], side="left")) + 1
+        return anterior - posicao
+
+
+_placar = None
+_placar_lock = threading.Lock()
+
+
+def obter_placar() -> PlacarPontos:
+    """
+    Rankings do worker, montados no primeiro uso a partir das sessões em colunas
+
+    A montagem trava a ingestão de todos os usuários (como a carga das
+    colunas), de modo que cada sessão é contada exatamente uma vez.
+    """
+    global _placar
+    if _placar is None:
+        colunas = obter_sessoes_colunares()
+        with _placar_lock:
+            if _placar is None:
+                with obter_rollups().locks_usuarios():
+                    _esperar_fila_gravada()
+                    _placar = PlacarPontos(
+                        colunas.pontos_por_usuario(),
+                        obter_armazenamento().listar_membros(),
+                        caminho_instantaneo=RANKING_INSTANTANEO_PATH
+                    )
+                    atexit.register(_placar.salvar_instantaneo)
+    return _placar
+
+
+# ============ ANÁLISE DE COORTES ============
+
+COORTE_MAX_ALUNOS = 20_000
+# Sem estudo há mais que isso (ou nunca): aluno em risco
+COORTE_DIAS_RISCO = 7
+COORTE_MAX_EM_RISCO = 100
+COORTE_PERCENTIS = (25, 50, 75, 90)
+COORTE_FAIXAS_HORAS = ((0, "0h"), (1, "até 1h"), (3, "1-3h"), (5, "3-5h"), (10, "5-10h"), (float("inf"), "10h+"))
+
+# Linhas das colunas por fragmento e processos para agregá-los (0: no próprio processo)
+COORTE_TAMANHO_FRAGMENTO = 1_000_000
+COORTE_PROCESSOS = int(os.environ.get("COORTE_PROCESSOS", "0"))
+
+
+def _agregar_fragmento(usuario, materia, minutos, timestamp, indice_coorte, num_alunos: int,
+                       inicio: int, fim: int, num_materias: int) -> tuple:
+    """
+    Agregado parcial de um fragmento das colunas para os alunos da coorte
+
+    Função de módulo com argumentos NumPy, para rodar em outro processo.
+    Retorna (minutos por aluno no período, sessões por aluno no período,
+    último timestamp por aluno, minutos por matéria no período).
+    """
+    posicao = indice_coorte[usuario]
+    da_coorte = posicao >= 0
+    no_periodo = da_coorte & (timestamp >= inicio) & (timestamp < fim)
+
+    ultimo = np.full(num_alunos, -1, dtype=np.int64)
+    np.maximum.at(ultimo, posicao[da_coorte], timestamp[da_coorte])
+    return (
+        np.bincount(posicao[no_periodo], weights=minutos[no_periodo], minlength=num_alunos),
+        np.bincount(posicao[no_periodo], minlength=num_alunos),
+        ultimo,
+        np.bincount(materia[no_periodo], weights=minutos[no_periodo], minlength=num_materias)
+    )
+
+
+def _combinar_agregados(parciais) -> tuple:
+    """Junta agregados parciais: somas para contagens, máximo para o último estudo"""
+    minutos, sessoes, ultimo, materias = next(parciais)
+    for m, s, u, mat in parciais:
+        minutos = minutos + m
+        sessoes = sessoes + s
+        ultimo = np.maximum(ultimo, u)
+        materias = materias + mat
+    return minutos, sessoes, ultimo, materias
+
+
+_pool_coortes = None
+_pool_coortes_lock = threading.Lock()
+
+
+def obter_pool_coortes() -> "ProcessPoolExecutor":
+    """Pool de processos das análises de coorte, criado no primeiro uso"""
+    # multiprocessing só é carregado quando o pool é ativado
+    from concurrent.futures import ProcessPoolExecutor
+    global _pool_coortes
+    if _pool_coortes is None:
+        with _pool_coortes_lock:
+            if _pool_coortes is None:
+                _pool_coortes = ProcessPoolExecutor(max_workers=COORTE_PROCESSOS)
+                atexit.register(_pool_coortes.shutdown)
+    return _pool_coortes
+
+
+def analisar_coorte(usuario_ids: list, periodo: str = "semanal", hoje: date = None,
+                    dias_risco: int = COORTE_DIAS_RISCO) -> dict:
+    """
+    Dashboard agregado de uma turma, escola ou lista de alunos
+
+    As colunas são divididas em fragmentos de COORTE_TAMANHO_FRAGMENTO
+    linhas; cada fragmento produz um agregado parcial (no pool de processos
+    quando COORTE_PROCESSOS > 0) e os parciais são combinados no final.
+    """
+    hoje = hoje or date.today()
+    usuario_ids = list(dict.fromkeys(usuario_ids))
+    sessoes_colunares = obter_sessoes_colunares()
+    colunas = sessoes_colunares.colunas()
+
+    # Código do usuário nas colunas → posição na coorte (-1: fora da coorte)
+    indice_coorte = np.full(len(sessoes_colunares.usuarios), -1, dtype=np.int64)
+    for posicao, usuario_id in enumerate(usuario_ids):
+        codigo = sessoes_colunares.codigo_usuario(usuario_id)
+        if codigo is not None:
+            indice_coorte[codigo] = posicao
+
+    primeiro_dia, ultimo_dia = RollupUsuario.intervalo_periodo(periodo, hoje)
+    inicio = (primeiro_dia - _ORDINAL_EPOCA) * 86400
+    fim = (ultimo_dia + 1 - _ORDINAL_EPOCA) * 86400
+    num_materias = len(sessoes_colunares.materias)
+
+    total_linhas = len(colunas["timestamp"])
+    fragmentos = [
+        (colunas["usuario"][i:i + COORTE_TAMANHO_FRAGMENTO], colunas["materia"][i:i + COORTE_TAMANHO_FRAGMENTO],
+         colunas["minutos"][i:i + COORTE_TAMANHO_FRAGMENTO], colunas["timestamp"][i:i + COORTE_TAMANHO_FRAGMENTO],
+         indice_coorte, len(usuario_ids), inicio, fim, num_materias)
+        for i in range(0, max(total_linhas, 1), COORTE_TAMANHO_FRAGMENTO)
+    ]
+    if COORTE_PROCESSOS > 0 and len(fragmentos) > 1:
+        parciais = obter_pool_coortes().map(_agregar_fragmento, *zip(*fragmentos))
+    else:
+        parciais = (_agregar_fragmento(*fragmento) for fragmento in fragmentos)
+    minutos, sessoes, ultimo, minutos_materia = _combinar_agregados(iter(parciais))
+
+    horas = minutos / 60
+    percentis = np.percentile(horas, COORTE_PERCENTIS) if len(horas) else np.zeros(len(COORTE_PERCENTIS))
+
+    distribuicao_horas = {}
+    limite_anterior = -1
+    for limite, rotulo in COORTE_FAIXAS_HORAS:
+        distribuicao_horas[rotulo] = int(np.count_nonzero((horas > limite_anterior) & (horas <= limite)))
+        limite_anterior = limite
+
+    # Em risco: nenhum estudo nos últimos dias_risco dias (ou nunca)
+    dia_ultimo = np.where(ultimo >= 0, ultimo // 86400 + _ORDINAL_EPOCA, -1)
+    em_risco = np.flatnonzero(dia_ultimo <= hoje.toordinal() - dias_risco)
+    em_risco = em_risco[np.argsort(dia_ultimo[em_risco], kind="stable")]
+
+    materias = np.flatnonzero(minutos_materia)
+    materias = materias[np.argsort(-minutos_materia[materias], kind="stable")]
+
+    return {
+        "alunos": len(usuario_ids),
+        "alunos_ativos_periodo": int(np.count_nonzero(sessoes)),
+        "horas": {
+            "total": round(float(horas.sum()), 1),
+            "media": round(float(horas.mean()), 1) if len(horas) else 0.0,
+            "percentis": {f"p{p}": round(float(v), 1) for p, v in zip(COORTE_PERCENTIS, percentis)}
+        },
+        "total_sessoes": int(sessoes.sum()),
+        "distribuicao_horas": distribuicao_horas,
+        "distribuicao_materias": {
+            sessoes_colunares.materias[i]: round(float(minutos_materia[i]) / 60, 1) for i in materias
+        },
+        "alunos_em_risco": [
+            {
+                "usuario_id": usuario_ids[i],
+                "dias_sem_estudo": None if dia_ultimo[i] < 0 else int(hoje.toordinal() - dia_ultimo[i])
+            }
+            for i in em_risco[:COORTE_MAX_EM_RISCO]
+        ],
+        "total_em_risco": len(em_risco)
     }
+
+
+# ============ RECOMENDAÇÕES PERSONALIZADAS ============
+
+# Vizinhos mais similares mantidos por matéria e sugestões por usuário
+RECOMENDADOR_VIZINHOS = 5
+RECOMENDADOR_SUGESTOES = 3
+RECOMENDADOR_LOTE_USUARIOS = 10_000
+# Matéria com menos que essa fração do tempo do usuário conta como pouco estudada
+RECOMENDADOR_FRACAO_POUCO_ESTUDADA = 0.1
+# Colunas da matriz: as matérias estudadas por mais usuários; as demais vão para "outros"
+RECOMENDADOR_MAX_MATERIAS = int(os.environ.get("RECOMENDADOR_MAX_MATERIAS", "200"))
+# Segundos entre recálculos em lote (feitos em segundo plano)
+RECOMENDADOR_INTERVALO = int(os.environ.get("RECOMENDADOR_INTERVALO", "600"))
+
+# Tópicos da base de resumos ligados a cada matéria (chave normalizada)
+TOPICOS_RESUMO_POR_MATERIA = {
+    "biologia": ("fotossintese",),
+    "historia": ("segunda guerra",)
+}
+
+
+class RecomendadorMaterias:
+    """
+    Recomendações de matérias por similaridade item-item, pré-calculadas em lote
+
+    A matriz usuário × matéria guarda log(1 + minutos). Matéria é texto
+    livre: nomes são normalizados e só as RECOMENDADOR_MAX_MATERIAS mais
+    estudadas (em usuários) viram colunas; o resto soma numa coluna
+    "outros", que conta no tempo do usuário mas nunca é sugerida. A similaridade de
+    cosseno entre matérias mantém só os RECOMENDADOR_VIZINHOS vizinhos de
+    cada uma (argpartition); a pontuação de um usuário é seu engajamento
+    vezes essa matriz esparsa. Sugestões são matérias pouco estudadas por
+    ele, calculadas para todos os usuários em lotes no treino e guardadas
+    em arrays indexados pelo código do usuário — servir é uma indexação.
+    """
+
+    def __init__(self, vizinhos: int = RECOMENDADOR_VIZINHOS, sugestoes: int = RECOMENDADOR_SUGESTOES,
+                 lote: int = RECOMENDADOR_LOTE_USUARIOS, max_materias: int = RECOMENDADOR_MAX_MATERIAS):
+        self.vizinhos = vizinhos
+        self.sugestoes = sugestoes
+        self.lote = lote
+        self.max_materias = max_materias
+        self.materias = []
+        self.similaridade = np.zeros((0, 0), dtype=np.float32)
+        self._indices = np.zeros((0, sugestoes), dtype=np.int32)
+        self._afinidades = np.zeros((0, sugestoes), dtype=np.float32)
+        self._detalhes = []
+        self._codigo_usuario = lambda usuario_id: None
+        self.treinado_em = None
+
+    @staticmethod
+    def matriz_engajamento(sessoes_colunares: SessoesColunares,
+                           max_materias: int = RECOMENDADOR_MAX_MATERIAS) -> tuple:
+        """
+        Usuário × matéria com log(1 + minutos), via bincount das colunas
+
+        Retorna (matriz, nomes das matérias); a última coluna da matriz é
+        "outros" e não tem nome na lista.
+        """
+        colunas = sessoes_colunares.colunas()
+        num_usuarios = len(sessoes_colunares.usuarios)
+        nomes = list(sessoes_colunares.materias)
+
+        # Código de dicionário → grupo da matéria normalizada (nome exibido: a primeira grafia)
+        grupos, exibicao = {}, []
+        grupo_do_codigo = np.empty(len(nomes), dtype=np.int64)
+        for codigo, nome in enumerate(nomes):
+            chave = normalizar_texto(nome)
+            if chave not in grupos:
+                grupos[chave] = len(exibicao)
+                exibicao.append(nome)
+            grupo_do_codigo[codigo] = grupos[chave]
+        num_grupos = len(exibicao)
+        usuario = colunas["usuario"].astype(np.int64)
+        grupo = grupo_do_codigo[colunas["materia"]]
+
+        # Vocabulário: grupos com mais usuários distintos, até max_materias
+        pares = np.unique(usuario * num_grupos + grupo)
+        usuarios_por_grupo = np.bincount(pares % num_grupos, minlength=num_grupos) if num_grupos else np.zeros(0)
+        mantidos = np.argsort(-usuarios_por_grupo, kind="stable")[:max_materias]
+        mantidos = np.sort(mantidos[usuarios_por_grupo[mantidos] > 0])
+        coluna_do_grupo = np.full(num_grupos, len(mantidos), dtype=np.int64)
+        coluna_do_grupo[mantidos] = np.arange(len(mantidos))
+
+        num_colunas = len(mantidos) + 1
+        chaves = usuario * num_colunas + coluna_do_grupo[grupo]
+        minutos = np.bincount(chaves, weights=colunas["minutos"], minlength=num_usuarios * num_colunas)
+        matriz = np.log1p(minutos.reshape(num_usuarios, num_colunas)).astype(np.float32)
+        return matriz, [exibicao[g] for g in mantidos.tolist()]
+
+    def _similaridade_esparsa(self, engajamento: np.ndarray) -> np.ndarray:
+        """Cosseno matéria × matéria, mantendo os k maiores de cada coluna"""
+        normas = np.linalg.norm(engajamento, axis=0)
+        normalizada = engajamento / np.where(normas > 0, normas, 1)
+        similaridade = normalizada.T @ normalizada
+        np.fill_diagonal(similaridade, 0)
+        num_materias = similaridade.shape[0]
+        if num_materias > self.vizinhos:
+            descartadas = np.argpartition(-similaridade, self.vizinhos, axis=0)[self.vizinhos:]
+            np.put_along_axis(similaridade, descartadas, 0, axis=0)
+        return similaridade
+
+    def treinar(self, sessoes_colunares: SessoesColunares) -> None:
+        """Recalcula similaridades e as sugestões de todos os usuários"""
+        engajamento, materias = self.matriz_engajamento(sessoes_colunares, self.max_materias)
+        usuarios = sessoes_colunares.usuarios[:engajamento.shape[0]]
+        # "outros" (última coluna) fica fora da similaridade e das candidatas
+        similaridade = self._similaridade_esparsa(engajamento[:, :-1])
+
+        quantidade = min(self.sugestoes, len(materias))
+        indices = np.zeros((len(usuarios), quantidade), dtype=np.int32)
+        afinidades = np.zeros((len(usuarios), quantidade), dtype=np.float32)
+        for inicio in range(0, len(usuarios) if quantidade else 0, self.lote):
+            bloco = engajamento[inicio:inicio + self.lote]
+            pontuacao = bloco[:, :-1] @ similaridade
+            # Só matérias pouco estudadas pelo usuário são candidatas
+            minutos = np.expm1(bloco)
+            pouco_estudadas = (minutos[:, :-1]
+                               < RECOMENDADOR_FRACAO_POUCO_ESTUDADA * minutos.sum(axis=1, keepdims=True))
+            pontuacao = np.where(pouco_estudadas & (pontuacao > 0), pontuacao, 0)
+            melhores = np.argpartition(-pontuacao, quantidade - 1, axis=1)[:, :quantidade]
+            valores = np.take_along_axis(pontuacao, melhores, axis=1)
+            ordem = np.argsort(-valores, axis=1, kind="stable")
+            indices[inicio:inicio + len(bloco)] = np.take_along_axis(melhores, ordem, axis=1)
+            afinidades[inicio:inicio + len(bloco)] = np.take_along_axis(valores, ordem, axis=1)
+
+        # Partes fixas de cada sugestão, montadas uma vez por matéria
+        detalhes = []
+        for materia in materias:
+            chave = normalizar_texto(materia)
+            detalhes.append((materia, f"técnicas de estudo {chave}", TOPICOS_RESUMO_POR_MATERIA.get(chave, ())))
+
+        self.materias = materias
+        self.similaridade = similaridade
+        self._indices, self._afinidades = indices, afinidades
+        self._detalhes = detalhes
+        self._codigo_usuario = sessoes_colunares.codigo_usuario
+        self.treinado_em = time.monotonic()
+
+    def recomendar(self, usuario_id: str) -> list:
+        """Sugestões pré-calculadas do usuário, com busca e resumos relacionados"""
+        codigo = self._codigo_usuario(usuario_id)
+        if codigo is None or codigo >= len(self._indices):
+            return []
+        recomendacoes = []
+        for indice, afinidade in zip(self._indices[codigo].tolist(), self._afinidades[codigo].tolist()):
+            if afinidade <= 0:
+                break
+            materia, busca, resumos = self._detalhes[indice]
+            recomendacoes.append({
+                "materia": materia,
+                "afinidade": round(afinidade, 3),
+                "busca": busca,
+                "resumos": list(resumos)
+            })
+        return recomendacoes
+
+
+_recomendador = None
+_recomendador_lock = threading.Lock()
+_recomendador_treinando = threading.Event()
+_recomendador_thread = None
+
+
+def _treinar_recomendador() -> RecomendadorMaterias:
+    recomendador = RecomendadorMaterias()
+    recomendador.treinar(obter_sessoes_colunares())
+    return recomendador
+
+
+def _retreinar_em_segundo_plano() -> None:
+    global _recomendador
+    try:
+        _recomendador = _treinar_recomendador()
+    except Exception as e:
+        logging.error(f"Erro ao recalcular recomendações: {str(e)}")
+        # Sem isso cada requisição dispararia um novo treino que também falharia
+        _recomendador.treinado_em = time.monotonic()
+    finally:
+        _recomendador_treinando.clear()
+
+
+def obter_recomendador() -> RecomendadorMaterias:
+    """
+    Recomendador do worker, treinado sempre em segundo plano: no primeiro
+    uso e a cada RECOMENDADOR_INTERVALO segundos. As requisições nunca
+    esperam o treino — usam o modelo anterior (vazio, antes do primeiro)
+    """
+    global _recomendador, _recomendador_thread
+    if _recomendador is None:
+        with _recomendador_lock:
+            if _recomendador is None:
+                _recomendador = RecomendadorMaterias()
+    recomendador = _recomendador
+    treinado_em = recomendador.treinado_em
+    if ((treinado_em is None or time.monotonic() - treinado_em >= RECOMENDADOR_INTERVALO)
+            and not _recomendador_treinando.is_set()):
+        with _recomendador_lock:
+            if not _recomendador_treinando.is_set():
+                _recomendador_treinando.set()
+                _recomendador_thread = threading.Thread(target=_retreinar_em_segundo_plano, daemon=True)
+                _recomendador_thread.start()
+    return recomendador
+
+
+def aguardar_recomendador(timeout: float = 5.0) -> bool:
+    """Espera o treino em andamento terminar; False se ainda estiver rodando"""
+    thread = _recomendador_thread
+    if thread is not None:
+        thread.join(timeout)
+    return not _recomendador_treinando.is_set()
+
+
+# ============ REVISÃO ESPAÇADA ============
+
+REVISAO_FACILIDADE_INICIAL = 2.5
+REVISAO_FACILIDADE_MINIMA = 1.3
+# Nota dada a tópicos registrados em registrar-progresso (estudo sem dificuldade)
+REVISAO_NOTA_ESTUDO = 4
+REVISAO_MAX_PENDENTES = 100
+# Baralhos mantidos em memória (os demais são recarregados do banco)
+REVISAO_MAX_BARALHOS = 10_000
+# Espera (s) da gravação em segundo plano, para juntar respostas próximas em um commit
+REVISAO_ATRASO_GRAVACAO = 0.05
+
+
+class CartaoRevisao:
+    """Estado SM-2 de um item: repetições, intervalo (dias), facilidade e vencimento (epoch)"""
+    __slots__ = ("item", "repeticoes", "intervalo", "facilidade", "vencimento")
+
+    def __init__(self, item: str, repeticoes: int = 0, intervalo: float = 0.0,
+                 facilidade: float = REVISAO_FACILIDADE_INICIAL, vencimento: float = 0.0):
+        self.item = item
+        self.repeticoes = repeticoes
+        self.intervalo = intervalo
+        self.facilidade = facilidade
+        self.vencimento = vencimento
+
+    def responder(self, nota: int, agora: float) -> None:
+        """Aplica o SM-2: nota de 0 (esqueceu) a 5 (resposta perfeita)"""
+        if nota < 3:
+            self.repeticoes = 0
+            self.intervalo = 1.0
+        else:
+            self.repeticoes += 1
+            if self.repeticoes == 1:
+                self.intervalo = 1.0
+            elif self.repeticoes == 2:
+                self.intervalo = 6.0
+            else:
+                self.intervalo = round(self.intervalo * self.facilidade, 2)
+        erro = 5 - nota
+        self.facilidade = max(REVISAO_FACILIDADE_MINIMA, self.facilidade + 0.1 - erro * (0.08 + erro * 0.02))
+        self.vencimento = agora + self.intervalo * 86400
+
+    def para_dict(self, agora: float) -> dict:
+        return {
+            "item": self.item,
+            "vencimento": datetime.fromtimestamp(self.vencimento).isoformat(timespec="seconds"),
+            "atraso_dias": round(max(0.0, agora - self.vencimento) / 86400, 1),
+            "repeticoes": self.repeticoes,
+            "intervalo_dias": self.intervalo,
+            "facilidade": round(self.facilidade, 2)
+        }
+
+
+class BaralhoRevisao:
+    """
+    Cartões de um usuário com um min-heap por vencimento
+
+    O heap guarda (vencimento, item); ao reagendar um cartão a entrada
+    antiga fica obsoleta e é descartada quando chega ao topo (remoção
+    preguiçosa), então responder custa O(log n) e ver os k vencidos custa
+    O(k log n), mesmo com dezenas de milhares de itens.
+    """
+
+    def __init__(self, cartoes=()):
+        self.lock = threading.Lock()
+        self.cartoes = {c.item: c for c in cartoes}
+        self._heap = [(c.vencimento, c.item) for c in self.cartoes.values()]
+        heapq.heapify(self._heap)
+
+    def __len__(self):
+        return len(self.cartoes)
+
+    def _obsoleta(self, entrada: tuple) -> bool:
+        cartao = self.cartoes.get(entrada[1])
+        return cartao is None or cartao.vencimento != entrada[0]
+
+    def _limpar_topo(self) -> None:
+        while self._heap and self._obsoleta(self._heap[0]):
+            heapq.heappop(self._heap)
+
+    def reagendar(self, cartao: CartaoRevisao) -> None:
+        self.cartoes[cartao.item] = cartao
+        heapq.heappush(self._heap, (cartao.vencimento, cartao.item))
+        # Entradas obsoletas demais: reconstrói o heap em O(n)
+        if len(self._heap) > 2 * len(self.cartoes) + 64:
+            self._heap = [(c.vencimento, c.item) for c in self.cartoes.values()]
+            heapq.heapify(self._heap)
+
+    def responder(self, item: str, nota: int, agora: float) -> CartaoRevisao:
+        cartao = self.cartoes.get(item)
+        if cartao is None:
+            cartao = CartaoRevisao(item)
+        cartao.responder(nota, agora)
+        self.reagendar(cartao)
+        return cartao
+
+    def proximo_vencimento(self):
+        self._limpar_topo()
+        return self._heap[0][0] if self._heap else None
+
+    def vencidos(self, agora: float, limite: int) -> list:
+        """Até `limite` cartões vencidos, do mais atrasado ao mais recente"""
+        retirados = []
+        vencidos = []
+        # Reagendar com o mesmo vencimento (ex.: item respondido duas vezes
+        # no mesmo lote) deixa duas entradas atuais iguais no heap
+        vistos = set()
+        self._limpar_topo()
+        while self._heap and self._heap[0][0] <= agora and len(vencidos) < limite:
+            entrada = heapq.heappop(self._heap)
+            retirados.append(entrada)
+            if entrada[1] not in vistos:
+                vistos.add(entrada[1])
+                vencidos.append(self.cartoes[entrada[1]])
+            self._limpar_topo()
+        for entrada in retirados:
+            heapq.heappush(self._heap, entrada)
+        return vencidos
+
+
+def item_revisao(materia: str, topico: str) -> str:
+    """Identificador estável de um tópico de estudo: 'materia/topico' normalizados"""
+    return f"{normalizar_texto(materia)}/{normalizar_texto(topico)}"
+
+
+class RevisoesEspacadas:
+    """
+    Agenda de revisões de todos os usuários
+
+    Baralhos são carregados do armazenamento no primeiro acesso (fora do
+    lock global: só quem pede o mesmo usuário espera) e mantidos em um
+    LRU. Respostas atualizam o baralho em memória e ficam pendentes
+    até uma thread gravá-las em lote (write-behind, como as sessões), fora
+    do caminho da requisição; um baralho recarregado do banco recebe as
+    linhas ainda pendentes, então descartá-lo da memória não perde nada.
+    """
+
+    def __init__(self, armazenamento=None, max_baralhos: int = REVISAO_MAX_BARALHOS):
+        self._armazenamento = armazenamento
+        self._baralhos = OrderedDict()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self.max_baralhos = max_baralhos
+        # {usuario_id: {item: linha}} ainda não gravados (ver gravar_linhas_revisao)
+        self._pendentes = {}
+        # {usuario_id: {item: linha}} gravados enquanto o baralho é lido do banco
+        self._carregando = {}
+        self._thread = None
+        self._encerrar = False
+
+    def _fonte(self):
+        return self._armazenamento or obter_armazenamento()
+
+    def baralho(self, usuario_id: str) -> BaralhoRevisao:
+        with self._cond:
+            while True:
+                baralho = self._baralhos.get(usuario_id)
+                if baralho is not None:
+                    self._baralhos.move_to_end(usuario_id)
+                    return baralho
+                if usuario_id not in self._carregando:
+                    break
+                self._cond.wait()
+            gravadas = self._carregando[usuario_id] = {}
+        try:
+            baralho = BaralhoRevisao(CartaoRevisao(*linha) for linha in self._fonte().listar_revisoes(usuario_id))
+        except Exception:
+            with self._cond:
+                del self._carregando[usuario_id]
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            # Linhas gravadas durante a leitura (que ela pode não ter visto) e
+            # as ainda pendentes, nessa ordem, por cima do que veio do banco
+            del self._carregando[usuario_id]
+            for linhas in (gravadas, self._pendentes.get(usuario_id, {})):
+                for linha in linhas.values():
+                    baralho.reagendar(CartaoRevisao(*linha[1:]))
+            self._baralhos[usuario_id] = baralho
+            while len(self._baralhos) > self.max_baralhos:
+                self._baralhos.popitem(last=False)
+            self._cond.notify_all()
+        return baralho
+
+    def responder(self, usuario_id: str, respostas, agora: float = None) -> list:
+        """Aplica respostas [(item, nota)]; os cartões atualizados são gravados em segundo plano"""
+        agora = time.time() if agora is None else agora
+        baralho = self.baralho(usuario_id)
+        with baralho.lock:
+            cartoes = [baralho.responder(item, nota, agora) for item, nota in respostas]
+            linhas = [(usuario_id, c.item, c.repeticoes, c.intervalo, c.facilidade, c.vencimento)
+                      for c in cartoes]
+        with self._cond:
+            pendentes = self._pendentes.setdefault(usuario_id, {})
+            for linha in linhas:
+                pendentes[linha[1]] = linha
+            atual = self._baralhos.get(usuario_id)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._escritor, name="escritor-revisoes", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+        # O baralho saiu do LRU e foi recarregado durante a resposta: leva os cartões para a cópia atual
+        if atual is not None and atual is not baralho:
+            with atual.lock:
+                for linha in linhas:
+                    atual.reagendar(CartaoRevisao(*linha[1:]))
+        return cartoes
+
+    def _escritor(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pendentes or self._encerrar)
+                if not self._pendentes:
+                    return
+                encerrar = self._encerrar
+            if not encerrar:
+                time.sleep(REVISAO_ATRASO_GRAVACAO)
+            with self._cond:
+                lote = [linha for pendentes in self._pendentes.values() for linha in pendentes.values()]
+            try:
+                self._fonte().gravar_linhas_revisao(lote)
+            except Exception as e:
+                logging.error(f"Erro ao gravar {len(lote)} cartões de revisão: {str(e)}")
+                if encerrar:
+                    return
+                time.sleep(1)
+                continue
+            with self._cond:
+                # Só sai das pendências a linha gravada; respostas mais novas do mesmo item ficam
+                for linha in lote:
+                    carga = self._carregando.get(linha[0])
+                    if carga is not None:
+                        carga[linha[1]] = linha
+                    pendentes = self._pendentes.get(linha[0])
+                    if pendentes is not None and pendentes.get(linha[1]) is linha:
+                        del pendentes[linha[1]]
+                        if not pendentes:
+                            del self._pendentes[linha[0]]
+                self._cond.notify_all()
+                if encerrar:
+                    return
+
+    def aguardar(self, timeout: float = 5.0) -> bool:
+        """Espera os cartões pendentes serem gravados"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pendentes, timeout)
+
+    def drenar(self, timeout: float = 10.0) -> None:
+        """Grava os cartões pendentes e encerra a thread escritora (chamado no atexit)"""
+        with self._cond:
+            self._encerrar = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def registrar_estudo(self, usuario_id: str, materia: str, topicos, agora: float = None) -> list:
+        """Tópicos estudados contam como revisão com nota REVISAO_NOTA_ESTUDO"""
+        itens = dict.fromkeys(item_revisao(materia, t) for t in topicos if t.strip())
+        return self.responder(usuario_id, [(item, REVISAO_NOTA_ESTUDO) for item in itens], agora)
+
+    def pendentes(self, usuario_id: str, limite: int = 20, agora: float = None) -> dict:
+        agora = time.time() if agora is None else agora
+        baralho = self.baralho(usuario_id)
+        with baralho.lock:
+            vencidos = baralho.vencidos(agora, limite)
+            proximo = baralho.proximo_vencimento()
+            total = len(baralho)
+        return {
+            "pendentes": [c.para_dict(agora) for c in vencidos],
+            "total_itens": total,
+            "proxima_revisao": (datetime.fromtimestamp(proximo).isoformat(timespec="seconds")
+                                if proximo is not None else None)
+        }
+
+
+_revisoes = None
+
+
+def obter_revisoes() -> RevisoesEspacadas:
+    """Agenda de revisões do worker, criada no primeiro uso"""
+    global _revisoes
+    if _revisoes is None:
+        armazenamento = obter_armazenamento()
+        with _armazenamento_lock:
+            if _revisoes is None:
+                _revisoes = RevisoesEspacadas(armazenamento)
+                # atexit executa em ordem inversa: grava os cartões antes de fechar o banco
+                atexit.register(_revisoes.drenar)
+    return _revisoes
@@ -0,0 +1,31 @@
+"""
+Redistribui o armazenamento de progresso entre shards (execução offline)
+
+Uso (com todos os workers parados):
+    python rebalancear_progresso.py --origem 1 --destino 4
+    python rebalancear_progresso.py --caminho /dados/estudai_progresso.db --origem 4 --destino 8
+
+Depois, configure PROGRESSO_SHARDS com o valor de --destino. Os arquivos
+antigos ficam guardados com o sufixo .<data-hora>.bak (um por execução).
+"""
+import argparse
+import json
+import logging
+
+from function_app import PROGRESSO_DB_PATH, rebalancear_shards
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebalanceia o progresso entre shards SQLite")
+    parser.add_argument("--caminho", default=PROGRESSO_DB_PATH, help="Caminho base do banco de progresso")
+    parser.add_argument("--origem", type=int, required=True, help="Quantidade atual de shards")
+    parser.add_argument("--destino", type=int, required=True, help="Nova quantidade de shards")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    resultado = rebalancear_shards(args.caminho, args.origem, args.destino)
+    print(json.dumps(resultado, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
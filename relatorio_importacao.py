@@ -0,0 +1,86 @@
+"""
+Relatório do tempo de importação do function_app (cold start)
+
+Uso:
+    python relatorio_importacao.py
+    python relatorio_importacao.py --top 20 --orcamento-ms 1000
+
+Importa o módulo num interpretador novo com `python -X importtime` e lista
+as dependências diretas que mais pesam. Sai com código 1 quando o total
+passa do orçamento (ORCAMENTO_IMPORTACAO_MS ou --orcamento-ms).
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ORCAMENTO_IMPORTACAO_MS = float(os.environ.get("ORCAMENTO_IMPORTACAO_MS", "1000"))
+
+
+def medir_importacao(modulo: str = "function_app", repeticoes: int = 1) -> dict:
+    """
+    Mede a importação de `modulo` em subprocessos (mantém a execução mais
+    rápida). Retorna total_ms, as dependências diretas como (nome, ms)
+    em ordem decrescente e o conjunto de todos os módulos carregados.
+    """
+    diretorio = os.path.dirname(os.path.abspath(__file__))
+    melhor = None
+    for _ in range(max(repeticoes, 1)):
+        saida = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+            cwd=diretorio, capture_output=True, text=True, check=True
+        ).stderr
+        medicao = _interpretar_importtime(saida, modulo)
+        if melhor is None or medicao["total_ms"] < melhor["total_ms"]:
+            melhor = medicao
+    return melhor
+
+
+def _interpretar_importtime(saida: str, modulo: str) -> dict:
+    # Linhas "import time: self | cumulativo | <recuo>nome", filhos antes do pai
+    linhas = []
+    for linha in saida.splitlines():
+        if not linha.startswith("import time:") or "|" not in linha:
+            continue
+        _, cumulativo, nome = linha[len("import time:"):].split("|", 2)
+        if not cumulativo.strip().isdigit():
+            continue  # cabeçalho
+        recuo = len(nome) - len(nome.lstrip(" "))
+        linhas.append((nome.strip(), int(cumulativo) / 1000, recuo))
+
+    indice = next(i for i, (nome, _, recuo) in enumerate(linhas) if nome == modulo and recuo == 1)
+    total_ms = linhas[indice][1]
+    diretas = []
+    # Os imports do módulo vêm logo antes dele, até a linha anterior de mesmo nível
+    for nome, cumulativo_ms, recuo in reversed(linhas[:indice]):
+        if recuo <= 1:
+            break
+        if recuo == 3:
+            diretas.append((nome, cumulativo_ms))
+    diretas.sort(key=lambda item: -item[1])
+    return {
+        "total_ms": total_ms,
+        "dependencias": diretas,
+        "modulos_carregados": {nome for nome, _, _ in linhas}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede o tempo de importação do function_app")
+    parser.add_argument("--modulo", default="function_app", help="Módulo a importar")
+    parser.add_argument("--top", type=int, default=15, help="Quantidade de dependências listadas")
+    parser.add_argument("--repeticoes", type=int, default=3, help="Medições (vale a mais rápida)")
+    parser.add_argument("--orcamento-ms", type=float, default=ORCAMENTO_IMPORTACAO_MS,
+                        help="Tempo máximo aceito para a importação")
+    args = parser.parse_args()
+
+    relatorio = medir_importacao(args.modulo, args.repeticoes)
+    print(f"{args.modulo}: {relatorio['total_ms']:.1f} ms (orçamento: {args.orcamento_ms:.0f} ms)")
+    for nome, ms in relatorio["dependencias"][:args.top]:
+        print(f"  {ms:8.1f} ms  {nome}")
+    if relatorio["total_ms"] > args.orcamento_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
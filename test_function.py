@@ -2,15 +2,82 @@
 Testes unitários para a Azure Function de busca educacional
 """
 import pytest
+import asyncio
+import gzip
 import json
+import os
+import threading
+import time
+import numpy as np
 from function_app import (
     simular_busca, 
     criar_questoes, 
     criar_resumo, 
     calcular_pontos, 
     gerar_mensagem_motivacao,
-    gerar_dashboard_demo
+    gerar_dashboard_demo,
+    normalizar_texto,
+    distancia_edicao,
+    IndiceTopicos,
+    resumir_texto,
+    resumir_texto_incremental,
+    BLOCO_SENTENCAS,
+    DictImutavel,
+    congelar,
+    ArmazenamentoProgresso,
+    FilaEscritaProgresso,
+    FilaProgressoCheia,
+    validar_sessao,
+    importar_progresso,
+    registrar_progresso,
+    gerar_dashboard,
+    ingerir_lote,
+    SessoesColunares,
+    CacheDashboard,
+    CalendarioAtividade,
+    obter_dashboard,
+    ListaSaltosIndexada,
+    PlacarPontos,
+    ranking,
+    analisar_coorte,
+    analise_coorte,
+    RecomendadorMaterias,
+    CartaoRevisao,
+    BaralhoRevisao,
+    RevisoesEspacadas,
+    revisoes_pendentes,
+    responder_revisao,
+    ArmazenamentoFragmentado,
+    caminhos_shards,
+    indice_shard,
+    rebalancear_shards,
+    serializar_json,
+    corpo_erro,
+    resposta_erro,
+    gerar_cronograma,
+    gerar_simulado,
+    negociar_codificacao,
+    gzip_prefixo,
+    gzip_concluir,
+    gerar_resumo,
+    calcular_etag,
+    ValidadoresEtag,
+    compilar_projecao,
+    projetar,
+    campo_solicitado,
+    executar_lote,
+    buscar_web,
+    gerar_dica_estudo,
+    BASE_CONHECIMENTO,
+    MedicaoTempo,
+    etapa,
+    RegistroMetricas,
+    metricas_prometheus
 )
+from datetime import date, datetime, timedelta
+import azure.functions as func
+import function_app
+from relatorio_importacao import ORCAMENTO_IMPORTACAO_MS, medir_importacao
 
 
 class TestSimularBusca:
@@ -254,6 +321,143 @@ class TestGeradorResumos:
             assert isinstance(resumo, dict)
 
 
+class TestIndiceTopicos:
+    """Testes para o índice de tópicos com busca aproximada"""
+    
+    def test_normalizar_texto(self):
+        """Testa remoção de acentos, maiúsculas e espaços extras"""
+        assert normalizar_texto("  Fotossíntese   Vegetal ") == "fotossintese vegetal"
+        assert normalizar_texto("REDAÇÃO") == "redacao"
+    
+    def test_distancia_edicao(self):
+        """Testa distância de Levenshtein com limite"""
+        assert distancia_edicao("fotossintese", "fotossintese", 2) == 0
+        assert distancia_edicao("fotosintese", "fotossintese", 2) == 1
+        assert distancia_edicao("abc", "xyzxyz", 2) == 3
+    
+    def test_resumo_com_acentos_e_erro_de_digitacao(self):
+        """Testa que acentos e erros de digitação encontram o resumo certo"""
+        esperado = criar_resumo("fotossintese", "biologia", "completo")["conceito"]
+        
+        for topico in ["Fotossíntese", "fotosintese", "fotossintese nas plantas"]:
+            assert criar_resumo(topico, "biologia", "completo")["conceito"] == esperado
+    
+    def test_sinonimos(self):
+        """Testa sinônimos registrados no índice"""
+        resumo = criar_resumo("Segunda Guerra Mundial", "historia", "rapido")
+        assert "1939" in resumo["conceito"]
+    
+    def test_topico_sem_correspondencia(self):
+        """Testa que tópicos distantes não casam com nenhuma chave"""
+        resumo = criar_resumo("Teoria da Relatividade", "fisica", "completo")
+        assert resumo["conceito"] == "Resumo sobre: Teoria da Relatividade"
+    
+    def test_indice_grande(self):
+        """Testa busca em um índice com milhares de entradas"""
+        indice = IndiceTopicos((f"topico numero {i}", i) for i in range(5000))
+        indice.adicionar("Revolução Industrial", "revolucao")
+        
+        assert len(indice) == 5001
+        assert indice.buscar("revolucao industrial") == "revolucao"
+        assert indice.buscar("revolusao industrial") == "revolucao"
+        assert indice.buscar("topico numero 4321") == 4321
+        assert indice.buscar("") is None
+    
+    def test_detalhado_nao_altera_base(self):
+        """Testa que o tipo detalhado não modifica a base compartilhada"""
+        criar_resumo("fotossintese", "biologia", "detalhado")
+        resumo = criar_resumo("fotossintese", "biologia", "completo")
+        
+        assert "mapa_mental" not in resumo
+
+
+class TestResumosImutaveis:
+    """Testes para resumos imutáveis e memorizados"""
+    
+    def test_resumo_nao_pode_ser_alterado(self):
+        """Testa que o resumo compartilhado é somente leitura"""
+        resumo = criar_resumo("fotossintese", "biologia", "detalhado")
+        
+        with pytest.raises(TypeError):
+            resumo["conceito"] = "alterado"
+        with pytest.raises(TypeError):
+            resumo["pontos_principais"].append("novo ponto")
+        with pytest.raises(TypeError):
+            resumo["mapa_mental"]["centro"] = "outro"
+    
+    def test_resumo_memorizado(self):
+        """Testa que a mesma combinação devolve o mesmo objeto"""
+        primeiro = criar_resumo("fotossintese", "biologia", "completo")
+        segundo = criar_resumo("  fotossintese ", "Biologia", "completo")
+        
+        assert primeiro is segundo
+    
+    def test_copia_mutavel(self):
+        """Testa que copy() devolve um dict comum que pode ser alterado"""
+        copia = criar_resumo("fotossintese", "biologia", "completo").copy()
+        copia["extra"] = True
+        
+        assert "extra" not in criar_resumo("fotossintese", "biologia", "completo")
+    
+    def test_congelar_serializa_como_json(self):
+        """Testa que objetos congelados serializam como dict/list comuns"""
+        dados = congelar({"a": [1, {"b": 2}]})
+        
+        assert isinstance(dados, DictImutavel)
+        assert json.loads(json.dumps(dados)) == {"a": [1, {"b": 2}]}
+
+
+TEXTO_FOTOSSINTESE = """
+A fotossíntese é o processo pelo qual as plantas produzem glicose a partir de luz solar.
+Ela ocorre nos cloroplastos, organelas que contêm clorofila.
+A clorofila absorve a luz solar e inicia a fase clara da fotossíntese.
+Na fase clara, a água é quebrada e o oxigênio é liberado para a atmosfera.
+Na fase escura, o Ciclo de Calvin fixa o gás carbônico e produz glicose.
+A glicose produzida serve de energia para a planta crescer.
+"""
+
+
+class TestResumoExtrativo:
+    """Testes para o resumo extrativo de textos enviados pelo estudante"""
+    
+    def test_resumo_texto_estrutura(self):
+        """Testa que o resumo de texto tem o mesmo formato de criar_resumo"""
+        resumo = resumir_texto(TEXTO_FOTOSSINTESE, "fotossintese", "completo")
+        
+        assert resumo["conceito"] in TEXTO_FOTOSSINTESE
+        assert 0 < len(resumo["pontos_principais"]) <= 4
+        assert all(p in TEXTO_FOTOSSINTESE for p in resumo["pontos_principais"])
+        assert "fotossíntese" in resumo["palavras_chave"] or "glicose" in resumo["palavras_chave"]
+    
+    def test_resumo_texto_tipos(self):
+        """Testa quantidade de conteúdo por tipo de resumo"""
+        rapido = resumir_texto(TEXTO_FOTOSSINTESE, "", "rapido")
+        detalhado = resumir_texto(TEXTO_FOTOSSINTESE, "", "detalhado")
+        
+        assert len(rapido["pontos_principais"]) <= 2
+        assert len(rapido["palavras_chave"]) <= 3
+        assert "mapa_mental" in detalhado
+        assert len(detalhado["pontos_principais"]) > len(rapido["pontos_principais"])
+    
+    def test_resumo_texto_longo_incremental(self):
+        """Testa resultados parciais por bloco em textos longos"""
+        texto = " ".join(
+            f"A sentença {i} fala sobre células, energia e metabolismo celular." 
+            for i in range(BLOCO_SENTENCAS * 3)
+        )
+        partes = list(resumir_texto_incremental(texto, "completo"))
+        
+        assert len(partes) == 4
+        assert [p["final"] for p in partes] == [False, False, False, True]
+        assert partes[0]["total_blocos"] == 3
+        assert "conceito" in partes[-1]["resumo"]
+    
+    def test_resumo_texto_vazio(self):
+        """Testa que texto sem conteúdo gera erro de validação"""
+        with pytest.raises(ValueError):
+            resumir_texto("... !!! 123", "", "completo")
+
+
 class TestDashboardProgresso:
     """Testes para o sistema de progresso e dashboard"""
     
@@ -326,6 +530,1777 @@ class TestDashboardProgresso:
         assert all(isinstance(v, float) for v in distribuicao.values())
 
 
+class TestArmazenamentoProgresso:
+    """Testes para o armazenamento de progresso em SQLite"""
+    
+    def _sessao(self, usuario_id="aluno1", materia="Matematica", tempo=30):
+        return {
+            "usuario_id": usuario_id,
+            "materia": materia,
+            "tempo_minutos": tempo,
+            "topicos_estudados": ["equacoes"],
+            "pontos": calcular_pontos(tempo, 1)
+        }
+    
+    def test_registrar_e_listar(self, tmp_path):
+        """Testa que sessões gravadas podem ser lidas de volta"""
+        armazenamento = ArmazenamentoProgresso(str(tmp_path / "progresso.db"))
+        armazenamento.registrar(self._sessao(tempo=45))
+        armazenamento.registrar(self._sessao(usuario_id="aluno2"))
+        
+        sessoes = armazenamento.listar_sessoes("aluno1")
+        assert len(sessoes) == 1
+        assert sessoes[0]["tempo_minutos"] == 45
+        assert sessoes[0]["topicos_estudados"] == ["equacoes"]
+        assert sessoes[0]["pontos"] == 100
+        armazenamento.fechar()
+    
+    def test_persistencia_entre_instancias(self, tmp_path):
+        """Testa que os dados sobrevivem à reabertura do banco"""
+        caminho = str(tmp_path / "progresso.db")
+        armazenamento = ArmazenamentoProgresso(caminho, durabilidade="full")
+        armazenamento.registrar_lote([self._sessao() for _ in range(10)])
+        armazenamento.fechar()
+        
+        assert ArmazenamentoProgresso(caminho).contar_sessoes() == 10
+    
+    def test_group_commit_concorrente(self, tmp_path):
+        """Testa que escritas concorrentes são agrupadas em menos commits"""
+        armazenamento = ArmazenamentoProgresso(str(tmp_path / "progresso.db"))
+        
+        def escrever(i):
+            for _ in range(100):
+                armazenamento.registrar(self._sessao(usuario_id=f"aluno{i}"))
+        
+        threads = [threading.Thread(target=escrever, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        assert armazenamento.contar_sessoes() == 800
+        assert armazenamento.total_commits <= 800
+        assert len(armazenamento.listar_sessoes("aluno3")) == 100
+    
+    def test_durabilidade_invalida(self, tmp_path):
+        """Testa que nível de durabilidade desconhecido é rejeitado"""
+        with pytest.raises(ValueError):
+            ArmazenamentoProgresso(str(tmp_path / "progresso.db"), durabilidade="talvez")
+
+
+class TestFilaEscritaProgresso:
+    """Testes para a fila de escrita atrasada (write-behind)"""
+    
+    def _sessao(self, usuario_id="aluno1"):
+        return {"usuario_id": usuario_id, "materia": "Fisica", "tempo_minutos": 20, "pontos": 40}
+    
+    def test_leitura_ve_propria_escrita(self, tmp_path):
+        """Testa que aguardar() garante leitura das sessões enfileiradas"""
+        armazenamento = ArmazenamentoProgresso(str(tmp_path / "progresso.db"))
+        fila = FilaEscritaProgresso(armazenamento)
+        for _ in range(50):
+            fila.enfileirar(self._sessao())
+        
+        assert fila.aguardar("aluno1")
+        assert len(armazenamento.listar_sessoes("aluno1")) == 50
+        fila.drenar()
+    
+    def test_drenar_grava_pendentes(self, tmp_path):
+        """Testa que o encerramento grava tudo o que estava na fila"""
+        armazenamento = ArmazenamentoProgresso(str(tmp_path / "progresso.db"))
+        fila = FilaEscritaProgresso(armazenamento, tamanho_lote=7)
+        for i in range(100):
+            fila.enfileirar(self._sessao(usuario_id=f"aluno{i % 3}"))
+        fila.drenar()
+        
+        assert armazenamento.contar_sessoes() == 100
+        with pytest.raises(RuntimeError):
+            fila.enfileirar(self._sessao())
+    
+    def test_put_depois_do_fim_e_gravado(self, tmp_path):
+        """Testa que um put ainda em andamento quando drenar marca o fim não se perde"""
+        armazenamento = ArmazenamentoProgresso(str(tmp_path / "progresso.db"))
+        fila = FilaEscritaProgresso(armazenamento)
+        fim_enfileirado = threading.Event()
+        put_original = fila._fila.put
+        
+        def put(item, *args, **kwargs):
+            if item is function_app._FIM_FILA:
+                put_original(item, *args, **kwargs)
+                fim_enfileirado.set()
+                return
+            # Como um put que esperava espaço: só entra depois do marco de fim
+            assert fim_enfileirado.wait(5)
+            time.sleep(0.1)
+            put_original(item, *args, **kwargs)
+        
+        fila._fila.put = put
+        produtor = threading.Thread(target=fila.enfileirar, args=(self._sessao(),))
+        produtor.start()
+        while not fila._produtores:
+            time.sleep(0.01)
+        fila.drenar()
+        produtor.join()
+        
+        assert armazenamento.contar_sessoes() == 1
+        assert fila.aguardar(timeout=0)
+    
+    def test_fila_cheia_aplica_backpressure(self):
+        """Testa que a fila cheia recusa novas sessões após o timeout"""
+        liberar = threading.Event()
+        
+        class ArmazenamentoLento:
+            def registrar_lote(self, sessoes):
+                liberar.wait(5)
+        
+        fila = FilaEscritaProgresso(ArmazenamentoLento(), capacidade=2, timeout=0.05)
+        with pytest.raises(FilaProgressoCheia):
+            for _ in range(10):
+                fila.enfileirar(self._sessao())
+        
+        liberar.set()
+        fila.drenar()
+    
+    def test_espera_por_espaco_nao_serializa(self):
+        """Testa que, com a fila cheia, cada requisição espera só o próprio timeout"""
+        liberar = threading.Event()
+        
+        class ArmazenamentoLento:
+            def registrar_lote(self, sessoes):
+                liberar.wait(5)
+        
+        fila = FilaEscritaProgresso(ArmazenamentoLento(), capacidade=1, timeout=0.2)
+        fila.enfileirar(self._sessao())
+        while fila.profundidade():  # escritora pegou a primeira e ficou presa
+            time.sleep(0.01)
+        fila.enfileirar(self._sessao())
+        
+        recusadas = []
+        def enfileirar():
+            try:
+                fila.enfileirar(self._sessao())
+            except FilaProgressoCheia:
+                recusadas.append(1)
+        inicio = time.perf_counter()
+        threads = [threading.Thread(target=enfileirar) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        assert len(recusadas) == 5
+        assert time.perf_counter() - inicio < 0.6  # em série seriam 5 x 0,2 s
+        liberar.set()
+        assert fila.aguardar(timeout=2)  # as recusadas não travam a sequência
+        fila.drenar()
+    
+    def test_sessao_com_erro_nao_derruba_o_lote(self, tmp_path):
+        """Testa que só a sessão que o SQLite rejeita é descartada"""
+        armazenamento = ArmazenamentoProgresso(str(tmp_path / "progresso.db"))
+        fila = FilaEscritaProgresso(armazenamento)
+        for i in range(20):
+            fila.enfileirar(self._sessao(usuario_id=f"aluno{i % 4}"))
+            if i == 10:
+                fila.enfileirar({**self._sessao("aluno9"), "tempo_minutos": 10**20})
+        
+        assert fila.aguardar()
+        assert armazenamento.contar_sessoes() == 20
+        assert fila.total_falhas == 1
+        assert [s["usuario_id"] for s in fila.descartadas] == ["aluno9"]
+        fila.drenar()
+    
+    def test_falha_parcial_entre_shards_sem_duplicar(self, tmp_path):
+        """Testa que a nova tentativa regrava só o shard que falhou"""
+        armazenamento = ArmazenamentoFragmentado(str(tmp_path / "progresso.db"), num_shards=2)
+        usuarios = {indice_shard(f"aluno{i}", 2): f"aluno{i}" for i in range(10)}
+        fila = FilaEscritaProgresso(armazenamento)
+        fila.enfileirar({**self._sessao(usuarios[0]), "tempo_minutos": 10**20})
+        for _ in range(5):
+            fila.enfileirar(self._sessao(usuarios[0]))
+            fila.enfileirar(self._sessao(usuarios[1]))
+        
+        assert fila.aguardar()
+        assert len(armazenamento.listar_sessoes(usuarios[0])) == 5
+        assert len(armazenamento.listar_sessoes(usuarios[1])) == 5
+        assert fila.total_falhas == 1
+        fila.drenar()
+        armazenamento.fechar()
+
+
+@pytest.fixture
+def armazenamento_temporario(tmp_path, monkeypatch):
+    """Armazenamento de progresso isolado em um diretório temporário"""
+    armazenamento = ArmazenamentoProgresso(str(tmp_path / "progresso.db"))
+    monkeypatch.setattr(function_app, "_armazenamento", armazenamento)
+    monkeypatch.setattr(function_app, "_fila_progresso", None)
+    monkeypatch.setattr(function_app, "_rollups", None)
+    monkeypatch.setattr(function_app, "_sessoes_colunares", None)
+    monkeypatch.setattr(function_app, "_captura_colunas", None)
+    monkeypatch.setattr(function_app, "_cache_dashboard", CacheDashboard())
+    monkeypatch.setattr(function_app, "_placar", None)
+    monkeypatch.setattr(function_app, "_recomendador", None)
+    monkeypatch.setattr(function_app, "_recomendador_thread", None)
+    monkeypatch.setattr(function_app, "_revisoes", None)
+    monkeypatch.setattr(function_app, "RANKING_INSTANTANEO_PATH", str(tmp_path / "ranking.json"))
+    yield armazenamento
+    if function_app._fila_progresso is not None:
+        function_app._fila_progresso.drenar()
+    if function_app._revisoes is not None:
+        function_app._revisoes.drenar()
+    function_app.aguardar_recomendador()
+
+
+class TestImportacaoProgresso:
+    """Testes para a importação de sessões em NDJSON"""
+    
+    def _requisicao(self, linhas, params=None):
+        corpo = "\n".join(
+            linha if isinstance(linha, str) else json.dumps(linha) for linha in linhas
+        ).encode("utf-8")
+        return func.HttpRequest("POST", "/api/importar-progresso", body=corpo, params=params or {})
+    
+    def test_validar_sessao(self):
+        """Testa normalização e erros de validação de uma sessão"""
+        sessao = validar_sessao({"materia": " Fisica ", "tempo_minutos": 30})
+        assert sessao["usuario_id"] == "default"
+        assert sessao["materia"] == "Fisica"
+        assert sessao["topicos_estudados"] == []
+        
+        with pytest.raises(ValueError):
+            validar_sessao({"materia": "Fisica", "tempo_minutos": "30"})
+        for tempo in (float("inf"), float("nan"), 10**20, 24 * 60 + 1):
+            with pytest.raises(ValueError):
+                validar_sessao({"materia": "Fisica", "tempo_minutos": tempo})
+        with pytest.raises(ValueError):
+            validar_sessao({"materia": "Fisica", "tempo_minutos": 30,
+                            "data_registro": "ontem"}, aceitar_data=True)
+    
+    def test_importacao_com_erros_por_linha(self, armazenamento_temporario):
+        """Testa que linhas válidas são gravadas e inválidas são reportadas"""
+        linhas = [
+            {"materia": "Historia", "tempo_minutos": 40, "data_registro": "2025-03-10T19:00:00"},
+            "{json quebrado",
+            "",
+            {"materia": "", "tempo_minutos": 10},
+            [1, 2, 3],
+            {"usuario_id": "aluno9", "materia": "Quimica", "tempo_minutos": 25}
+        ]
+        resposta = asyncio.run(importar_progresso(self._requisicao(linhas, {"usuario_id": "aluno1"})))
+        dados = json.loads(resposta.get_body())
+        
+        assert resposta.status_code == 200
+        assert dados["total_linhas"] == 5
+        assert dados["importadas"] == 2
+        assert [e["linha"] for e in dados["erros"]] == [2, 4, 5]
+        assert armazenamento_temporario.listar_sessoes("aluno1")[0]["data_registro"] == "2025-03-10T19:00:00"
+        assert len(armazenamento_temporario.listar_sessoes("aluno9")) == 1
+    
+    def test_tempo_fora_do_limite_por_linha(self, armazenamento_temporario):
+        """Testa que 1e400 e 10**20 viram erro da linha sem derrubar o restante do lote"""
+        linhas = [
+            '{"materia": "Fisica", "tempo_minutos": 1e400}',
+            {"materia": "Fisica", "tempo_minutos": 10**20},
+            {"usuario_id": "aluno8", "materia": "Quimica", "tempo_minutos": 25}
+        ]
+        resposta = asyncio.run(importar_progresso(self._requisicao(linhas, {"usuario_id": "aluno1"})))
+        dados = json.loads(resposta.get_body())
+        
+        assert resposta.status_code == 200
+        assert dados["importadas"] == 1
+        assert [e["linha"] for e in dados["erros"]] == [1, 2]
+        assert len(armazenamento_temporario.listar_sessoes("aluno8")) == 1
+        
+        registro = asyncio.run(registrar_progresso(func.HttpRequest(
+            "POST", "/api/registrar-progresso", body=b'{"materia": "Fisica", "tempo_minutos": 100000000000000000000}'
+        )))
+        assert registro.status_code == 400
+    
+    def test_importacao_grande_em_lotes(self, armazenamento_temporario):
+        """Testa importação de vários lotes em uma única requisição"""
+        linhas = [{"materia": "Biologia", "tempo_minutos": 30} for _ in range(1200)]
+        resposta = asyncio.run(importar_progresso(self._requisicao(linhas, {"usuario_id": "aluno2"})))
+        
+        assert json.loads(resposta.get_body())["importadas"] == 1200
+        assert armazenamento_temporario.contar_sessoes() == 1200
+    
+    def test_importacao_vazia(self, armazenamento_temporario):
+        """Testa que corpo sem sessões retorna 400"""
+        resposta = asyncio.run(importar_progresso(self._requisicao(["", "  "])))
+        assert resposta.status_code == 400
+
+
+def _sessao_em(usuario_id, dia, materia="Matematica", minutos=60):
+    """Sessão de estudo às 19h do dia informado"""
+    return validar_sessao({
+        "usuario_id": usuario_id,
+        "materia": materia,
+        "tempo_minutos": minutos,
+        "data_registro": datetime.combine(dia, datetime.min.time()).replace(hour=19).isoformat()
+    }, aceitar_data=True)
+
+
+class TestDashboardReal:
+    """Testes para o dashboard calculado a partir dos rollups de progresso"""
+    
+    # Quarta-feira
+    HOJE = date(2025, 3, 12)
+    
+    def test_dashboard_sem_sessoes(self, armazenamento_temporario):
+        """Testa dashboard de usuário sem histórico"""
+        dashboard = gerar_dashboard("novato", "semanal", self.HOJE)
+        
+        assert dashboard["estatisticas_gerais"]["total_horas_estudadas"] == 0
+        assert len(dashboard["progresso_semanal"]) == 7
+        assert not any(c["desbloqueado"] for c in dashboard["conquistas"])
+    
+    def test_rollups_por_periodo(self, armazenamento_temporario):
+        """Testa totais diário, semanal e mensal"""
+        segunda = self.HOJE - timedelta(days=2)
+        ingerir_lote([
+            _sessao_em("aluno1", self.HOJE, "Matematica", 90),
+            _sessao_em("aluno1", self.HOJE, "Fisica", 30),
+            _sessao_em("aluno1", segunda, "Quimica", 60),
+            _sessao_em("aluno1", date(2025, 3, 3), "Historia", 120),
+            _sessao_em("aluno1", date(2025, 2, 20), "Biologia", 600),
+        ])
+        
+        diario = gerar_dashboard("aluno1", "diario", self.HOJE)
+        semanal = gerar_dashboard("aluno1", "semanal", self.HOJE)
+        mensal = gerar_dashboard("aluno1", "mensal", self.HOJE)
+        
+        assert diario["estatisticas_gerais"]["total_horas_estudadas"] == 2.0
+        assert diario["distribuicao_materias"] == {"Matematica": 1.5, "Fisica": 0.5}
+        assert semanal["estatisticas_gerais"]["total_horas_estudadas"] == 3.0
+        assert [d["horas"] for d in semanal["progresso_semanal"]] == [1.0, 0.0, 2.0, 0.0, 0.0, 0.0, 0.0]
+        assert semanal["meta_semanal"]["percentual_atingido"] == 15.0
+        assert mensal["estatisticas_gerais"]["total_horas_estudadas"] == 5.0
+        assert mensal["estatisticas_gerais"]["materias_diferentes"] == 4
+    
+    def test_dias_consecutivos_e_conquistas(self, armazenamento_temporario):
+        """Testa sequência de dias e conquistas desbloqueadas"""
+        materias = ["Matematica", "Fisica", "Quimica", "Biologia", "Historia"]
+        ingerir_lote([
+            _sessao_em("aluno2", self.HOJE - timedelta(days=i), materias[i], 200)
+            for i in range(5)
+        ])
+        
+        dashboard = gerar_dashboard("aluno2", "mensal", self.HOJE)
+        conquistas = {c["nome"]: c["desbloqueado"] for c in dashboard["conquistas"]}
+        
+        assert dashboard["estatisticas_gerais"]["dias_consecutivos"] == 5
+        assert conquistas == {
+            "Estudante Dedicado": True, "Maratonista": True, "Multitask": True, "Constância": False
+        }
+    
+    def test_registro_atualiza_dashboard(self, armazenamento_temporario):
+        """Testa que o dashboard reflete sessões recém-registradas"""
+        antes = gerar_dashboard("aluno3", "diario")["estatisticas_gerais"]["total_horas_estudadas"]
+        req = func.HttpRequest("POST", "/api/registrar-progresso", body=json.dumps({
+            "usuario_id": "aluno3", "materia": "Portugues", "tempo_minutos": 30
+        }).encode("utf-8"))
+        assert asyncio.run(registrar_progresso(req)).status_code == 200
+        
+        depois = gerar_dashboard("aluno3", "diario")
+        assert depois["estatisticas_gerais"]["total_horas_estudadas"] == antes + 0.5
+        assert depois["distribuicao_materias"] == {"Portugues": 0.5}
+    
+    def test_carga_do_historico_gravado(self, armazenamento_temporario, monkeypatch):
+        """Testa que um worker novo reconstrói os rollups a partir do banco"""
+        ingerir_lote([_sessao_em("aluno4", self.HOJE, "Fisica", 45)])
+        monkeypatch.setattr(function_app, "_rollups", None)
+        monkeypatch.setattr(function_app, "_sessoes_colunares", None)
+        
+        dashboard = gerar_dashboard("aluno4", "diario", self.HOJE)
+        assert dashboard["distribuicao_materias"] == {"Fisica": 0.8}
+
+
+class TestCalendarioAtividade:
+    """Testes para o calendário de atividade em bitmap"""
+    
+    HOJE = date(2025, 3, 12).toordinal()
+    
+    def _calendario(self, deslocamentos):
+        calendario = CalendarioAtividade()
+        for d in deslocamentos:
+            calendario.marcar(self.HOJE - d)
+        return calendario
+    
+    def test_sequencia_atual(self):
+        """Testa sequência terminando hoje, ontem ou interrompida"""
+        assert self._calendario([0, 1, 2, 4]).sequencia_atual(self.HOJE) == 3
+        assert self._calendario([1, 2]).sequencia_atual(self.HOJE) == 2
+        assert self._calendario([2, 3]).sequencia_atual(self.HOJE) == 0
+        assert CalendarioAtividade().sequencia_atual(self.HOJE) == 0
+    
+    def test_marcar_antes_da_origem(self):
+        """Testa que dias anteriores ao primeiro dia conhecido deslocam o bitmap"""
+        calendario = self._calendario([0, 10, 1, 3, 2])
+        assert calendario.origem == self.HOJE - 10
+        assert calendario.ativo(self.HOJE - 10) and not calendario.ativo(self.HOJE - 11)
+        assert calendario.sequencia_atual(self.HOJE) == 4
+    
+    def test_maior_sequencia_e_contagem(self):
+        """Testa maior sequência histórica e contagem de dias em janelas"""
+        calendario = self._calendario([0, 1, 5, 6, 7, 8, 9, 20])
+        assert calendario.maior_sequencia() == 5
+        assert calendario.dias_ativos(self.HOJE - 29, self.HOJE) == 8
+        assert calendario.dias_ativos(self.HOJE - 6, self.HOJE) == 4
+        assert calendario.dias_ativos(self.HOJE - 100, self.HOJE - 50) == 0
+    
+    def test_equivalente_a_conjunto(self):
+        """Testa que o bitmap concorda com a contagem ingênua por conjunto"""
+        import random
+        rng = random.Random(7)
+        dias = {rng.randrange(400) for _ in range(250)}
+        calendario = self._calendario(dias)
+        
+        inicio = 0 if 0 in dias else 1
+        sequencia = 0
+        while inicio + sequencia in dias:
+            sequencia += 1
+        assert calendario.sequencia_atual(self.HOJE) == sequencia
+        assert calendario.dias_ativos(self.HOJE - 99, self.HOJE) == sum(1 for d in dias if d < 100)
+
+
+class TestCacheDashboard:
+    """Testes para o cache de dashboards por usuário"""
+    
+    def _dashboard(self, usuario_id, periodo="diario"):
+        req = func.HttpRequest("POST", "/api/obter-dashboard", body=json.dumps({
+            "usuario_id": usuario_id, "periodo": periodo
+        }).encode("utf-8"))
+        resposta = asyncio.run(obter_dashboard(req))
+        assert resposta.status_code == 200
+        return json.loads(resposta.get_body())
+    
+    def _registrar(self, usuario_id, minutos):
+        req = func.HttpRequest("POST", "/api/registrar-progresso", body=json.dumps({
+            "usuario_id": usuario_id, "materia": "Geografia", "tempo_minutos": minutos
+        }).encode("utf-8"))
+        assert asyncio.run(registrar_progresso(req)).status_code == 200
+    
+    def _treinar_modelo(self):
+        # Um modelo publicado entre as leituras (troca de validade) invalidaria o cache
+        function_app.obter_recomendador()
+        assert function_app.aguardar_recomendador()
+    
+    def test_leituras_repetidas_usam_cache(self, armazenamento_temporario):
+        """Testa que a segunda leitura vem do cache com o mesmo conteúdo"""
+        self._treinar_modelo()
+        primeira = self._dashboard("aluno_cache")
+        segunda = self._dashboard("aluno_cache")
+        cache = function_app._cache_dashboard
+        
+        assert primeira["dashboard"] == segunda["dashboard"]
+        assert segunda["usuario_id"] == "aluno_cache"
+        assert (cache.acertos, cache.falhas) == (1, 1)
+    
+    def test_registro_invalida_apenas_o_usuario(self, armazenamento_temporario):
+        """Testa invalidação precisa ao registrar progresso"""
+        self._treinar_modelo()
+        self._dashboard("aluno_a")
+        self._dashboard("aluno_b")
+        self._registrar("aluno_a", 90)
+        
+        dashboard_a = self._dashboard("aluno_a")["dashboard"]
+        self._dashboard("aluno_b")
+        cache = function_app._cache_dashboard
+        
+        assert dashboard_a["distribuicao_materias"] == {"Geografia": 1.5}
+        assert (cache.acertos, cache.falhas) == (1, 3)
+    
+    def test_geracao_antiga_nao_e_guardada(self):
+        """Testa que um cálculo anterior à invalidação é descartado"""
+        cache = CacheDashboard()
+        geracao = cache.geracao("aluno")
+        cache.invalidar("aluno")
+        cache.guardar("aluno", "diario", 1, geracao, {}, b"{}")
+        
+        assert cache.obter("aluno", "diario", 1) is None
+    
+    def test_tamanho_limitado(self):
+        """Testa descarte LRU acima do tamanho máximo"""
+        cache = CacheDashboard(tamanho=2)
+        for usuario in ["a", "b", "c"]:
+            cache.guardar(usuario, "diario", 1, 0, {}, b"{}")
+        
+        assert cache.obter("a", "diario", 1) is None
+        assert cache.obter("c", "diario", 1) == ({}, b"{}")
+
+
+class TestSessoesColunares:
+    """Testes para o armazenamento em colunas e agregações vetorizadas"""
+    
+    def _colunas(self):
+        colunas = SessoesColunares(capacidade=2)
+        dia = date(2025, 3, 12)
+        colunas.adicionar_lote([
+            _sessao_em("aluno1", dia, "Matematica", 60),
+            _sessao_em("aluno1", dia, "Matematica", 30),
+            _sessao_em("aluno1", dia - timedelta(days=1), "Fisica", 45),
+            _sessao_em("aluno2", dia, "Matematica", 20),
+            _sessao_em("aluno2", dia - timedelta(days=40), "Quimica", 10),
+        ])
+        return colunas
+    
+    def test_codificacao_e_crescimento(self):
+        """Testa dicionário de matérias e crescimento dos arrays"""
+        colunas = self._colunas()
+        
+        assert len(colunas) == 5
+        assert colunas.materias == ["Matematica", "Fisica", "Quimica"]
+        assert colunas.bytes_por_sessao() <= 32
+    
+    def test_agregacoes_por_materia_e_usuario(self):
+        """Testa group-bys com filtro de usuário e período"""
+        colunas = self._colunas()
+        inicio = datetime(2025, 3, 1)
+        
+        assert colunas.minutos_por_materia() == {"Matematica": 110, "Fisica": 45, "Quimica": 10}
+        assert colunas.minutos_por_materia(["aluno2"], inicio=inicio) == {"Matematica": 20}
+        assert colunas.minutos_por_usuario(inicio=inicio) == {"aluno1": 135, "aluno2": 20}
+        assert colunas.minutos_por_usuario(["desconhecido"]) == {}
+    
+    def test_rollup_a_partir_das_colunas(self):
+        """Testa que o rollup construído por group-by bate com as sessões"""
+        rollup = self._colunas().rollup_usuario("aluno1")
+        dia = rollup.agregado("diario", date(2025, 3, 12))
+        
+        assert dia.minutos == 90
+        assert dia.sessoes == 2
+        assert rollup.dias_consecutivos(date(2025, 3, 12)) == 2
+    
+    def test_colunas_somente_leitura(self):
+        """Testa que o instantâneo das colunas não pode ser alterado"""
+        colunas = self._colunas().colunas()
+        with pytest.raises(ValueError):
+            colunas["minutos"][0] = 999
+    
+    def test_carga_sem_travar_a_ingestao(self, armazenamento_temporario, monkeypatch):
+        """Testa que sessões ingeridas durante a primeira carga entram uma única vez"""
+        dia = date(2025, 3, 12)
+        function_app.ingerir_lote([_sessao_em("aluno1", dia, minutos=30), _sessao_em("aluno2", dia, minutos=20)])
+        iterar_original = armazenamento_temporario.iterar_sessoes
+        
+        def iterar_com_ingestao(*args, **kwargs):
+            # Ingestão concorrente no meio da varredura: travaria se os locks estivessem presos
+            thread = threading.Thread(target=function_app.ingerir_lote,
+                                      args=([_sessao_em("aluno1", dia, minutos=45)],))
+            thread.start()
+            thread.join(timeout=5)
+            assert not thread.is_alive()
+            yield from iterar_original(*args, **kwargs)
+        
+        monkeypatch.setattr(armazenamento_temporario, "iterar_sessoes", iterar_com_ingestao)
+        colunas = function_app.obter_sessoes_colunares()
+        
+        assert len(colunas) == 3
+        assert colunas.minutos_por_usuario() == {"aluno1": 75, "aluno2": 20}
+        assert function_app._captura_colunas is None
+    
+    def test_minutos_sem_estouro(self):
+        """Testa que minutos/pontos usam 64 bits e não estouram em somas grandes"""
+        colunas = self._colunas().colunas()
+        
+        assert colunas["minutos"].dtype == np.int64
+        assert colunas["pontos"].dtype == np.int64
+
+
+class TestRankingPontos:
+    """Testes para a skip list indexável e os rankings de pontos"""
+    
+    def test_lista_saltos_equivalente_a_lista_ordenada(self):
+        """Testa inserção, remoção, posição e fatias contra uma lista ordenada"""
+        import bisect
+        import random
+        rng = random.Random(3)
+        referencia = sorted(rng.sample(range(10_000), 300))
+        lista = ListaSaltosIndexada(referencia, semente=1)
+        for _ in range(2000):
+            if referencia and rng.random() < 0.4:
+                lista.remover(referencia.pop(rng.randrange(len(referencia))))
+            else:
+                chave = rng.randrange(10_000, 20_000) * 2
+                if chave not in referencia:
+                    bisect.insort(referencia, chave)
+                    lista.inserir(chave)
+        
+        assert len(lista) == len(referencia)
+        assert lista.fatia(0, len(referencia)) == referencia
+        for indice in range(0, len(referencia), 17):
+            assert lista.posicao(referencia[indice]) == indice
+            assert lista.fatia(indice, 5) == referencia[indice:indice + 5]
+        with pytest.raises(KeyError):
+            lista.remover(1)
+    
+    def test_posicoes_com_empate_e_vizinhos(self):
+        """Testa top-K, empates dividindo a posição e vizinhos do usuário"""
+        placar = PlacarPontos({"ana": 500, "bia": 300, "caio": 300, "davi": 100, "eva": 50}, semente=1)
+        resultado = placar.consultar("davi", k=3, raio=1)
+        
+        assert [(e["posicao"], e["usuario_id"]) for e in resultado["top"]] == [
+            (1, "ana"), (2, "bia"), (2, "caio")
+        ]
+        assert resultado["usuario"]["posicao"] == 4
+        assert [e["usuario_id"] for e in resultado["vizinhos"]] == ["caio", "davi", "eva"]
+        assert resultado["vizinhos"][0]["posicao"] == 2
+        assert resultado["participantes"] == 5
+    
+    def test_atualizacao_e_troca_de_turma(self):
+        """Testa que sessões movem o usuário no ranking e entre turmas"""
+        placar = PlacarPontos(
+            {"ana": 100, "bia": 80}, {"ana": ("3A", "Escola X"), "bia": ("3A", "Escola X")}, semente=1
+        )
+        placar.aplicar([{"usuario_id": "bia", "pontos": 50}])
+        assert placar.consultar("bia", "turma")["usuario"]["posicao"] == 1
+        
+        placar.aplicar([{"usuario_id": "bia", "pontos": 0, "turma": "3B"}])
+        assert placar.consultar("ana", "turma")["participantes"] == 1
+        assert placar.consultar("bia", "turma")["grupo"] == "3B"
+        assert placar.consultar("bia", "escola")["participantes"] == 2
+        
+        placar.aplicar([{"usuario_id": "novo", "pontos": 10}])
+        assert placar.consultar("novo")["usuario"]["posicao"] == 3
+        assert placar.consultar("novo", "turma")["usuario"] is None
+    
+    def test_instantaneo_e_variacao(self, tmp_path):
+        """Testa a gravação do instantâneo e a variação de posição desde ele"""
+        caminho = str(tmp_path / "ranking.json")
+        placar = PlacarPontos({"ana": 100, "bia": 80, "caio": 60}, caminho_instantaneo=caminho, semente=1)
+        assert placar.consultar("caio")["usuario"]["variacao_posicao"] is None
+        
+        placar.salvar_instantaneo()
+        placar.aplicar([{"usuario_id": "caio", "pontos": 100}])
+        assert placar.consultar("caio")["usuario"]["variacao_posicao"] == 2
+        
+        # Um worker novo usa o instantâneo gravado como base
+        recarregado = PlacarPontos({"ana": 100, "bia": 80, "caio": 160}, caminho_instantaneo=caminho)
+        assert recarregado.consultar("bia")["usuario"]["variacao_posicao"] == -1
+    
+    def test_instantaneo_periodico_fora_do_aplicar(self, tmp_path, monkeypatch):
+        """Testa que o instantâneo vencido é gravado numa thread, sem bloquear aplicar"""
+        caminho = tmp_path / "ranking.json"
+        placar = PlacarPontos({"ana": 100}, caminho_instantaneo=str(caminho), intervalo_instantaneo=0)
+        liberar = threading.Event()
+        gravar = placar.salvar_instantaneo
+        
+        def gravar_devagar():
+            liberar.wait(5)
+            gravar()
+        
+        monkeypatch.setattr(placar, "salvar_instantaneo", gravar_devagar)
+        placar.aplicar([{"usuario_id": "bia", "pontos": 50}])
+        placar.aplicar([{"usuario_id": "bia", "pontos": 10}])
+        assert not caminho.exists()
+        
+        liberar.set()
+        for _ in range(100):
+            if caminho.exists():
+                break
+            time.sleep(0.01)
+        assert json.loads(caminho.read_text(encoding="utf-8"))["pontos"] == {"ana": 100, "bia": 60}
+    
+    def test_membros_gravados_e_migracao(self, tmp_path):
+        """Testa turma/escola gravadas nas sessões, inclusive em bancos antigos"""
+        import sqlite3
+        caminho = str(tmp_path / "antigo.db")
+        conexao = sqlite3.connect(caminho)
+        conexao.execute(
+            "CREATE TABLE sessoes (id INTEGER PRIMARY KEY, usuario_id TEXT NOT NULL, materia TEXT NOT NULL, "
+            "tempo_minutos INTEGER NOT NULL, topicos TEXT NOT NULL, pontos INTEGER NOT NULL, "
+            "data_registro TEXT NOT NULL)"
+        )
+        conexao.close()
+        
+        armazenamento = ArmazenamentoProgresso(caminho)
+        armazenamento.registrar_lote([
+            validar_sessao({"usuario_id": "ana", "materia": "Fisica", "tempo_minutos": 10, "turma": "3A"}),
+            validar_sessao({"usuario_id": "ana", "materia": "Fisica", "tempo_minutos": 10, "escola": "X"}),
+            validar_sessao({"usuario_id": "bia", "materia": "Fisica", "tempo_minutos": 10})
+        ])
+        assert armazenamento.listar_membros() == {"ana": ("3A", "X")}
+        armazenamento.fechar()
+        
+        with pytest.raises(ValueError):
+            validar_sessao({"materia": "Fisica", "tempo_minutos": 10, "turma": 3})
+    
+    def test_endpoint_ranking(self, armazenamento_temporario):
+        """Testa o ranking por turma a partir de sessões registradas"""
+        for usuario_id, minutos in [("ana", 30), ("bia", 60), ("caio", 45)]:
+            req = func.HttpRequest("POST", "/api/registrar-progresso", body=json.dumps({
+                "usuario_id": usuario_id, "materia": "Historia", "tempo_minutos": minutos, "turma": "2B"
+            }).encode("utf-8"))
+            assert asyncio.run(registrar_progresso(req)).status_code == 200
+        
+        req = func.HttpRequest("POST", "/api/ranking", body=json.dumps({
+            "usuario_id": "ana", "escopo": "turma", "k": 2
+        }).encode("utf-8"))
+        resposta = asyncio.run(ranking(req))
+        dados = json.loads(resposta.get_body())
+        
+        assert resposta.status_code == 200
+        assert dados["grupo"] == "2B"
+        assert [e["usuario_id"] for e in dados["top"]] == ["bia", "caio"]
+        assert dados["usuario"]["posicao"] == 3
+        assert dados["usuario"]["pontos"] == 60
+        
+        # Sessões seguintes atualizam o ranking já montado
+        req = func.HttpRequest("POST", "/api/registrar-progresso", body=json.dumps({
+            "usuario_id": "ana", "materia": "Historia", "tempo_minutos": 90
+        }).encode("utf-8"))
+        asyncio.run(registrar_progresso(req))
+        assert function_app.obter_placar().consultar("ana", "turma")["usuario"]["posicao"] == 1
+    
+    def test_escopo_invalido(self):
+        """Testa rejeição de escopo desconhecido"""
+        req = func.HttpRequest("POST", "/api/ranking", body=json.dumps({"escopo": "cidade"}).encode("utf-8"))
+        assert asyncio.run(ranking(req)).status_code == 400
+    
+    def test_parametros_nao_numericos(self):
+        """Testa que k e raio não numéricos são rejeitados com 400"""
+        for corpo in ({"k": "dez"}, {"raio": [1]}, {"k": None}):
+            req = func.HttpRequest("POST", "/api/ranking", body=json.dumps(corpo).encode("utf-8"))
+            resposta = asyncio.run(ranking(req))
+            assert resposta.status_code == 400
+            assert json.loads(resposta.get_body())["erro"] == "Parâmetro inválido"
+
+
+class TestAnaliseCoorte:
+    """Testes para a análise agregada de turmas e escolas"""
+    
+    HOJE = date(2025, 3, 12)
+    
+    def _popular(self):
+        sessoes = []
+        for i in range(6):
+            for dias_atras in range(i):
+                sessao = _sessao_em(f"aluno{i}", self.HOJE - timedelta(days=dias_atras + i), "Fisica", 30 * (i + 1))
+                sessao["turma"] = "1A" if i < 4 else "1B"
+                sessoes.append(sessao)
+        ingerir_lote(sessoes)
+    
+    def test_agregados_da_coorte(self, armazenamento_temporario):
+        """Testa horas, percentis e alunos em risco de uma lista de alunos"""
+        self._popular()
+        analise = analisar_coorte([f"aluno{i}" for i in range(6)] + ["sem_sessoes"], "mensal", self.HOJE)
+        
+        assert analise["alunos"] == 7
+        assert analise["alunos_ativos_periodo"] == 5
+        assert analise["horas"]["total"] == 35.0
+        assert analise["distribuicao_horas"]["0h"] == 2
+        assert analise["distribuicao_materias"] == {"Fisica": 35.0}
+        em_risco = {a["usuario_id"]: a["dias_sem_estudo"] for a in analise["alunos_em_risco"]}
+        assert em_risco == {"aluno0": None, "sem_sessoes": None}
+        
+        analise = analisar_coorte(["aluno5"], "mensal", self.HOJE, dias_risco=5)
+        assert analise["alunos_em_risco"] == [{"usuario_id": "aluno5", "dias_sem_estudo": 5}]
+    
+    def test_fragmentos_combinados(self, armazenamento_temporario, monkeypatch):
+        """Testa que agregar em fragmentos (inclusive em processos) dá o mesmo resultado"""
+        self._popular()
+        alunos = [f"aluno{i}" for i in range(6)]
+        inteiro = analisar_coorte(alunos, "mensal", self.HOJE)
+        
+        monkeypatch.setattr(function_app, "COORTE_TAMANHO_FRAGMENTO", 3)
+        assert analisar_coorte(alunos, "mensal", self.HOJE) == inteiro
+        
+        monkeypatch.setattr(function_app, "COORTE_PROCESSOS", 2)
+        monkeypatch.setattr(function_app, "_pool_coortes", None)
+        assert analisar_coorte(alunos, "mensal", self.HOJE) == inteiro
+        function_app._pool_coortes.shutdown()
+    
+    def test_endpoint_por_turma(self, armazenamento_temporario):
+        """Testa a análise de uma turma resolvida pelos membros registrados"""
+        self._popular()
+        req = func.HttpRequest("POST", "/api/analise-coorte", body=json.dumps({
+            "turma": "1B", "periodo": "mensal"
+        }).encode("utf-8"))
+        resposta = asyncio.run(analise_coorte(req))
+        dados = json.loads(resposta.get_body())
+        
+        assert resposta.status_code == 200, dados
+        assert dados["grupo"] == {"turma": "1B"}
+        assert dados["analise"]["alunos"] == 2
+    
+    def test_coorte_invalida(self, armazenamento_temporario):
+        """Testa rejeição de coorte vazia ou desconhecida"""
+        for corpo in ({}, {"usuario_ids": []}, {"turma": "inexistente"}):
+            req = func.HttpRequest("POST", "/api/analise-coorte", body=json.dumps(corpo).encode("utf-8"))
+            assert asyncio.run(analise_coorte(req)).status_code == 400
+    
+    def test_dias_risco_nao_numerico(self, armazenamento_temporario):
+        """Testa que dias_risco não numérico é rejeitado com 400"""
+        req = func.HttpRequest("POST", "/api/analise-coorte", body=json.dumps({
+            "usuario_ids": ["ana"], "dias_risco": "uma semana"
+        }).encode("utf-8"))
+        resposta = asyncio.run(analise_coorte(req))
+        
+        assert resposta.status_code == 400
+        assert "dias_risco" in json.loads(resposta.get_body())["mensagem"]
+
+
+class TestRecomendador:
+    """Testes para as recomendações por similaridade entre matérias"""
+    
+    def _colunas(self):
+        colunas = SessoesColunares()
+        linhas = []
+        # Dois grupos de interesse: exatas e humanas
+        for i in range(20):
+            par = ("Matematica", "Fisica") if i % 2 else ("Historia", "Geografia")
+            linhas += [(f"u{i}", par[0], 60, 0, "2025-03-10T19:00:00"),
+                       (f"u{i}", par[1], 40, 0, "2025-03-11T19:00:00")]
+        linhas += [("so_fisica", "Fisica", 90, 0, "2025-03-10T19:00:00"),
+                   ("so_historia", "Historia", 90, 0, "2025-03-10T19:00:00"),
+                   ("u1", "Biologia", 10, 0, "2025-03-12T19:00:00")]
+        colunas.adicionar_linhas(linhas)
+        return colunas
+    
+    def test_sugere_materia_similar_pouco_estudada(self):
+        """Testa que a sugestão vem do grupo de interesse do usuário"""
+        recomendador = RecomendadorMaterias(vizinhos=2, sugestoes=2)
+        recomendador.treinar(self._colunas())
+        
+        assert recomendador.recomendar("so_fisica")[0]["materia"] == "Matematica"
+        assert recomendador.recomendar("so_historia")[0]["materia"] == "Geografia"
+        assert recomendador.recomendar("desconhecido") == []
+        sugeridas = [r["materia"] for r in recomendador.recomendar("so_fisica")]
+        assert "Fisica" not in sugeridas
+    
+    def test_similaridade_mantem_k_vizinhos(self):
+        """Testa a poda top-k (argpartition) da similaridade entre matérias"""
+        recomendador = RecomendadorMaterias(vizinhos=1)
+        recomendador.treinar(self._colunas())
+        similaridade = recomendador.similaridade
+        
+        assert (np.count_nonzero(similaridade, axis=0) <= 1).all()
+        fisica = recomendador.materias.index("Fisica")
+        assert recomendador.materias[int(similaridade[:, fisica].argmax())] == "Matematica"
+    
+    def test_resumos_relacionados(self):
+        """Testa tópicos de resumo ligados à matéria sugerida"""
+        recomendador = RecomendadorMaterias()
+        recomendador.treinar(self._colunas())
+        sugestao = next(r for r in recomendador.recomendar("u3") if r["materia"] == "Biologia")
+        assert sugestao["resumos"] == ["fotossintese"]
+        assert "biologia" in sugestao["busca"]
+    
+    def test_dashboard_com_recomendacoes(self, armazenamento_temporario):
+        """Testa que o dashboard inclui as recomendações do usuário"""
+        hoje = date(2025, 3, 12)
+        ingerir_lote(
+            [_sessao_em(f"a{i}", hoje, m, 60) for i in range(5) for m in ("Quimica", "Biologia")]
+            + [_sessao_em("novato", hoje, "Quimica", 60)]
+        )
+        # O primeiro uso só dispara o treino em segundo plano
+        assert gerar_dashboard("novato", "diario", hoje)["recomendacoes_personalizadas"] == []
+        assert function_app.aguardar_recomendador()
+        dashboard = gerar_dashboard("novato", "diario", hoje)
+        
+        assert dashboard["recomendacoes_personalizadas"][0]["materia"] == "Biologia"
+        assert any("Biologia" in r for r in dashboard["recomendacoes"])
+    
+    def test_dashboard_em_cache_acompanha_o_modelo(self, armazenamento_temporario):
+        """Testa que o dashboard em cache é refeito quando um modelo novo é publicado"""
+        hoje = date.today()
+        ingerir_lote(
+            [_sessao_em(f"a{i}", hoje, m, 60) for i in range(5) for m in ("Quimica", "Biologia")]
+            + [_sessao_em("novato", hoje, "Quimica", 60)]
+        )
+        
+        def consultar():
+            req = func.HttpRequest("POST", "/api/obter-dashboard", body=json.dumps({
+                "usuario_id": "novato", "periodo": "diario"
+            }).encode("utf-8"))
+            return json.loads(asyncio.run(obter_dashboard(req)).get_body())["dashboard"]
+        
+        assert consultar()["recomendacoes_personalizadas"] == []
+        assert function_app.aguardar_recomendador()
+        assert consultar()["recomendacoes_personalizadas"][0]["materia"] == "Biologia"
+    
+    def test_vocabulario_limitado(self):
+        """Testa que grafias se juntam e matérias raras vão para "outros" sem ser sugeridas"""
+        colunas = self._colunas()
+        colunas.adicionar_linhas(
+            [("u0", " história ", 30, 0, "2025-03-12T19:00:00")]
+            + [(f"u{i}", f"assunto livre {i}", 5, 0, "2025-03-12T19:00:00") for i in range(500)]
+        )
+        engajamento, materias = RecomendadorMaterias.matriz_engajamento(colunas, max_materias=5)
+        
+        assert engajamento.shape == (len(colunas.usuarios), 6)
+        assert sorted(materias) == ["Biologia", "Fisica", "Geografia", "Historia", "Matematica"]
+        recomendador = RecomendadorMaterias(max_materias=5)
+        recomendador.treinar(colunas)
+        assert all(r["materia"] in materias for u in colunas.usuarios for r in recomendador.recomendar(u))
+
+
+class TestRevisaoEspacada:
+    """Testes para a agenda de revisão espaçada (SM-2)"""
+    
+    AGORA = 1_741_800_000.0
+    DIA = 86400
+    
+    def test_intervalos_sm2(self):
+        """Testa a progressão 1, 6, 15 dias e o reinício após esquecer"""
+        cartao = CartaoRevisao("matematica/funcoes")
+        intervalos = []
+        for _ in range(3):
+            cartao.responder(4, self.AGORA)
+            intervalos.append(cartao.intervalo)
+        assert intervalos == [1.0, 6.0, 15.0]
+        assert cartao.vencimento == self.AGORA + 15 * self.DIA
+        
+        cartao.responder(1, self.AGORA)
+        assert (cartao.repeticoes, cartao.intervalo) == (0, 1.0)
+        assert cartao.facilidade < 2.5
+    
+    def test_item_respondido_duas_vezes_no_lote(self):
+        """Testa que duas entradas iguais no heap não repetem o cartão nos vencidos"""
+        baralho = BaralhoRevisao()
+        baralho.responder("x", 1, self.AGORA)
+        baralho.responder("x", 1, self.AGORA)
+        baralho.reagendar(CartaoRevisao("y", vencimento=self.AGORA))
+        
+        assert [c.item for c in baralho.vencidos(self.AGORA + 2 * self.DIA, 10)] == ["y", "x"]
+        assert [c.item for c in baralho.vencidos(self.AGORA + 2 * self.DIA, 10)] == ["y", "x"]
+    
+    def test_heap_de_vencimentos(self):
+        """Testa vencidos em ordem de atraso e descarte de entradas obsoletas"""
+        baralho = BaralhoRevisao()
+        for i, atraso in enumerate([3, 1, 2]):
+            baralho.reagendar(CartaoRevisao(f"item{i}", vencimento=self.AGORA - atraso * self.DIA))
+        
+        assert [c.item for c in baralho.vencidos(self.AGORA, 10)] == ["item0", "item2", "item1"]
+        assert len(baralho.vencidos(self.AGORA, 2)) == 2
+        
+        # Responder reagenda para o futuro: a entrada antiga fica obsoleta
+        baralho.responder("item0", 5, self.AGORA)
+        assert [c.item for c in baralho.vencidos(self.AGORA, 10)] == ["item2", "item1"]
+        assert baralho.proximo_vencimento() == self.AGORA - 2 * self.DIA
+    
+    def test_persistencia(self, tmp_path):
+        """Testa que cartões respondidos sobrevivem a um novo worker"""
+        armazenamento = ArmazenamentoProgresso(str(tmp_path / "revisoes.db"))
+        revisoes = RevisoesEspacadas(armazenamento)
+        revisoes.responder("ana", [("fisica/cinematica", 5)], self.AGORA)
+        assert revisoes.aguardar()
+        
+        baralho = RevisoesEspacadas(armazenamento).baralho("ana")
+        assert baralho.cartoes["fisica/cinematica"].vencimento == self.AGORA + self.DIA
+        armazenamento.fechar()
+    
+    def test_gravacao_em_segundo_plano(self):
+        """Testa que responder não espera o banco e que o LRU recarrega as pendências"""
+        liberar = threading.Event()
+        
+        class ArmazenamentoLento:
+            def __init__(self):
+                self.linhas = []
+            def listar_revisoes(self, usuario_id):
+                return [linha[1:] for linha in self.linhas if linha[0] == usuario_id]
+            def gravar_linhas_revisao(self, linhas):
+                liberar.wait(5)
+                self.linhas.extend(linhas)
+        
+        armazenamento = ArmazenamentoLento()
+        revisoes = RevisoesEspacadas(armazenamento, max_baralhos=1)
+        inicio = time.perf_counter()
+        revisoes.responder("ana", [("fisica/optica", 5)], self.AGORA)
+        assert time.perf_counter() - inicio < 1
+        
+        revisoes.baralho("bia")  # tira "ana" do LRU com o cartão ainda não gravado
+        assert revisoes.baralho("ana").cartoes["fisica/optica"].repeticoes == 1
+        
+        liberar.set()
+        assert revisoes.aguardar()
+        assert [linha[:3] for linha in armazenamento.linhas] == [("ana", "fisica/optica", 1)]
+        revisoes.drenar()
+    
+    def test_carga_fria_nao_trava_outros_usuarios(self):
+        """Testa que ler um baralho do banco não bloqueia os demais usuários nem o escritor"""
+        lendo, liberar = threading.Event(), threading.Event()
+        agora = self.AGORA
+        
+        class ArmazenamentoLeituraLenta:
+            def __init__(self):
+                self.linhas = [("ana", "fisica/optica", 2, 6.0, 2.5, agora)]
+            def listar_revisoes(self, usuario_id):
+                if usuario_id == "ana":
+                    lendo.set()
+                    liberar.wait(5)
+                return [linha[1:] for linha in self.linhas if linha[0] == usuario_id]
+            def gravar_linhas_revisao(self, linhas):
+                self.linhas.extend(linhas)
+        
+        armazenamento = ArmazenamentoLeituraLenta()
+        revisoes = RevisoesEspacadas(armazenamento)
+        carga = threading.Thread(target=revisoes.baralho, args=("ana",))
+        carga.start()
+        assert lendo.wait(5)
+        
+        # Durante a leitura de "ana": outro usuário responde e a resposta é gravada
+        revisoes.responder("bia", [("historia/brasil", 4)], self.AGORA)
+        assert revisoes.aguardar()
+        assert ("bia", "historia/brasil") in [linha[:2] for linha in armazenamento.linhas]
+        
+        liberar.set()
+        carga.join(5)
+        assert revisoes.baralho("ana").cartoes["fisica/optica"].repeticoes == 2
+        revisoes.drenar()
+    
+    def test_falha_na_agenda_nao_falha_o_registro(self, armazenamento_temporario, monkeypatch):
+        """Testa que a sessão já enfileirada responde 200 mesmo se a agenda falhar"""
+        def agenda_quebrada():
+            raise RuntimeError("banco indisponível")
+        monkeypatch.setattr(function_app, "obter_revisoes", agenda_quebrada)
+        
+        req = func.HttpRequest("POST", "/api/registrar-progresso", body=json.dumps({
+            "usuario_id": "caio", "materia": "Fisica", "tempo_minutos": 30, "topicos_estudados": ["Óptica"]
+        }).encode("utf-8"))
+        resposta = asyncio.run(registrar_progresso(req))
+        
+        assert resposta.status_code == 200
+        assert json.loads(resposta.get_body())["estatisticas"]["revisoes_agendadas"] == 0
+    
+    def test_limite_nao_numerico(self, armazenamento_temporario):
+        """Testa que limite não numérico é rejeitado com 400"""
+        req = func.HttpRequest("POST", "/api/revisoes-pendentes", body=json.dumps({
+            "usuario_id": "ana", "limite": "todos"
+        }).encode("utf-8"))
+        resposta = asyncio.run(revisoes_pendentes(req))
+        
+        assert resposta.status_code == 400
+        assert "limite" in json.loads(resposta.get_body())["mensagem"]
+    
+    def test_progresso_e_endpoints(self, armazenamento_temporario):
+        """Testa tópicos registrados entrando na agenda e respostas de simulado"""
+        req = func.HttpRequest("POST", "/api/registrar-progresso", body=json.dumps({
+            "usuario_id": "bia", "materia": "Matemática", "tempo_minutos": 30,
+            "topicos_estudados": ["Funções", "Equações"]
+        }).encode("utf-8"))
+        dados = json.loads(asyncio.run(registrar_progresso(req)).get_body())
+        assert dados["estatisticas"]["revisoes_agendadas"] == 2
+        
+        req = func.HttpRequest("POST", "/api/revisoes-pendentes",
+                               body=json.dumps({"usuario_id": "bia"}).encode("utf-8"))
+        agenda = json.loads(asyncio.run(revisoes_pendentes(req)).get_body())
+        assert agenda["pendentes"] == []
+        assert agenda["total_itens"] == 2
+        
+        req = func.HttpRequest("POST", "/api/responder-revisao", body=json.dumps({
+            "usuario_id": "bia",
+            "respostas": [{"item": "matematica/funcoes", "acertou": False},
+                          {"item": "simulado/fisica/2", "nota": 5}]
+        }).encode("utf-8"))
+        dados = json.loads(asyncio.run(responder_revisao(req)).get_body())
+        assert [c["intervalo_dias"] for c in dados["reagendados"]] == [1.0, 1.0]
+        assert function_app.obter_revisoes().baralho("bia").cartoes["matematica/funcoes"].repeticoes == 0
+    
+    def test_resposta_invalida(self, armazenamento_temporario):
+        """Testa rejeição de nota fora da escala"""
+        for corpo in ({"item": "x", "nota": 7}, {"item": "x"}, {"nota": 3}, {"respostas": []}):
+            req = func.HttpRequest("POST", "/api/responder-revisao", body=json.dumps(corpo).encode("utf-8"))
+            assert asyncio.run(responder_revisao(req)).status_code == 400
+
+
+class TestArmazenamentoFragmentado:
+    """Testes para o armazenamento particionado por usuário"""
+    
+    def _sessoes(self, quantidade=40):
+        return [
+            validar_sessao({"usuario_id": f"aluno{i % 10}", "materia": "Fisica", "tempo_minutos": 10 + i,
+                            "turma": f"T{i % 3}"})
+            for i in range(quantidade)
+        ]
+    
+    def test_roteamento_estavel(self, tmp_path):
+        """Testa que cada usuário fica inteiro em um único shard"""
+        armazenamento = ArmazenamentoFragmentado(str(tmp_path / "p.db"), 3)
+        armazenamento.registrar_lote(self._sessoes())
+        
+        assert indice_shard("aluno1", 3) == indice_shard("aluno1", 3)
+        for i in range(10):
+            usuario_id = f"aluno{i}"
+            esperado = armazenamento.shards[indice_shard(usuario_id, 3)]
+            assert len(esperado.listar_sessoes(usuario_id)) == 4
+            assert sum(len(s.listar_sessoes(usuario_id)) for s in armazenamento.shards) == 4
+        
+        assert armazenamento.contar_sessoes() == 40
+        assert len(list(armazenamento.iterar_sessoes())) == 40
+        assert len(armazenamento.listar_membros()) == 10
+        armazenamento.fechar()
+    
+    def test_um_shard_usa_o_caminho_original(self, tmp_path):
+        """Testa compatibilidade do layout com um único arquivo"""
+        base = str(tmp_path / "p.db")
+        assert caminhos_shards(base, 1) == [base]
+        assert caminhos_shards(base, 2) == [str(tmp_path / "p.0.db"), str(tmp_path / "p.1.db")]
+    
+    def test_rebalanceamento(self, tmp_path):
+        """Testa a redistribuição de 1 para 3 e de 3 para 2 shards sem perder dados"""
+        base = str(tmp_path / "p.db")
+        original = ArmazenamentoFragmentado(base, 1)
+        original.registrar_lote(self._sessoes())
+        original.gravar_revisoes("aluno3", [CartaoRevisao("fisica/optica", 1, 1.0, 2.5, 100.0)])
+        antes = original.listar_sessoes("aluno3")
+        original.fechar()
+        
+        assert rebalancear_shards(base, 1, 3)["sessoes"] == 40
+        assert rebalancear_shards(base, 3, 2) == {
+            "sessoes": 40, "revisoes": 1, "shards_origem": 3, "shards_destino": 2
+        }
+        
+        novo = ArmazenamentoFragmentado(base, 2)
+        assert novo.contar_sessoes() == 40
+        assert novo.listar_sessoes("aluno3") == antes
+        assert novo.listar_revisoes("aluno3") == [("fisica/optica", 1, 1.0, 2.5, 100.0)]
+        assert novo.listar_membros()["aluno3"] == ("T0", None)
+        novo.fechar()
+    
+    def test_rebalanceamento_preserva_backups_anteriores(self, tmp_path):
+        """Testa que execuções seguidas guardam backups distintos do mesmo arquivo"""
+        base = str(tmp_path / "p.db")
+        original = ArmazenamentoFragmentado(base, 1)
+        original.registrar_lote(self._sessoes())
+        original.fechar()
+        
+        rebalancear_shards(base, 1, 2)
+        rebalancear_shards(base, 2, 1)
+        rebalancear_shards(base, 1, 2)
+        
+        backups = sorted(tmp_path.glob("p.db.*.bak"))
+        assert len(backups) == 2
+        for backup in backups:
+            antigo = ArmazenamentoProgresso(str(backup))
+            assert antigo.contar_sessoes() == 40
+            antigo.fechar()
+    
+    def test_dashboard_sobre_shards(self, armazenamento_temporario, tmp_path, monkeypatch):
+        """Testa o fluxo de registro e dashboard com o armazenamento particionado"""
+        monkeypatch.setattr(function_app, "_armazenamento", ArmazenamentoFragmentado(str(tmp_path / "s.db"), 4))
+        hoje = date(2025, 3, 12)
+        ingerir_lote([_sessao_em(f"aluno{i}", hoje, "Quimica", 30) for i in range(8)])
+        monkeypatch.setattr(function_app, "_rollups", None)
+        monkeypatch.setattr(function_app, "_sessoes_colunares", None)
+        
+        assert gerar_dashboard("aluno5", "diario", hoje)["distribuicao_materias"] == {"Quimica": 0.5}
+        function_app._armazenamento.fechar()
+
+
+class TestRespostasJson:
+    """Testes para a serialização compartilhada das respostas"""
+    
+    def _payloads(self):
+        req = func.HttpRequest("POST", "/api/gerar-cronograma", body=json.dumps({
+            "materias": ["Matemática", "Física"], "horas_disponiveis": 3, "dias_ate_prova": 10
+        }).encode("utf-8"))
+        return [
+            json.loads(asyncio.run(gerar_cronograma(req)).get_body()),
+            gerar_dashboard_demo("ana", "mensal"),
+            criar_resumo("fotossíntese", "biologia", "detalhado"),
+            congelar({"ação": [1, 2.5, None, True], 7: "chave numérica"}),
+        ]
+    
+    def test_compacto_e_utf8(self):
+        """Testa separadores compactos e acentos sem escape"""
+        assert serializar_json({"matéria": "Física", "x": [1, 2]}) == \
+            '{"matéria":"Física","x":[1,2]}'.encode("utf-8")
+    
+    def test_mesma_saida_sem_orjson(self, monkeypatch):
+        """Testa que a saída não muda quando o orjson não está instalado"""
+        if function_app.orjson is None:
+            pytest.skip("orjson não instalado")
+        payloads = self._payloads()
+        com_orjson = [serializar_json(dados) for dados in payloads]
+        monkeypatch.setattr(function_app, "orjson", None)
+        assert [serializar_json(dados) for dados in payloads] == com_orjson
+    
+    def test_floats_especiais_iguais_nos_dois_caminhos(self, monkeypatch):
+        """Testa NaN/Infinity como null e expoentes no formato do orjson, byte a byte"""
+        dados = {
+            "a": 1e16, "b": float("nan"), "c": [float("inf"), -float("inf"), 1e-7, 1.5e-5, -9.99e-5],
+            "d": 1e300, "e": 0.0001, "texto": 'fica "1e+16" e 1e-05', 2: 1.2345678901234568e+20
+        }
+        esperado = (b'{"a":1e16,"b":null,"c":[null,null,1e-7,0.000015,-0.0000999],"d":1e300,'
+                    b'"e":0.0001,"texto":"fica \\"1e+16\\" e 1e-05","2":1.2345678901234568e20}')
+        if function_app.orjson is not None:
+            assert serializar_json(dados) == esperado
+        monkeypatch.setattr(function_app, "orjson", None)
+        assert serializar_json(dados) == esperado
+    
+    def test_tipo_nao_suportado_cai_no_json_padrao(self):
+        """Testa o fallback para inteiros além de 64 bits"""
+        assert serializar_json({"n": 2 ** 70}) == b'{"n":1180591620717411303424}'
+    
+    def test_corpo_erro_em_cache(self):
+        """Testa que o corpo de erro é serializado uma única vez"""
+        corpo = corpo_erro("JSON inválido", "O corpo da requisição deve ser um JSON válido")
+        assert corpo is corpo_erro("JSON inválido", "O corpo da requisição deve ser um JSON válido")
+        assert json.loads(corpo) == {
+            "erro": "JSON inválido", "mensagem": "O corpo da requisição deve ser um JSON válido"
+        }
+        assert corpo_erro("Falha") == '{"erro":"Falha"}'.encode("utf-8")
+    
+    def test_resposta_erro(self):
+        """Testa status, cabeçalhos e mimetype da resposta de erro"""
+        resposta = resposta_erro("Serviço ocupado", "Tente novamente", status_code=503,
+                                 headers={"Retry-After": "1"})
+        assert resposta.status_code == 503
+        assert resposta.mimetype == "application/json"
+        assert resposta.headers["Retry-After"] == "1"
+        assert json.loads(resposta.get_body())["erro"] == "Serviço ocupado"
+    
+    def test_handler_invalido_usa_corpo_compartilhado(self):
+        """Testa que os handlers devolvem o mesmo corpo de erro em cache"""
+        req = func.HttpRequest("POST", "/api/gerar-cronograma", body=b"{nao e json")
+        resposta = asyncio.run(gerar_cronograma(req))
+        assert resposta.status_code == 400
+        assert resposta.get_body() == corpo_erro("JSON inválido", "O corpo da requisição deve ser um JSON válido")
+
+
+class TestCompressaoRespostas:
+    """Testes para a negociação de Accept-Encoding e a compressão"""
+    
+    def _requisicao(self, rota, corpo, codificacoes=None):
+        headers = {"Accept-Encoding": codificacoes} if codificacoes else {}
+        return func.HttpRequest("POST", f"/api/{rota}", body=json.dumps(corpo).encode("utf-8"),
+                                headers=headers)
+    
+    def test_negociacao(self):
+        """Testa pesos q, curinga e preferência do servidor"""
+        def negociar(valor, disponiveis=("br", "gzip")):
+            return negociar_codificacao(self._requisicao("x", {}, valor), disponiveis)
+        
+        assert negociar(None) is None
+        assert negociar("gzip, deflate") == "gzip"
+        assert negociar("gzip, br") == "br"
+        assert negociar("br;q=0.5, gzip") == "gzip"
+        assert negociar("gzip;q=0, identity") is None
+        assert negociar("*") == "br"
+        assert negociar("*;q=0.1, gzip;q=0") == "br"
+        assert negociar("br", ("gzip",)) is None
+    
+    def test_simulado_comprimido(self):
+        """Testa que um simulado grande sai em gzip e descomprime igual"""
+        corpo = {"materia": "fisica", "num_questoes": 20}
+        resposta = asyncio.run(gerar_simulado(self._requisicao("gerar-simulado", corpo, "gzip")))
+        
+        assert resposta.headers["Content-Encoding"] == "gzip"
+        assert resposta.headers["Vary"] == "Accept-Encoding"
+        dados = json.loads(gzip.decompress(resposta.get_body()))
+        assert len(dados["questoes"]) == 20
+        
+        sem_compressao = asyncio.run(gerar_simulado(self._requisicao("gerar-simulado", corpo)))
+        assert "Content-Encoding" not in sem_compressao.headers
+        assert len(resposta.get_body()) < len(sem_compressao.get_body()) / 2
+    
+    def test_limite_de_tamanho(self, monkeypatch):
+        """Testa que corpos abaixo do limite não são comprimidos"""
+        monkeypatch.setattr(function_app, "COMPRESSAO_MIN_BYTES", 10 ** 6)
+        resposta = asyncio.run(gerar_simulado(self._requisicao("gerar-simulado", {"materia": "fisica"}, "gzip")))
+        assert "Content-Encoding" not in resposta.headers
+        assert resposta.headers["Vary"] == "Accept-Encoding"
+        json.loads(resposta.get_body())
+    
+    def test_gzip_em_partes(self):
+        """Testa que prefixo e sufixo comprimidos separadamente formam um gzip válido"""
+        prefixo = b'{"dados":"' + b"abc" * 2000
+        assert gzip.decompress(gzip_concluir(gzip_prefixo(prefixo), b'"}')) == prefixo + b'"}'
+        assert gzip.decompress(gzip_concluir(gzip_prefixo(b""), b"")) == b""
+    
+    def test_dashboard_reaproveita_prefixo(self, armazenamento_temporario, monkeypatch):
+        """Testa o envelope do dashboard em gzip com o prefixo em cache"""
+        monkeypatch.setattr(function_app, "COMPRESSAO_MIN_BYTES", 64)
+        corpo = {"usuario_id": "ana", "periodo": "semanal"}
+        
+        primeira = asyncio.run(obter_dashboard(self._requisicao("obter-dashboard", corpo, "gzip, br")))
+        segunda = asyncio.run(obter_dashboard(self._requisicao("obter-dashboard", corpo, "gzip")))
+        simples = asyncio.run(obter_dashboard(self._requisicao("obter-dashboard", corpo)))
+        
+        assert primeira.headers["Content-Encoding"] == "gzip"
+        dados = json.loads(gzip.decompress(segunda.get_body()))
+        esperado = json.loads(simples.get_body())
+        dados.pop("tempo_resposta_ms")
+        esperado.pop("tempo_resposta_ms")
+        assert dados == esperado
+        
+        entrada = function_app._cache_dashboard._entradas[("ana", "semanal")]
+        assert "gzip" in entrada[3]
+        assert segunda.get_body().startswith(entrada[3]["gzip"][0])
+
+
+class TestRequisicoesCondicionais:
+    """Testes para ETag / If-None-Match nos endpoints determinísticos"""
+    
+    @pytest.fixture(autouse=True)
+    def validadores(self, monkeypatch):
+        monkeypatch.setattr(function_app, "_validadores_etag", ValidadoresEtag())
+    
+    def _requisicao(self, rota, corpo, etag=None):
+        headers = {"If-None-Match": etag} if etag else {}
+        return func.HttpRequest("POST", f"/api/{rota}", body=json.dumps(corpo).encode("utf-8"),
+                                headers=headers)
+    
+    def test_etag_ignora_campos_volateis(self):
+        """Testa que timestamp e tempo de resposta não mudam o ETag"""
+        a = calcular_etag({"x": 1, "timestamp": "2025-01-01T10:00", "tempo_resposta_ms": 1.5})
+        b = calcular_etag({"x": 1, "timestamp": "2025-06-01T12:00", "tempo_resposta_ms": 9.0})
+        assert a == b
+        assert a.startswith('W/"')
+        assert calcular_etag({"x": 2}) != a
+    
+    def test_cronograma_304_sem_gerar(self, monkeypatch):
+        """Testa o 304 antes de gerar o cronograma quando o ETag é conhecido"""
+        corpo = {"materias": ["Matemática", "Física"], "dias_semana": 5, "horas_dia": 4}
+        primeira = asyncio.run(gerar_cronograma(self._requisicao("gerar-cronograma", corpo)))
+        etag = primeira.headers["ETag"]
+        assert primeira.status_code == 200
+        
+        def falhar(*args, **kwargs):
+            raise AssertionError("cronograma não deveria ser gerado")
+        monkeypatch.setattr(function_app, "criar_cronograma", falhar)
+        
+        resposta = asyncio.run(gerar_cronograma(self._requisicao("gerar-cronograma", corpo, etag)))
+        assert resposta.status_code == 304
+        assert resposta.headers["ETag"] == etag
+        assert not resposta.get_body()
+    
+    def test_cronograma_mudou(self):
+        """Testa que outra entrada ou ETag antigo recebe o conteúdo completo"""
+        corpo = {"materias": ["Química"], "horas_dia": 2}
+        etag = asyncio.run(gerar_cronograma(self._requisicao("gerar-cronograma", corpo))).headers["ETag"]
+        
+        resposta = asyncio.run(gerar_cronograma(self._requisicao("gerar-cronograma", {**corpo, "horas_dia": 3}, etag)))
+        assert resposta.status_code == 200
+        assert resposta.headers["ETag"] != etag
+        assert json.loads(resposta.get_body())["resumo"]["horas_por_dia"] == 3
+    
+    def test_cache_frio_compara_depois_de_gerar(self, monkeypatch):
+        """Testa o 304 mesmo sem a chave em cache (ex.: outra instância)"""
+        corpo = {"topico": "fotossíntese", "materia": "biologia"}
+        etag = asyncio.run(gerar_resumo(self._requisicao("gerar-resumo", corpo))).headers["ETag"]
+        
+        monkeypatch.setattr(function_app, "_validadores_etag", ValidadoresEtag())
+        resposta = asyncio.run(gerar_resumo(self._requisicao("gerar-resumo", corpo, f'"outro", {etag}')))
+        assert resposta.status_code == 304
+    
+    def test_simulado_com_semente(self):
+        """Testa simulados reprodutíveis com semente e ETag"""
+        corpo = {"materia": "matematica", "num_questoes": 8, "semente": 42}
+        a = asyncio.run(gerar_simulado(self._requisicao("gerar-simulado", corpo)))
+        b = asyncio.run(gerar_simulado(self._requisicao("gerar-simulado", corpo)))
+        dados_a, dados_b = json.loads(a.get_body()), json.loads(b.get_body())
+        
+        assert dados_a["questoes"] == dados_b["questoes"]
+        assert dados_a["semente"] == 42
+        assert a.headers["ETag"] == b.headers["ETag"]
+        assert asyncio.run(gerar_simulado(self._requisicao("gerar-simulado", corpo, a.headers["ETag"]))).status_code == 304
+        
+        sem_semente = asyncio.run(gerar_simulado(self._requisicao("gerar-simulado", {"materia": "matematica"})))
+        assert "ETag" not in sem_semente.headers
+    
+    def test_semente_invalida(self):
+        """Testa a validação da semente"""
+        resposta = asyncio.run(gerar_simulado(self._requisicao("gerar-simulado", {"materia": "fisica", "semente": "abc"})))
+        assert resposta.status_code == 400
+        assert json.loads(resposta.get_body())["erro"] == "Semente inválida"
+
+
+class TestProjecaoCampos:
+    """Testes para o parâmetro 'fields' (projeção de campos)"""
+    
+    def _requisicao(self, rota, corpo):
+        return func.HttpRequest("POST", f"/api/{rota}", body=json.dumps(corpo).encode("utf-8"))
+    
+    def test_compilacao(self):
+        """Testa a árvore compilada, caminhos redundantes e o cache da compilação"""
+        arvore = compilar_projecao("resumo.pontos_principais, topico,resumo.conceito")
+        assert arvore == {"resumo": {"pontos_principais": None, "conceito": None}, "topico": None}
+        assert compilar_projecao("a.b,a,a.c") == {"a": None}
+        assert compilar_projecao("resumo.pontos_principais, topico,resumo.conceito") is arvore
+        assert compilar_projecao(" , ") is None
+        with pytest.raises(ValueError):
+            compilar_projecao("a..b")
+    
+    def test_projetar_e_campo_solicitado(self):
+        """Testa a projeção em dicts aninhados e listas"""
+        arvore = compilar_projecao("itens.nome,total")
+        dados = {"itens": [{"nome": "a", "x": 1}, {"nome": "b", "x": 2}], "total": 2, "extra": True}
+        assert projetar(dados, arvore) == {"itens": [{"nome": "a"}, {"nome": "b"}], "total": 2}
+        assert projetar(dados, None) is dados
+        assert campo_solicitado(arvore, "itens", "nome")
+        assert not campo_solicitado(arvore, "itens", "x")
+        assert campo_solicitado(None, "qualquer", "coisa")
+    
+    def test_resumo_so_pontos_principais(self):
+        """Testa a projeção de /gerar-resumo"""
+        resposta = asyncio.run(gerar_resumo(self._requisicao("gerar-resumo", {
+            "topico": "fotossíntese", "materia": "biologia", "fields": "resumo.pontos_principais"
+        })))
+        dados = json.loads(resposta.get_body())
+        assert list(dados) == ["resumo"]
+        assert list(dados["resumo"]) == ["pontos_principais"]
+        assert dados["resumo"]["pontos_principais"]
+    
+    def test_cronograma_sem_dicas(self, monkeypatch):
+        """Testa que as dicas não são geradas quando não pedidas"""
+        def falhar(*args, **kwargs):
+            raise AssertionError("dica não deveria ser gerada")
+        monkeypatch.setattr(function_app, "gerar_dica_estudo", falhar)
+        
+        resposta = asyncio.run(gerar_cronograma(self._requisicao("gerar-cronograma", {
+            "materias": ["Matemática", "Física"], "fields": ["cronograma.dia", "cronograma.sessoes.materia"]
+        })))
+        dados = json.loads(resposta.get_body())
+        assert resposta.status_code == 200
+        assert dados["cronograma"][0] == {"dia": "Segunda", "sessoes": [{"materia": "Matemática"}, {"materia": "Física"}]}
+    
+    def test_dashboard_so_estatisticas(self, armazenamento_temporario, monkeypatch):
+        """Testa que conquistas e recomendações não são calculadas sem pedido"""
+        def falhar():
+            raise AssertionError("recomendador não deveria ser consultado")
+        monkeypatch.setattr(function_app, "obter_recomendador", falhar)
+        
+        resposta = asyncio.run(obter_dashboard(self._requisicao("obter-dashboard", {
+            "usuario_id": "ana", "fields": "dashboard.estatisticas_gerais.total_horas_estudadas"
+        })))
+        dados = json.loads(resposta.get_body())
+        assert dados == {"dashboard": {"estatisticas_gerais": {"total_horas_estudadas": 0.0}}}
+        assert function_app._cache_dashboard.obter(
+            "ana", "semanal", function_app.validade_dashboard(date.today())
+        ) is None
+    
+    def test_fields_invalido(self, armazenamento_temporario):
+        """Testa o erro 400 para 'fields' malformado"""
+        resposta = asyncio.run(ranking(self._requisicao("ranking", {"fields": 42})))
+        assert resposta.status_code == 400
+        assert json.loads(resposta.get_body())["erro"] == "Campo 'fields' inválido"
+    
+    def test_fields_na_query(self, armazenamento_temporario):
+        """Testa 'fields' como parâmetro de query (importação NDJSON)"""
+        req = func.HttpRequest("POST", "/api/importar-progresso", body=b'{"materia": "Fisica", "tempo_minutos": 30}',
+                               params={"fields": "importadas,rejeitadas"})
+        assert json.loads(asyncio.run(importar_progresso(req)).get_body()) == {"importadas": 1, "rejeitadas": 0}
+
+
+class TestLoteOperacoes:
+    """Testes para o endpoint /batch"""
+    
+    def _lote(self, operacoes, **extra):
+        req = func.HttpRequest("POST", "/api/batch", body=json.dumps({"operacoes": operacoes, **extra}).encode("utf-8"))
+        return asyncio.run(executar_lote(req))
+    
+    def test_varias_rotas(self, armazenamento_temporario):
+        """Testa cronograma, resumo e simulado em uma chamada, na ordem do pedido"""
+        resposta = self._lote([
+            {"rota": "gerar-cronograma", "corpo": {"materias": ["Física"]}},
+            {"id": "resumo", "rota": "/api/gerar-resumo", "corpo": {"topico": "fotossíntese"}},
+            {"rota": "gerar-simulado", "corpo": {"materia": "fisica", "num_questoes": 3}}
+        ])
+        dados = json.loads(resposta.get_body())
+        
+        assert resposta.status_code == 200
+        assert [r["id"] for r in dados["resultados"]] == ["0", "resumo", "2"]
+        assert all(r["status"] == 200 and r["tempo_ms"] >= 0 for r in dados["resultados"])
+        assert dados["resultados"][2]["resposta"]["num_questoes"] == 3
+        assert dados["falhas"] == 0
+    
+    def test_erros_por_operacao_e_dependencias(self, armazenamento_temporario):
+        """Testa status por operação e o 424 quando a dependência falha"""
+        dados = json.loads(self._lote([
+            {"id": "registro", "rota": "registrar-progresso",
+             "corpo": {"usuario_id": "ana", "materia": "Quimica", "tempo_minutos": 45}},
+            {"id": "dash", "rota": "obter-dashboard", "corpo": {"usuario_id": "ana"}, "depende_de": ["registro"]},
+            {"id": "ruim", "rota": "gerar-simulado", "corpo": {}},
+            {"id": "depois", "rota": "gerar-simulado", "corpo": {"materia": "fisica"}, "depende_de": "ruim"},
+            {"id": "texto", "rota": "importar-progresso", "corpo": '{"materia": "Fisica", "tempo_minutos": 10}',
+             "params": {"usuario_id": "ana"}}
+        ]).get_body())
+        resultados = {r["id"]: r for r in dados["resultados"]}
+        
+        assert resultados["registro"]["status"] == 200
+        assert resultados["dash"]["resposta"]["dashboard"]["estatisticas_gerais"]["total_sessoes"] >= 1
+        assert resultados["ruim"]["status"] == 400
+        assert resultados["depois"]["status"] == 424
+        assert resultados["texto"]["resposta"]["importadas"] == 1
+        assert dados["falhas"] == 2
+    
+    def test_validacao(self):
+        """Testa rotas desconhecidas, ids repetidos e dependências adiante"""
+        for operacoes in (
+            [],
+            [{"rota": "batch", "corpo": {}}],
+            [{"id": "a", "rota": "buscar"}, {"id": "a", "rota": "buscar"}],
+            [{"id": "a", "rota": "buscar", "depende_de": ["b"]}, {"id": "b", "rota": "buscar"}],
+            [{"rota": "buscar"}] * 21
+        ):
+            resposta = self._lote(operacoes)
+            assert resposta.status_code == 400
+            assert json.loads(resposta.get_body())["erro"] == "Lote inválido"
+
+
+class TestHandlersAssincronos:
+    """Testes para os handlers async e a busca sem bloquear o worker"""
+    
+    def _requisicao(self, rota, corpo):
+        return func.HttpRequest("POST", f"/api/{rota}", body=json.dumps(corpo).encode("utf-8"))
+    
+    def test_buscas_lentas_nao_bloqueiam_outras_rotas(self, monkeypatch):
+        """Testa 50 buscas lentas concorrentes e um cronograma no mesmo event loop"""
+        async def busca_lenta(query, max_results=5):
+            await asyncio.sleep(0.2)
+            return simular_busca(query, max_results)
+        monkeypatch.setattr(function_app, "buscar_web_real", busca_lenta)
+        
+        async def cenario():
+            buscas = [asyncio.ensure_future(buscar_web(self._requisicao("buscar", {"query": f"tema {i}"})))
+                      for i in range(50)]
+            inicio = time.perf_counter()
+            cronograma = await gerar_cronograma(self._requisicao("gerar-cronograma", {"materias": ["Física"]}))
+            tempo_cronograma = time.perf_counter() - inicio
+            return cronograma, tempo_cronograma, await asyncio.gather(*buscas)
+        
+        inicio = time.perf_counter()
+        cronograma, tempo_cronograma, buscas = asyncio.run(cenario())
+        total = time.perf_counter() - inicio
+        
+        assert cronograma.status_code == 200
+        assert tempo_cronograma < 0.2
+        assert all(b.status_code == 200 for b in buscas)
+        assert total < 2  # sequencial seria 50 x 0,2 s
+    
+    def test_sessao_http_por_event_loop(self):
+        """Testa que a sessão aiohttp é reaproveitada no loop e recriada em outro"""
+        async def duas_sessoes():
+            a = await function_app.obter_sessao_http()
+            b = await function_app.obter_sessao_http()
+            await a.close()
+            return a, b
+        
+        a, b = asyncio.run(duas_sessoes())
+        c, _ = asyncio.run(duas_sessoes())
+        assert a is b
+        assert c is not a
+    
+    def test_sessao_http_anterior_fechada(self):
+        """Testa que trocar de loop (e encerrar o worker) fecha a sessão anterior"""
+        async def sessao_do_loop():
+            return await function_app.obter_sessao_http()
+        
+        primeira = asyncio.run(sessao_do_loop())
+        segunda = asyncio.run(sessao_do_loop())
+        assert primeira.closed
+        assert not segunda.closed
+        
+        function_app._fechar_sessao_http()
+        assert segunda.closed
+        assert function_app._sessao_http is None
+
+
+@pytest.fixture(scope="module")
+def relatorio():
+    """Medição da importação do function_app num interpretador novo"""
+    return medir_importacao("function_app", repeticoes=2)
+
+
+class TestTempoImportacao:
+    """Testes para o custo de importação do módulo (cold start)"""
+    
+    @pytest.mark.skipif(not os.environ.get("VERIFICAR_ORCAMENTO_IMPORTACAO"),
+                        reason="tempo de parede varia com a máquina; defina VERIFICAR_ORCAMENTO_IMPORTACAO=1")
+    def test_dentro_do_orcamento(self, relatorio):
+        """Testa que importar o function_app cabe no orçamento (opcional)"""
+        assert relatorio["total_ms"] < ORCAMENTO_IMPORTACAO_MS, relatorio["dependencias"][:5]
+    
+    def test_dependencias_adiadas(self, relatorio):
+        """Testa que cliente HTTP e multiprocessing só carregam no primeiro uso"""
+        assert "function_app" in relatorio["modulos_carregados"]
+        for modulo in ("aiohttp", "requests", "multiprocessing"):
+            assert modulo not in relatorio["modulos_carregados"]
+
+
+class TestConteudoEstatico:
+    """Testes para as tabelas de conteúdo montadas na importação"""
+    
+    def test_questoes_sao_visoes_compartilhadas(self):
+        """Testa que o simulado reaproveita visões imutáveis já numeradas"""
+        a = criar_questoes("matematica", 6, "facil", semente=7)
+        b = criar_questoes("matematica", 6, "facil", semente=7)
+        
+        assert [q["numero"] for q in a] == [1, 2, 3, 4, 5, 6]
+        assert all(x is y for x, y in zip(a, b))
+        assert all(q["dificuldade"] == "facil" for q in a)
+        with pytest.raises(TypeError):
+            a[0]["numero"] = 99
+    
+    def test_busca_e_dicas_sem_acentos(self):
+        """Testa consultas acentuadas contra as chaves normalizadas"""
+        assert simular_busca("Matemática básica", 3) == simular_busca("matematica basica", 3)
+        assert simular_busca("Matemática", 1)[0] is BASE_CONHECIMENTO["matematica"][0]
+        assert gerar_dica_estudo("Física", 1).endswith("Desenhe diagramas e esquemas")
+        assert gerar_dica_estudo("Artes", 3) == "Sessão extensa: aprofunde conceitos e faça muitos exercícios"
+    
+    def test_materia_sem_questoes(self):
+        """Testa as questões genéricas de uma matéria fora da base"""
+        questoes = criar_questoes("Astronomia", 3, "dificil")
+        assert [q["numero"] for q in questoes] == [1, 2, 3]
+        assert questoes[0]["enunciado"] == "Questão sobre Astronomia - Em desenvolvimento"
+
+
+class TestMedicaoTempo:
+    """Testes para o Server-Timing e as etapas medidas por requisição"""
+    
+    def _requisicao(self, rota, corpo):
+        return func.HttpRequest("POST", f"/api/{rota}", body=json.dumps(corpo).encode("utf-8"))
+    
+    def _etapas(self, resposta):
+        etapas = {}
+        for item in resposta.headers["Server-Timing"].split(", "):
+            nome, duracao = item.split(";dur=")
+            etapas[nome] = float(duracao)
+        return etapas
+    
+    def test_etapas_do_cronograma(self):
+        """Testa o cabeçalho com as etapas na ordem e o campo de tempo unificado"""
+        resposta = asyncio.run(gerar_cronograma(self._requisicao("gerar-cronograma", {"materias": ["Física"]})))
+        etapas = self._etapas(resposta)
+        
+        assert list(etapas) == ["leitura", "validacao", "geracao", "etag", "serializacao", "total"]
+        assert all(ms >= 0 for ms in etapas.values())
+        assert etapas["total"] >= etapas["geracao"]
+        assert "tempo_resposta_ms" in json.loads(resposta.get_body())
+        
+        simulado = asyncio.run(gerar_simulado(self._requisicao("gerar-simulado", {"materia": "fisica"})))
+        dados = json.loads(simulado.get_body())
+        assert "tempo_resposta_ms" in dados and "response_time_ms" not in dados
+    
+    def test_erro_e_log_estruturado(self, caplog):
+        """Testa o cabeçalho em respostas de erro e os tempos como campos do log"""
+        with caplog.at_level("INFO"):
+            resposta = asyncio.run(gerar_simulado(self._requisicao("gerar-simulado", {})))
+        registro = next(r for r in caplog.records if getattr(r, "rota", None) == "gerar_simulado")
+        
+        assert resposta.status_code == 400
+        assert list(self._etapas(resposta)) == ["leitura", "total"]
+        assert registro.status_code == 400
+        assert set(registro.tempos_ms) == {"leitura", "total"}
+    
+    def test_busca_por_fonte(self, monkeypatch):
+        """Testa uma etapa por fonte externa consultada, mesmo quando ela falha"""
+        async def sem_rede():
+            raise ConnectionError("sem rede")
+        monkeypatch.setattr(function_app, "obter_sessao_http", sem_rede)
+        
+        resposta = asyncio.run(buscar_web(self._requisicao("buscar", {"query": "fotossíntese"})))
+        etapas = self._etapas(resposta)
+        
+        assert resposta.status_code == 200
+        assert {"busca-duckduckgo", "busca-wikipedia"} <= set(etapas)
+    
+    def test_marcar_e_acumular(self):
+        """Testa marcas desde a etapa anterior, nomes repetidos e uso fora de handler"""
+        medicao = MedicaoTempo()
+        with medicao.etapa("a"):
+            time.sleep(0.01)
+        time.sleep(0.01)
+        medicao.marcar("b")
+        with medicao.etapa("a"):
+            time.sleep(0.01)
+        duracoes = medicao.duracoes_ms()
+        
+        assert list(duracoes) == ["a", "b", "total"]
+        assert duracoes["a"] >= 20 and 10 <= duracoes["b"] < 20
+        assert duracoes["total"] >= duracoes["a"] + duracoes["b"]
+        
+        with etapa("fora"):  # sem requisição em andamento não mede nada
+            pass
+        assert function_app._medicao_atual.get() is None
+
+
+class TestMetricas:
+    """Testes para o registro de métricas e a rota /metrics"""
+    
+    def _amostras(self):
+        resposta = asyncio.run(metricas_prometheus(func.HttpRequest("GET", "/api/metrics", body=b"")))
+        assert resposta.status_code == 200
+        assert resposta.mimetype.startswith("text/plain")
+        amostras = {}
+        for linha in resposta.get_body().decode("utf-8").splitlines():
+            if not linha.startswith("#"):
+                chave, valor = linha.rsplit(" ", 1)
+                amostras[chave] = float(valor)
+        return amostras
+    
+    def test_contadores_por_thread(self):
+        """Testa que incrementos concorrentes de várias threads somam sem perdas"""
+        registro = RegistroMetricas()
+        
+        def incrementar():
+            for _ in range(10_000):
+                registro.incrementar("teste_total", rota="a")
+        threads = [threading.Thread(target=incrementar) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        assert registro.coletar()[("teste_total", (("rota", "a"),))] == 40_000
+    
+    def test_histograma_log_linear(self):
+        """Testa baldes cumulativos, soma, contagem e +Inf no formato do Prometheus"""
+        registro = RegistroMetricas()
+        registro.descrever("teste_segundos", "histogram", "Latência de teste")
+        for valor in (0.00015, 0.0003, 0.0003, 0.25, 60):
+            registro.observar("teste_segundos", valor, rota="a")
+        linhas = registro.texto_prometheus().splitlines()
+        
+        assert linhas[:2] == ["# HELP teste_segundos Latência de teste", "# TYPE teste_segundos histogram"]
+        assert 'teste_segundos_bucket{rota="a",le="0.0001"} 0' in linhas
+        assert 'teste_segundos_bucket{rota="a",le="0.0002"} 1' in linhas
+        assert 'teste_segundos_bucket{rota="a",le="0.0003"} 3' in linhas
+        assert 'teste_segundos_bucket{rota="a",le="0.3"} 4' in linhas
+        assert 'teste_segundos_bucket{rota="a",le="10.0"} 4' in linhas
+        assert 'teste_segundos_bucket{rota="a",le="+Inf"} 5' in linhas
+        assert 'teste_segundos_count{rota="a"} 5' in linhas
+    
+    def test_requisicoes_e_caches(self):
+        """Testa contagem e latência por rota, acertos de cache e profundidade de fila"""
+        antes = self._amostras()
+        req = func.HttpRequest("POST", "/api/gerar-cronograma", body=json.dumps({"materias": ["Biologia"]}).encode("utf-8"))
+        for _ in range(2):
+            asyncio.run(gerar_cronograma(req))
+        simular_busca("métricas de cache", 3)
+        simular_busca("métricas de cache", 3)
+        depois = self._amostras()
+        
+        def delta(chave):
+            return depois.get(chave, 0) - antes.get(chave, 0)
+        assert delta('estudai_requisicoes_total{rota="gerar_cronograma",status="200"}') == 2
+        assert delta('estudai_requisicao_duracao_segundos_count{rota="gerar_cronograma"}') == 2
+        assert depois['estudai_requisicoes_em_andamento{rota="gerar_cronograma"}'] == 0
+        assert delta('estudai_cache_consultas_total{cache="busca",resultado="acerto"}') >= 1
+        assert delta('estudai_cache_consultas_total{cache="etag",resultado="acerto"}') == 1
+        assert 0 <= depois['estudai_cache_taxa_acerto{cache="busca"}'] <= 1
+        assert 'estudai_fila_profundidade{fila="progresso"}' in depois
+    
+    def test_buscas_externas_por_resultado(self, monkeypatch):
+        """Testa a contagem de timeout e falha por fonte de busca"""
+        erros = iter([asyncio.TimeoutError(), ConnectionError("sem rede")])
+        
+        async def sessao_com_erro():
+            raise next(erros)
+        monkeypatch.setattr(function_app, "obter_sessao_http", sessao_com_erro)
+        
+        antes = self._amostras()
+        asyncio.run(buscar_web(func.HttpRequest("POST", "/api/buscar", body=b'{"query": "energia"}')))
+        depois = self._amostras()
+        
+        for chave in ('estudai_busca_externa_total{fonte="duckduckgo",resultado="timeout"}',
+                      'estudai_busca_externa_total{fonte="wikipedia",resultado="falha"}',
+                      'estudai_busca_externa_duracao_segundos_count{fonte="wikipedia"}'):
+            assert depois[chave] - antes.get(chave, 0) == 1
+
+
 class TestIntegracaoNovasFuncoes:
     """Testes de integração para as novas funcionalidades"""
     